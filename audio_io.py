@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""Потоковое декодирование аудио в 16 кГц моно float32 с ограниченной памятью."""
+import os
+import json
+import shutil
+import time
+import struct
+import hashlib
+import logging
+import subprocess
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+import soundfile as sf
+
+from journal import file_sha256
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+DECODE_BLOCK_SEC = 30.0  # Размер блока при чтении и декодировании
+DECODED_DIR = Path("decoded")  # Промежуточные 16 кГц WAV (исходные файлы не трогаем)
+
+
+def _native_info(audio_path: Path):
+    """Возвращает sf.info, если файл читается soundfile напрямую, иначе None."""
+    try:
+        return sf.info(str(audio_path))
+    except RuntimeError:
+        return None
+
+
+def iter_decoded_blocks(audio_path: Path, block_sec: float = DECODE_BLOCK_SEC):
+    """Отдаёт аудио блоками 16 кГц моно float32, не загружая файл целиком.
+
+    Файлы, которые soundfile читает сам и которые уже в 16 кГц, читаются блоками
+    напрямую; всё остальное (mp3, другие частоты) декодируется и ресемплируется
+    потоково через ffmpeg.
+    """
+    block = int(block_sec * SAMPLE_RATE)
+    info = _native_info(audio_path)
+    if info is not None and info.samplerate == SAMPLE_RATE:
+        for chunk in sf.blocks(str(audio_path), blocksize=block, dtype="float32", always_2d=True):
+            yield chunk.mean(axis=1, dtype=np.float32) if chunk.shape[1] > 1 else chunk[:, 0]
+        return
+
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("Для декодирования нужен ffmpeg в PATH")
+    cmd = [ffmpeg, "-nostdin", "-loglevel", "error", "-i", str(audio_path),
+           "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    completed = False
+    try:
+        while True:
+            data = proc.stdout.read(block * 4)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+        completed = True
+    finally:
+        if not completed:
+            # Потребитель остановился раньше конца файла
+            proc.kill()
+        proc.stdout.close()
+        stderr = proc.stderr.read().decode("utf-8", errors="replace")
+        proc.stderr.close()
+        returncode = proc.wait()
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg не смог декодировать {audio_path.name}: {stderr.strip()}")
+
+
+def is_native(audio_path: Path) -> bool:
+    """Можно ли использовать файл как есть (WAV 16 кГц моно float32, пригодный для memmap)."""
+    if audio_path.suffix.lower() != ".wav":
+        return False
+    info = _native_info(audio_path)
+    return (info is not None and info.samplerate == SAMPLE_RATE and info.channels == 1
+            and info.subtype == "FLOAT")
+
+
+def _source_stat(audio_path: Path) -> dict:
+    stat = audio_path.stat()
+    return {"path": str(audio_path.resolve()), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def decoded_path(audio_path: Path, decoded_dir: Path = DECODED_DIR) -> Path:
+    """Путь декодированного WAV: decoded_dir/<хэш пути, размера и mtime исходника>/<имя>.wav.
+
+    Папка по хэшу разводит одноимённые файлы из разных папок (и a.mp3 с a.ogg), а
+    имя файла остаётся прежним — по нему называются результаты и записи манифеста.
+    """
+    source = _source_stat(audio_path)
+    key = hashlib.sha1(f"{source['path']}|{source['size']}|{source['mtime_ns']}".encode("utf-8")).hexdigest()[:16]
+    return decoded_dir / key / (audio_path.stem + ".wav")
+
+
+def _source_record(wav_path: Path) -> Path:
+    return wav_path.with_name(wav_path.name + ".source.json")
+
+
+def _prune_stale(source: dict, keep: Path, decoded_dir: Path):
+    """Удаляет папки прежних версий того же исходника (другой размер или mtime → другой хэш)."""
+    for folder in decoded_dir.iterdir():
+        if folder == keep or not folder.is_dir():
+            continue
+        for record in folder.glob("*.source.json"):
+            try:
+                with open(record, "r", encoding="utf-8") as f:
+                    stale = json.load(f).get("path") == source["path"]
+            except (OSError, ValueError, AttributeError):
+                continue
+            if stale:
+                logger.info(f"🧹 Удаляю устаревший декодированный WAV: {folder.name}/{record.name[:-len('.source.json')]}")
+                shutil.rmtree(folder, ignore_errors=True)
+                break
+
+
+def decode_to_wav(audio_path: Path, decoded_dir: Path = DECODED_DIR) -> Path:
+    """Потоково пишет 16 кГц моно float32 WAV в decoded_dir и возвращает путь к нему.
+
+    Рядом с WAV сохраняется запись об исходнике (путь, размер, mtime_ns); WAV
+    переиспользуется, только если она совпадает с текущим исходником. Запись идёт во
+    временный файл с атомарной заменой, поэтому недописанный WAV не попадёт в кэш.
+    После записи удаляются WAV прежних версий этого исходника.
+    """
+    if is_native(audio_path):
+        return audio_path
+
+    wav_path = decoded_path(audio_path, decoded_dir)
+    source = _source_stat(audio_path)
+    record = _source_record(wav_path)
+    try:
+        with open(record, "r", encoding="utf-8") as f:
+            reusable = json.load(f) == source and wav_path.exists()
+    except (OSError, ValueError):
+        reusable = False
+    if reusable:
+        logger.info(f"♻️ Уже декодирован: {wav_path.name}")
+        return wav_path
+
+    logger.info(f">> Декодирование {audio_path.name} в 16 кГц WAV...")
+    wav_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = wav_path.with_name(f".{wav_path.stem}.{os.getpid()}.tmp.wav")
+    tmp_record = record.with_name(f".{record.name}.{os.getpid()}.tmp")
+    try:
+        with sf.SoundFile(str(tmp_path), "w", samplerate=SAMPLE_RATE, channels=1, subtype="FLOAT") as f:
+            for block in iter_decoded_blocks(audio_path):
+                f.write(block)
+        os.replace(tmp_path, wav_path)
+        with open(tmp_record, "w", encoding="utf-8") as f:
+            json.dump(source, f, ensure_ascii=False)
+        os.replace(tmp_record, record)
+    finally:
+        for path in (tmp_path, tmp_record):
+            if path.exists():
+                path.unlink()
+    _prune_stale(source, wav_path.parent, decoded_dir)
+    logger.info(f"✅ Сохранено: {wav_path.name}")
+    return wav_path
+
+
+def timed_decode(audio_path: Path, decoded_dir: Path = DECODED_DIR) -> tuple:
+    """decode_to_wav, возвращающий (путь к WAV, секунды декодирования); удобен для пула процессов."""
+    started = time.perf_counter()
+    wav_path = decode_to_wav(audio_path, decoded_dir)
+    return wav_path, time.perf_counter() - started
+
+
+def _decode_job(audio_path: Path, decoded_dir: Path, digest: bool) -> tuple:
+    """timed_decode и, при digest, SHA-256 исходника: (путь к WAV, секунды, дайджест или None)."""
+    wav_path, seconds = timed_decode(audio_path, decoded_dir)
+    return wav_path, seconds, file_sha256(audio_path) if digest else None
+
+
+def decode_many(audio_files: list, workers: int = 2, decoded_dir: Path = DECODED_DIR, digest: bool = False):
+    """Декодирует файлы в пуле процессов и отдаёт (исходный файл, WAV, ошибка, секунды, SHA-256) по мере готовности.
+
+    Воркеры возвращают только путь к WAV — само аудио родитель открывает через
+    open_shared_audio(), без копирования массивов между процессами. Одновременно в
+    работе не больше 2 × workers файлов. audio_files читаются лениво, по мере
+    освобождения места, поэтому подходит и генератор (захват файлов из общей
+    очереди shard.py). С digest воркеры заодно считают SHA-256 исходника для
+    журнала (иначе вместо дайджеста None).
+    """
+    pending = iter(audio_files)
+    if workers <= 1:
+        for audio_file in pending:
+            try:
+                wav_path, seconds, sha256 = _decode_job(audio_file, decoded_dir, digest)
+            except Exception as e:
+                yield audio_file, None, e, 0.0, None
+            else:
+                yield audio_file, wav_path, None, seconds, sha256
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        exhausted = False
+        while not exhausted or in_flight:
+            while not exhausted and len(in_flight) < 2 * workers:
+                audio_file = next(pending, None)
+                if audio_file is None:
+                    exhausted = True
+                    break
+                in_flight[pool.submit(_decode_job, audio_file, decoded_dir, digest)] = audio_file
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                audio_file = in_flight.pop(future)
+                try:
+                    wav_path, seconds, sha256 = future.result()
+                except Exception as e:
+                    yield audio_file, None, e, 0.0, None
+                else:
+                    yield audio_file, wav_path, None, seconds, sha256
+
+
+def _float_wav_data(wav_path: Path):
+    """Ищет в RIFF/WAVE блок данных float32 моно 16 кГц: возвращает (смещение, число отсчётов) или None."""
+    with open(wav_path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        fmt_ok = False
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"fmt ":
+                fmt = f.read(size)
+                tag, channels, rate = struct.unpack("<HHI", fmt[:8])
+                bits = struct.unpack("<H", fmt[14:16])[0]
+                if tag == 0xFFFE and size >= 26:  # WAVE_FORMAT_EXTENSIBLE: настоящий тег в SubFormat
+                    tag = struct.unpack("<H", fmt[24:26])[0]
+                fmt_ok = tag == 3 and channels == 1 and rate == SAMPLE_RATE and bits == 32
+                f.seek(size % 2, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if not fmt_ok:
+                    return None
+                offset = f.tell()
+                available = os.path.getsize(wav_path) - offset
+                return offset, min(size, available) // 4
+            else:
+                f.seek(size + size % 2, os.SEEK_CUR)
+
+
+def open_shared_audio(wav_path: Path) -> np.ndarray:
+    """Открывает 16 кГц аудио как float32-массив, общий для всех стадий обработки.
+
+    Float32 WAV отображается в память (copy-on-write) прямо из файла, который читают
+    и стадии NeMo по манифесту, поэтому срезы сегментов — это представления без
+    копирования, а страницы файла делятся через кэш ОС. Другие WAV читаются один
+    раз в float32.
+    """
+    layout = _float_wav_data(wav_path)
+    if layout is not None:
+        offset, frames = layout
+        if frames == 0:
+            return np.zeros(0, dtype=np.float32)
+        return np.memmap(wav_path, dtype="<f4", mode="c", offset=offset, shape=(frames,))
+    audio, sample_rate = sf.read(str(wav_path), dtype="float32", always_2d=True)
+    if sample_rate != SAMPLE_RATE:
+        raise ValueError(f"Аудио должно быть 16kHz, а не {sample_rate}Hz")
+    return audio.mean(axis=1, dtype=np.float32) if audio.shape[1] > 1 else audio[:, 0]
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""Размер пакетов по свободной памяти и восстановление после нехватки памяти.
+
+BatchSizer хранит для одного вида работы (ASR, эмбеддинги диаризатора) цену
+секунды аудио — сколько МБ активаций занимает секунда аудио в пакете (с учётом
+паддинга). Бюджет пакета = свободная память × BATCH_MEMORY_FRACTION / цена.
+После каждого пакета цена уточняется по пиковой памяти, а при OOM поднимается
+так, чтобы пакет того же размера больше не выбирался, и пакет повторяется
+половинного размера (run_adaptive).
+
+На GPU свободная память — это свободная память устройства плюс кэш аллокатора
+torch, на CPU — MemAvailable хоста, ограниченная бюджетом RSS (CPU_RSS_BUDGET_MB).
+"""
+import os
+import sys
+import logging
+import threading
+import contextlib
+
+from metrics import BATCH_OOM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+BATCH_MEMORY_FRACTION = float(os.environ.get("BATCH_MEMORY_FRACTION", "0.7"))  # Доля свободной памяти под пакет
+CPU_RSS_BUDGET_MB = int(os.environ.get("CPU_RSS_BUDGET_MB", "0"))  # 0 — без ограничения сверх памяти хоста
+MIN_BATCH_SECONDS = 1.0
+# Начальная цена секунды аудио (МБ); уточняется по первым же пакетам
+INITIAL_COST_MB_PER_SEC = {"asr": 40.0, "embeddings": 25.0}
+COST_DECAY = 0.8  # Как быстро цена снижается, если пакеты обходятся дешевле оценки
+
+_sizers = {}
+_sizers_lock = threading.Lock()
+# Пик памяти (VmHWM, пиковая статистика CUDA) общий на процесс: одновременно его меряет только один пакет
+_measure_lock = threading.Lock()
+_END = object()
+
+
+def is_oom(error: BaseException) -> bool:
+    """Ошибка нехватки памяти: CUDA OOM, отказ CPU-аллокатора torch или MemoryError."""
+    if isinstance(error, MemoryError):
+        return True
+    torch = sys.modules.get("torch")
+    if torch is not None and isinstance(error, getattr(torch.cuda, "OutOfMemoryError", ())):
+        return True
+    message = str(error)
+    return isinstance(error, RuntimeError) and ("out of memory" in message or "can't allocate memory" in message)
+
+
+def release_memory(device: str):
+    """Отдаёт кэш аллокатора CUDA — только после OOM, чтобы повтор начался с чистой памяти."""
+    torch = sys.modules.get("torch")
+    if device != "cpu" and torch is not None:
+        torch.cuda.empty_cache()
+
+
+def available_mb(device: str) -> float:
+    """Память, которую может занять следующий пакет."""
+    if device != "cpu":
+        import torch
+        free, _ = torch.cuda.mem_get_info()
+        # Кэш аллокатора torch переиспользуется без обращения к драйверу
+        cached = torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+        return (free + cached) / 2 ** 20
+    available = _host_available_mb()
+    if CPU_RSS_BUDGET_MB > 0:
+        available = min(available, CPU_RSS_BUDGET_MB - _rss_mb())
+    return max(0.0, available)
+
+
+def _host_available_mb() -> float:
+    try:
+        with open("/proc/meminfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    import psutil
+    return psutil.virtual_memory().available / 2 ** 20
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        import psutil
+        return psutil.Process().memory_info().rss / 2 ** 20
+
+
+def _reset_peak_rss() -> bool:
+    """Сбрасывает пиковый RSS процесса (VmHWM) — на Linux через /proc/self/clear_refs."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb() -> float:
+    with open("/proc/self/status", "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 2 ** 10
+    raise OSError("VmHWM не найден")
+
+
+class BatchSizer:
+    """Бюджет пакета для одного вида работы на одном устройстве (см. описание модуля)."""
+
+    def __init__(self, kind: str, device: str, cost_mb_per_sec: float):
+        self.kind = kind
+        self.device = device
+        self.cost_mb_per_sec = cost_mb_per_sec
+        self._lock = threading.Lock()
+
+    def budget(self, max_seconds: float = None) -> float:
+        """Секунды аудио (с паддингом) на следующий пакет; не больше max_seconds."""
+        seconds = available_mb(self.device) * BATCH_MEMORY_FRACTION / self.cost_mb_per_sec
+        if max_seconds is not None:
+            seconds = min(seconds, max_seconds)
+        return max(MIN_BATCH_SECONDS, seconds)
+
+    def items(self, item_seconds: float, max_items: int = None) -> int:
+        """Число одинаковых элементов по item_seconds секунд в пакете."""
+        count = max(1, int(self.budget() // item_seconds))
+        return min(count, max_items) if max_items is not None else count
+
+    @contextlib.contextmanager
+    def measure(self, seconds: float):
+        """Уточняет цену секунды по пиковой памяти пакета из seconds секунд аудио.
+
+        Сброс и чтение пика — на весь процесс, поэтому пакеты, которые идут
+        одновременно с уже измеряемым (эмбеддинги диаризатора и ASR по сегментам),
+        выполняются без замера, и цену не меняют.
+        """
+        if not _measure_lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            peak_mb = self._start_peak()
+            yield
+            used = self._peak_growth(peak_mb)
+        finally:
+            _measure_lock.release()
+        if used is not None and seconds > 0:
+            with self._lock:
+                observed = used / seconds
+                if observed > self.cost_mb_per_sec:
+                    self.cost_mb_per_sec = observed
+                else:
+                    self.cost_mb_per_sec = COST_DECAY * self.cost_mb_per_sec + (1 - COST_DECAY) * observed
+
+    def oom(self, seconds: float):
+        """Пакет из seconds секунд не поместился: цена растёт так, чтобы бюджет стал не больше половины."""
+        with self._lock:
+            self.cost_mb_per_sec = max(self.cost_mb_per_sec * 2,
+                                       available_mb(self.device) * BATCH_MEMORY_FRACTION * 2 / seconds)
+        BATCH_OOM_RETRIES.inc(kind=self.kind)
+
+    def _start_peak(self):
+        if self.device != "cpu":
+            import torch
+            torch.cuda.reset_peak_memory_stats()
+            return torch.cuda.memory_allocated() / 2 ** 20
+        if not _reset_peak_rss():
+            return None
+        return _rss_mb()
+
+    def _peak_growth(self, start_mb):
+        if start_mb is None:
+            return None
+        if self.device != "cpu":
+            import torch
+            return max(0.0, torch.cuda.max_memory_allocated() / 2 ** 20 - start_mb)
+        try:
+            return max(0.0, _peak_rss_mb() - start_mb)
+        except OSError:
+            return None
+
+
+def get_sizer(kind: str, device: str) -> BatchSizer:
+    """Общий на процесс BatchSizer для вида работы (asr, embeddings) и устройства."""
+    with _sizers_lock:
+        key = (kind, device)
+        if key not in _sizers:
+            _sizers[key] = BatchSizer(kind, device, INITIAL_COST_MB_PER_SEC.get(kind, 40.0))
+        return _sizers[key]
+
+
+def run_adaptive(items, run_batch, sizer: BatchSizer, item_seconds, max_seconds: float = None,
+                 max_items: int = None):
+    """Вызывает run_batch(пакет) для последовательных пакетов items, размер которых задаёт sizer.
+
+    Пакет набирается, пока (самый длинный элемент × число элементов) укладывается
+    в бюджет, но не больше max_items. При OOM тот же пакет повторяется вдвое
+    меньшим; OOM на одном элементе пробрасывается. items читаются лениво, поэтому
+    подходят и генераторы (окна длинной записи).
+    """
+    source = iter(items)
+    buffer = []
+    limit = max_items
+    while True:
+        budget = sizer.budget(max_seconds)
+        batch, longest = [], 0.0
+        while limit is None or len(batch) < limit:
+            if len(batch) == len(buffer):
+                item = next(source, _END)
+                if item is _END:
+                    break
+                buffer.append(item)
+            candidate = max(longest, item_seconds(buffer[len(batch)]))
+            if batch and candidate * (len(batch) + 1) > budget:
+                break
+            batch.append(buffer[len(batch)])
+            longest = candidate
+        if not batch:
+            return
+        padded = longest * len(batch)
+        try:
+            with sizer.measure(padded):
+                run_batch(batch)
+        except Exception as e:
+            if len(batch) == 1 or not is_oom(e):
+                raise
+            release_memory(sizer.device)
+            sizer.oom(padded)
+            limit = len(batch) // 2
+            logger.warning(f"⚠️ Нехватка памяти на пакете {sizer.kind} ({len(batch)} шт., {padded:.0f} с), "
+                           f"повтор по {limit}")
+            continue
+        del buffer[:len(batch)]
+        limit = max_items
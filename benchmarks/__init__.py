@@ -0,0 +1 @@
+"""Бенчмарки производительности. Запускаются из корня репозитория: python -m benchmarks.<имя>."""
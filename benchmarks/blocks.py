@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Память и время диаризации целиком (run_diarization) против блочной (diarize_long) по длине записи.
+
+Каждый замер — отдельный процесс, поэтому пиковая память честная. Кроме RTF и
+пиковой памяти выводится число найденных спикеров (в синтетических записях их
+--speakers): при удачном связывании блоков оно не растёт с длиной записи.
+С заглушками моделей (--backend stub) замер показывает накладные расходы
+блоков; квадратичный рост кластеризации виден на настоящем диаризаторе
+(--backend nemo).
+
+Запуск из корня репозитория:
+    python -m benchmarks.blocks --backend nemo --durations 600 1800 3600 7200 --block_sec 600
+"""
+import time
+import json
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import peak_rss_mb, write_synthetic_speech, run_child, print_table
+
+MODES = ("whole", "blocks")
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def child(args):
+    import torch
+    import main
+
+    main.set_backend(args.backend)
+    diarizer = main.load_diarizer()
+    rss_after_load = peak_rss_mb()
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+
+    started = time.perf_counter()
+    if args.mode == "whole":
+        segments = main.run_diarization(args.audio, diarizer)
+    else:
+        plan = main.load_block_diarization()._replace(block_sec=args.block_sec, blocks_per_run=args.blocks_per_run)
+        segments = main.diarize_long(args.audio, diarizer, plan)
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        "elapsed": elapsed,
+        "rtf": elapsed / args.duration,
+        "speakers": len({speaker for _, _, speaker in segments}),
+        "segments": len(segments),
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_growth_mb": peak_rss_mb() - rss_after_load,
+        "peak_vram_mb": torch.cuda.max_memory_allocated() / 2 ** 20 if torch.cuda.is_available() else None,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Whole-recording vs block-wise diarization scaling benchmark")
+    parser.add_argument("--backend", default="stub", help="Model backend (stub or nemo)")
+    parser.add_argument("--durations", type=float, nargs="+", default=[600, 1800, 3600])
+    parser.add_argument("--speakers", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--block_sec", type=float, default=600.0)
+    parser.add_argument("--blocks_per_run", type=int, default=4)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--audio", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--duration", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    common = ["--backend", args.backend, "--block_sec", args.block_sec, "--blocks_per_run", args.blocks_per_run]
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # Рабочая папка замеров — временная, чтобы их results/ не смешивались с настоящими
+        shutil.copy2(REPO_ROOT / "diarizer_config.yaml", Path(tmp) / "diarizer_config.yaml")
+        for duration in args.durations:
+            audio = write_synthetic_speech(Path(tmp) / f"bench_{int(duration)}s.wav", duration, args.speakers)
+            for mode in args.modes:
+                try:
+                    result = run_child("benchmarks.blocks", common + ["--mode", mode, "--audio", audio,
+                                                                      "--duration", duration], cwd=tmp)
+                except RuntimeError as e:
+                    # Диаризация целиком на длинных записях может упасть по OOM — это тоже результат
+                    result = {"error": str(e).splitlines()[-1]}
+                rows.append({"duration_s": duration, "mode": mode, **result})
+                print(json.dumps(rows[-1]), flush=True)
+
+    print()
+    print(f"Спикеров в записях: {args.speakers}")
+    print_table(rows, ["duration_s", "mode", "rtf", "speakers", "segments", "peak_rss_mb", "rss_growth_mb",
+                       "peak_vram_mb", "error"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Общие утилиты бенчмарков: синтетическое аудио, замер пиковой памяти, запуск замеров в отдельных процессах."""
+import os
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+SAMPLE_RATE = 16000
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS текущего процесса в МБ."""
+    if sys.platform == "win32":
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт КБ, macOS — байты
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def write_synthetic_speech(path: Path, duration_sec: float, num_speakers: int = 2, seed: int = 0,
+                           block_sec: float = 10.0) -> Path:
+    """Пишет «речеподобный» сигнал блоками, не держа весь файл в памяти.
+
+    Каждый спикер — гармонический тон со своей основной частотой; реплики случайной
+    длины чередуются с паузами.
+    """
+    rng = np.random.default_rng(seed)
+    pitches = np.linspace(110, 260, num_speakers)
+    total = int(duration_sec * SAMPLE_RATE)
+    block = int(block_sec * SAMPLE_RATE)
+
+    # Расписание реплик: (конец в отсчётах, спикер или -1 для паузы)
+    schedule, pos = [], 0
+    while pos < total:
+        pos += int(rng.uniform(1.0, 6.0) * SAMPLE_RATE)
+        schedule.append((pos, int(rng.integers(num_speakers))))
+        pos += int(rng.uniform(0.2, 1.0) * SAMPLE_RATE)
+        schedule.append((pos, -1))
+
+    ends = np.array([end for end, _ in schedule])
+    labels = np.array([speaker for _, speaker in schedule] + [-1])
+
+    with sf.SoundFile(str(path), "w", samplerate=SAMPLE_RATE, channels=1, subtype="PCM_16") as f:
+        for offset in range(0, total, block):
+            idx = offset + np.arange(min(block, total - offset))
+            t = idx / SAMPLE_RATE
+            speakers = labels[np.searchsorted(ends, idx, side="right")]
+            f0 = pitches[np.maximum(speakers, 0)]
+            signal = sum(np.sin(2 * np.pi * f0 * h * t) / h for h in (1, 2, 3))
+            envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4.0 * t)  # ~4 слога в секунду
+            audio = np.where(speakers >= 0, 0.3 * signal * envelope, 0.0)
+            audio += 0.005 * rng.standard_normal(len(idx))
+            f.write(audio.astype(np.float32))
+    return path
+
+
+def run_child(module: str, args: list, cwd: Path = None, env: dict = None) -> dict:
+    """Запускает замер в отдельном процессе (чтобы пик памяти был честным) и возвращает его JSON.
+
+    cwd — рабочая папка процесса (относительные папки audio, results, cache окажутся
+    в ней); корень репозитория добавляется в PYTHONPATH, env дополняет окружение.
+    """
+    cmd = [sys.executable, "-m", module, "--child"] + [str(a) for a in args]
+    child_env = dict(os.environ, **(env or {}))
+    repo_root = str(Path(__file__).resolve().parent.parent)
+    child_env["PYTHONPATH"] = os.pathsep.join(filter(None, [repo_root, child_env.get("PYTHONPATH")]))
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="replace",
+                            cwd=cwd, env=child_env)
+    if result.returncode != 0:
+        raise RuntimeError(f"Замер завершился с ошибкой:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def print_table(rows: list, columns: list):
+    """Печатает результаты замеров выровненной таблицей."""
+    widths = [max(len(col), *(len(_fmt(row.get(col))) for row in rows)) for col in columns]
+    print("  ".join(col.ljust(w) for col, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(_fmt(row.get(col)).ljust(w) for col, w in zip(columns, widths)))
+
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return "-" if value is None else str(value)
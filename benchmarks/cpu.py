@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Точность против RTF вариантов CPU-бэкенда (int8, экспорт, bf16) относительно fp32.
+
+Каждый вариант — отдельный процесс с бэкендом cpu и своими параметрами; все
+распознают одни и те же файлы (по умолчанию папку audio). WER (jiwer) считается
+против гипотез fp32 (wer_vs_fp32: сколько качества стоит ускорение) и,
+если рядом с аудио лежит эталон <имя>.txt, против него (wer_vs_ref). Первый файл
+распознаётся один раз вхолостую, чтобы RTF не включал прогрев.
+
+Запуск из корня репозитория:
+    python -m benchmarks.cpu --language en --ctc --model_name stt_en_conformer_ctc_small --threads 8
+"""
+import os
+import time
+import json
+import argparse
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import peak_rss_mb, run_child, print_table
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg")
+REPO_ROOT = Path(__file__).resolve().parent.parent
+VARIANTS = {
+    "fp32": {"quantize": "none"},
+    "int8": {"quantize": "int8"},
+    "int8_torchscript": {"quantize": "int8", "export": "torchscript"},
+    "fp32_onnx": {"quantize": "none", "export": "onnx"},
+    "int8_onnx": {"quantize": "int8", "export": "onnx"},
+    "bf16": {"quantize": "none", "bf16": True},
+}
+
+
+def child(args):
+    import soundfile as sf
+    import main
+
+    options = dict(VARIANTS[args.variant], threads=args.threads, interop_threads=args.interop_threads)
+    main.set_backend("cpu", **options)
+    started = time.perf_counter()
+    asr_model = main.load_asr_model(args.language, "transducer" if args.transducer else "ctc", args.model_name)
+    model_load_s = time.perf_counter() - started
+
+    wav_paths = [main.convert_to_wav(audio) for audio in args.audio]
+    main.transcribe_audio(wav_paths[0], asr_model)  # Прогрев
+    texts, elapsed, duration = {}, 0.0, 0.0
+    for audio, wav_path in zip(args.audio, wav_paths):
+        started = time.perf_counter()
+        texts[audio.name] = main.transcribe_audio(wav_path, asr_model)
+        elapsed += time.perf_counter() - started
+        duration += sf.info(str(wav_path)).duration
+
+    print(json.dumps({
+        "model_load_s": model_load_s,
+        "elapsed": elapsed,
+        "rtf": elapsed / duration,
+        "peak_rss_mb": peak_rss_mb(),
+        "bf16": main.get_backend().bf16,
+        "texts": texts,
+    }, ensure_ascii=False))
+
+
+def wer(references: dict, hypotheses: dict) -> float:
+    """WER по словам (без учёта регистра) по всем файлам, для которых есть эталон; None, если эталонов нет."""
+    import jiwer
+    pairs = [(reference.lower(), hypotheses[name].lower()) for name, reference in references.items()
+             if name in hypotheses and reference.strip()]
+    if not pairs:
+        return None
+    return jiwer.wer([reference for reference, _ in pairs], [hypothesis for _, hypothesis in pairs])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU backend accuracy vs RTF benchmark")
+    parser.add_argument("--language", choices=["ru", "en"], default="ru")
+    parser.add_argument("--transducer", action="store_true")
+    parser.add_argument("--ctc", action="store_true")
+    parser.add_argument("--model_name", required=True)
+    parser.add_argument("--audio_dir", type=Path, default=Path("audio"),
+                        help="Benchmark audio; optional reference transcripts as <name>.txt next to each file")
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads (0 = torch default)")
+    parser.add_argument("--interop_threads", type=int, default=0)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--variant", choices=list(VARIANTS), help=argparse.SUPPRESS)
+    parser.add_argument("--audio", type=Path, nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    audio_files = sorted(f.resolve() for f in args.audio_dir.iterdir() if f.suffix.lower() in AUDIO_EXTENSIONS)
+    if not audio_files:
+        raise SystemExit(f"❌ В папке {args.audio_dir} нет аудиофайлов")
+    references = {f.name: f.with_suffix(".txt").read_text(encoding="utf-8")
+                  for f in audio_files if f.with_suffix(".txt").exists()}
+    # fp32 — опорный вариант для wer_vs_fp32 и speedup, поэтому идёт первым
+    variants = ["fp32"] + [variant for variant in args.variants if variant != "fp32"]
+
+    common = ["--language", args.language, "--model_name", args.model_name, "--threads", args.threads,
+              "--interop_threads", args.interop_threads, "--audio", *audio_files]
+    common += ["--transducer"] if args.transducer else ["--ctc"]
+    # Экспортированные энкодеры и чекпойнты кэшируются в общей папке моделей, а не во временной
+    env = {"ASR_MODELS_DIR": str(Path(os.environ.get("ASR_MODELS_DIR", REPO_ROOT / "models")).resolve())}
+    rows, baseline = [], None
+    with tempfile.TemporaryDirectory() as tmp:
+        for variant in variants:
+            try:
+                result = run_child("benchmarks.cpu", common + ["--variant", variant], cwd=tmp, env=env)
+            except RuntimeError as e:
+                rows.append({"variant": variant, "error": str(e).splitlines()[-1]})
+                print(json.dumps(rows[-1], ensure_ascii=False), flush=True)
+                continue
+            texts = result.pop("texts")
+            if variant == "fp32":
+                baseline = texts
+            row = {"variant": variant, **result}
+            row["wer_vs_fp32"] = wer(baseline, texts) if baseline is not None else None
+            row["wer_vs_ref"] = wer(references, texts)
+            if baseline is not None:
+                row["speedup"] = rows[0]["rtf"] / row["rtf"] if rows else 1.0
+            rows.append(row)
+            print(json.dumps(row, ensure_ascii=False), flush=True)
+
+    print()
+    print(f"Файлов: {len(audio_files)}, с эталоном: {len(references)}")
+    print_table(rows, ["variant", "rtf", "speedup", "wer_vs_fp32", "wer_vs_ref", "model_load_s", "peak_rss_mb",
+                       "bf16", "error"])
+
+
+if __name__ == "__main__":
+    main()
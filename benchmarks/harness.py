@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""RTF, пиковая память и скорость по сегментам для основных стадий обработки.
+
+Стадии: convert (convert_to_wav), transcribe (transcribe_audio), gated
+(transcribe_gated — ASR только по участкам речи), diarize
+(diarize_and_transcribe) и server (загрузка, задание и SSE-поток веб-сервера).
+По умолчанию используются CPU-заглушки моделей (benchmarks/stubs.py), поэтому
+набор работает без GPU и сети. Каждый замер идёт в отдельном процессе со своей
+рабочей папкой.
+
+Запуск из корня репозитория:
+    python -m benchmarks.harness --durations 60 600 --speakers 2 --save_baseline bench_baseline.json
+    python -m benchmarks.harness --durations 60 600 --speakers 2 --baseline bench_baseline.json
+"""
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import peak_rss_mb, write_synthetic_speech, run_child, print_table
+
+STAGES = ("convert", "transcribe", "gated", "diarize", "server")
+COLUMNS = ["duration_s", "stage", "elapsed", "rtf", "segments", "segments_per_s", "vad_skipped", "calls_saved",
+           "model_load_s", "peak_rss_mb", "rss_growth_mb", "error"]
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def child(args):
+    import main
+    from main import (convert_to_wav, load_asr_model, load_diarizer, transcribe_audio, transcribe_gated,
+                      diarize_and_transcribe)
+
+    main.set_backend(args.backend)
+    source = Path("audio") / args.audio_name
+    segments = []
+    model_load = 0.0
+    skipped = None
+    plan = {}
+
+    if args.stage == "convert":
+        shutil.rmtree("decoded", ignore_errors=True)
+        rss_before = peak_rss_mb()
+        started = time.perf_counter()
+        convert_to_wav(source)
+        elapsed = time.perf_counter() - started
+    elif args.stage == "server":
+        rss_before, elapsed, model_load, segments = _run_server(args, source)
+    else:
+        wav_path = convert_to_wav(source)
+        t0 = time.perf_counter()
+        asr_model = load_asr_model(args.language, args.model_type, args.model_name)
+        diarizer = load_diarizer() if args.stage in ("gated", "diarize") else None
+        model_load = time.perf_counter() - t0
+        rss_before = peak_rss_mb()
+        started = time.perf_counter()
+        if args.stage == "transcribe":
+            segments = transcribe_audio(wav_path, asr_model).split()
+        elif args.stage == "gated":
+            text, skipped = transcribe_gated(wav_path, asr_model, diarizer)
+            segments = text.splitlines()
+        else:
+            def progress(event, **data):
+                if event == "segment":
+                    segments.append(data)
+                elif event == "segment_plan":
+                    plan.update(data)
+            diarize_and_transcribe(wav_path, asr_model, diarizer, progress=progress)
+        elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        "elapsed": elapsed,
+        "rtf": elapsed / args.duration,
+        "segments": len(segments) if args.stage != "convert" else None,
+        "segments_per_s": len(segments) / elapsed if segments and elapsed > 0 else None,
+        "vad_skipped": skipped,
+        "calls_saved": plan.get("calls_saved"),
+        "model_load_s": model_load,
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_growth_mb": peak_rss_mb() - rss_before,
+    }))
+
+
+def _run_server(args, source: Path) -> tuple:
+    """Загрузка файла, задание /jobs с диаризацией и чтение SSE до конца через тестовый клиент Flask."""
+    import server
+
+    client = server.app.test_client()
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    with open(source, "rb") as f:
+        client.post("/upload", data={"audio_files": (f, source.name)}, content_type="multipart/form-data")
+    response = client.post("/jobs", data={"language": args.language, "model_type": args.model_type,
+                                          "model_name": args.model_name, "diarization": "on"})
+    job_id = response.get_json()["job_id"]
+    stream = client.get(f"/jobs/{job_id}/events")
+    segments = [line for line in stream.get_data(as_text=True).splitlines() if line == "event: segment"]
+    elapsed = time.perf_counter() - started
+
+    job = server.worker.get(job_id)
+    if job.status != "done":
+        raise RuntimeError(f"Задание завершилось со статусом {job.status}: {job.errors}")
+    # Загрузка моделей — разовая стоимость холодного старта, в RTF её не включаем
+    model_load = job.timings["asr_model_load"] + job.timings["diarizer_load"]
+    return rss_before, elapsed - model_load, model_load, segments
+
+
+def compare(rows: list, baseline: list, tolerance: float) -> list:
+    """Добавляет к строкам отклонение от базового прогона и возвращает строки с регрессиями."""
+    base = {(row["stage"], row["duration_s"]): row for row in baseline}
+    regressions = []
+    for row in rows:
+        ref = base.get((row["stage"], row["duration_s"]))
+        if ref is None or "error" in row or not ref.get("rtf"):
+            continue
+        row["rtf_change"] = row["rtf"] / ref["rtf"] - 1
+        row["rss_change"] = row["peak_rss_mb"] / ref["peak_rss_mb"] - 1 if ref.get("peak_rss_mb") else None
+        if row["rtf_change"] > tolerance or (row["rss_change"] or 0) > tolerance:
+            regressions.append(row)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark with stub or real models")
+    parser.add_argument("--durations", type=float, nargs="+", default=[60, 600])
+    parser.add_argument("--speakers", type=int, default=2)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--backend", default="stub", help="Model backend (stub or nemo)")
+    parser.add_argument("--language", choices=["ru", "en"], default="en")
+    parser.add_argument("--model_type", choices=["ctc", "transducer"], default="ctc")
+    parser.add_argument("--model_name", default="stt_en_conformer_ctc_small")
+    parser.add_argument("--save_baseline", type=Path, help="Write results to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="Compare against a JSON file written by --save_baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative RTF / peak RSS growth over the baseline")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--audio_name", help=argparse.SUPPRESS)
+    parser.add_argument("--duration", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    common = ["--backend", args.backend, "--language", args.language, "--model_type", args.model_type,
+              "--model_name", args.model_name]
+    rows = []
+    for duration in args.durations:
+        with tempfile.TemporaryDirectory() as tmp:
+            workdir = Path(tmp)
+            (workdir / "audio").mkdir()
+            shutil.copy2(REPO_ROOT / "diarizer_config.yaml", workdir / "diarizer_config.yaml")
+            audio = write_synthetic_speech(workdir / "audio" / f"bench_{int(duration)}s.wav", duration, args.speakers)
+            for stage in args.stages:
+                try:
+                    result = run_child("benchmarks.harness", common + ["--stage", stage, "--audio_name", audio.name,
+                                                                       "--duration", duration], cwd=workdir)
+                except RuntimeError as e:
+                    result = {"error": str(e).splitlines()[-1]}
+                rows.append({"duration_s": duration, "stage": stage, **result})
+                print(json.dumps(rows[-1]), flush=True)
+
+    columns = list(COLUMNS)
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(rows, json.load(f)["rows"], args.tolerance)
+        columns[4:4] = ["rtf_change", "rss_change"]
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"backend": args.backend, "speakers": args.speakers, "rows": rows}, f, indent=2)
+
+    print()
+    print_table(rows, columns)
+    if regressions:
+        print(f"\nРегрессии (допуск {args.tolerance:.0%}): "
+              + ", ".join(f"{row['stage']}@{row['duration_s']:.0f}s" for row in regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Память и RTF распознавания целиком (transcribe_audio) против окон (transcribe_long_audio).
+
+Запуск из корня репозитория:
+    python -m benchmarks.longform --language en --ctc --model_name stt_en_conformer_ctc_small --durations 60 600 3600
+"""
+import time
+import json
+import argparse
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import peak_rss_mb, write_synthetic_speech, run_child, print_table
+
+MODES = ("full", "chunked")
+
+
+def child(args):
+    import torch
+    from main import load_asr_model, transcribe_audio, transcribe_long_audio
+
+    asr_model = load_asr_model(args.language, "transducer" if args.transducer else "ctc", args.model_name)
+    rss_after_load = peak_rss_mb()
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+
+    started = time.perf_counter()
+    if args.mode == "full":
+        transcribe_audio(args.audio, asr_model)
+    else:
+        transcribe_long_audio(args.audio, asr_model, args.chunk_sec, args.overlap_sec, args.chunk_batch)
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        "elapsed": elapsed,
+        "rtf": elapsed / args.duration,
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_growth_mb": peak_rss_mb() - rss_after_load,
+        "peak_vram_mb": torch.cuda.max_memory_allocated() / 2 ** 20 if torch.cuda.is_available() else None,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-form transcription memory/RTF benchmark")
+    parser.add_argument("--language", choices=["ru", "en"], default="ru")
+    parser.add_argument("--transducer", action="store_true")
+    parser.add_argument("--ctc", action="store_true")
+    parser.add_argument("--model_name", required=True)
+    parser.add_argument("--durations", type=float, nargs="+", default=[60, 300, 1200])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--chunk_sec", type=float, default=30.0)
+    parser.add_argument("--overlap_sec", type=float, default=4.0)
+    parser.add_argument("--chunk_batch", type=int, default=8)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--audio", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--duration", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    common = ["--language", args.language, "--model_name", args.model_name,
+              "--chunk_sec", args.chunk_sec, "--overlap_sec", args.overlap_sec, "--chunk_batch", args.chunk_batch,
+              "--transducer" if args.transducer else "--ctc"]
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for duration in args.durations:
+            audio = write_synthetic_speech(Path(tmp) / f"bench_{int(duration)}s.wav", duration)
+            for mode in args.modes:
+                try:
+                    result = run_child("benchmarks.longform", common + ["--mode", mode, "--audio", audio,
+                                                                        "--duration", duration])
+                except RuntimeError as e:
+                    # Полный режим на длинных записях может упасть по OOM — это тоже результат
+                    result = {"error": str(e).splitlines()[-1]}
+                rows.append({"duration_s": duration, "mode": mode, **result})
+                print(json.dumps(rows[-1]), flush=True)
+
+    print()
+    print_table(rows, ["duration_s", "mode", "rtf", "peak_rss_mb", "rss_growth_mb", "peak_vram_mb", "error"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Обработка папки несколькими локальными воркерами через общую очередь (shard.py).
+
+Для каждого числа воркеров запускаются процессы main.py --queue_dir с общей
+папкой аудио и очередью, но каждый в своей рабочей папке (свои results, decoded,
+журнал) — как воркеры на разных машинах с общей файловой системой. С
+--kill_after один воркер убивается (SIGKILL) посреди прогона: его аренды должны
+истечь и достаться остальным. После прогона проверяется, что каждый файл готов
+и его результаты на месте. По умолчанию используются CPU-заглушки моделей.
+
+Запуск из корня репозитория:
+    python -m benchmarks.shard --workers 1 2 4 --files 16 --duration 60 --kill_after 10
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+from benchmarks.common import write_synthetic_speech, print_table
+from shard import WorkQueue
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def run_workers(count: int, args, audio_dir: Path, root: Path) -> dict:
+    queue_dir = root / "queue"
+    cmd = [sys.executable, str(REPO_ROOT / "main.py"), "--backend", args.backend, "--language", args.language,
+           f"--{args.model_type}", "--model_name", args.model_name, "--audio_dir", str(audio_dir),
+           "--queue_dir", str(queue_dir), "--no_cache", "--jobs", "1", "--writers", "1"]
+    env = dict(os.environ, SHARD_LEASE_TTL_SEC=str(args.lease_ttl), SHARD_POLL_SEC="1")
+    procs = []
+    started = time.perf_counter()
+    for i in range(count):
+        cwd = root / f"worker-{i}"
+        cwd.mkdir()
+        log = open(cwd / "worker.log", "w", encoding="utf-8")
+        procs.append((subprocess.Popen(cmd + ["--worker_id", f"worker-{i}"], cwd=cwd, env=env, stdout=log,
+                                       stderr=subprocess.STDOUT), log))
+    killed = False
+    if args.kill_after is not None and count > 1:
+        try:
+            procs[0][0].wait(timeout=args.kill_after)
+        except subprocess.TimeoutExpired:
+            procs[0][0].kill()
+            killed = True
+    codes = [proc.wait() for proc, _ in procs]
+    wall = time.perf_counter() - started
+    for _, log in procs:
+        log.close()
+
+    status = WorkQueue(queue_dir, audio_dir).status()
+    done = [json.loads(path.read_text(encoding="utf-8")) for path in (queue_dir / "done").glob("*.json")]
+    missing = sum(1 for entry in done for result in entry["results"] if not Path(result).exists())
+    audio_sec = sum(entry.get("audio_sec") or 0.0 for entry in done)
+    failed_workers = sum(1 for code in codes if code != 0) - int(killed)
+    if failed_workers:
+        log_path = next(root / f"worker-{i}" / "worker.log" for i, code in enumerate(codes) if code != 0)
+        print(log_path.read_text(encoding="utf-8")[-2000:], file=sys.stderr)
+    return {
+        "workers": count,
+        "killed": killed,
+        "files": status["files"],
+        "done": status["done"],
+        "gave_up": status["gave_up"],
+        "missing_results": missing,
+        "claims": sum(worker["claimed"] for worker in status["workers"]),
+        "expired_leases": status["expired_leases"],
+        "wall_s": wall,
+        "files_per_min": 60 * status["done"] / wall,
+        "audio_x": audio_sec / wall,
+        "failed_workers": failed_workers,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-worker shared queue benchmark")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--files", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of synthetic audio per file")
+    parser.add_argument("--kill_after", type=float, default=None,
+                        help="SIGKILL the first worker after N seconds (runs with more than one worker)")
+    parser.add_argument("--lease_ttl", type=float, default=5.0, help="Lease expiry for the run (SHARD_LEASE_TTL_SEC)")
+    parser.add_argument("--backend", default="stub", help="Model backend (stub or nemo)")
+    parser.add_argument("--language", choices=["ru", "en"], default="en")
+    parser.add_argument("--model_type", choices=["ctc", "transducer"], default="ctc")
+    parser.add_argument("--model_name", default="stt_en_conformer_ctc_small")
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        audio_dir = Path(tmp) / "audio"
+        audio_dir.mkdir()
+        for i in range(args.files):
+            write_synthetic_speech(audio_dir / f"file_{i:03d}.wav", args.duration, seed=i)
+        for count in args.workers:
+            root = Path(tmp) / f"run-{count}"
+            root.mkdir()
+            rows.append(run_workers(count, args, audio_dir, root))
+            print(json.dumps(rows[-1], ensure_ascii=False), flush=True)
+
+    print()
+    print_table(rows, ["workers", "killed", "files", "done", "gave_up", "missing_results", "claims",
+                       "expired_leases", "wall_s", "files_per_min", "audio_x", "failed_workers"])
+    if any(row["done"] + row["gave_up"] != row["files"] or row["missing_results"] or row["failed_workers"]
+           for row in rows):
+        print("\n❌ Не все файлы обработаны или не все результаты на месте")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
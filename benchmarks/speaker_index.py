@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Индекс спикеров: скорость добавления, задержка поиска и точность против полного перебора.
+
+Индекс заполняется синтетическими эмбеддингами: --people «людей» (случайные
+направления), каждый спикер записи — направление своего человека плюс шум. Для
+каждого размера индекса выводятся скорость добавления (строк/с), задержка
+search() для пакетов из --batches запросов, задержка names_for() одной записи с
+--names зарегистрированными именами и доля запросов, у которых k ближайших
+совпали с полным перебором одной матрицей. Каждый размер — отдельный процесс.
+
+Запуск из корня репозитория:
+    python -m benchmarks.speaker_index --sizes 10000 100000 300000
+"""
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.common import peak_rss_mb, run_child, print_table
+
+
+def child(args):
+    from speaker_index import SpeakerIndex
+
+    rng = np.random.default_rng(0)
+    people = rng.standard_normal((args.people, args.dim)).astype(np.float32)
+    index = SpeakerIndex(Path("speakers"))
+
+    def speakers(count):
+        who = rng.integers(0, args.people, count)
+        return people[who] + args.noise * rng.standard_normal((count, args.dim)).astype(np.float32)
+
+    started = time.perf_counter()
+    recordings = args.size // args.speakers
+    for r in range(recordings):
+        vectors = speakers(args.speakers)
+        index.add(f"rec_{r:07d}", {f"speaker_{s}": (vector, 60.0) for s, vector in enumerate(vectors)})
+    insert = time.perf_counter() - started
+    for n in range(args.names):
+        index.enroll(f"person_{n}", f"rec_{n:07d}", "speaker_0")
+
+    result = {"rows": len(index.rows), "insert_rows_s": len(index.rows) / insert}
+    matrix = np.asarray(index.matrix())
+    for batch in args.batches:
+        queries = speakers(batch)
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            ids, _ = index.search(queries, args.k)
+            timings.append(time.perf_counter() - started)
+        result[f"search_{batch}_ms"] = 1000 * float(np.median(timings))
+        # Полный перебор: одна матрица сходства, сортировка каждой строки
+        exact = np.argsort(-(queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ matrix.T, axis=1)[:, :args.k]
+        result[f"exact_{batch}"] = float(np.mean([set(a) == set(b) for a, b in zip(ids, exact)]))
+
+    timings = []
+    for r in range(args.repeat):
+        started = time.perf_counter()
+        index.names_for(f"rec_{r % recordings:07d}")
+        timings.append(time.perf_counter() - started)
+    result["names_for_ms"] = 1000 * float(np.median(timings))
+    result["size_mb"] = index.stats()["size_mb"]
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speaker index insert throughput and query latency")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10000, 100000, 300000], help="Index rows")
+    parser.add_argument("--dim", type=int, default=192, help="Embedding dimension (TitaNet: 192)")
+    parser.add_argument("--speakers", type=int, default=4, help="Speakers per synthetic recording")
+    parser.add_argument("--people", type=int, default=5000, help="Distinct synthetic people")
+    parser.add_argument("--noise", type=float, default=0.5, help="Per-recording embedding noise")
+    parser.add_argument("--names", type=int, default=50, help="Enrolled names")
+    parser.add_argument("--batches", nargs="+", type=int, default=[1, 16, 64], help="Queries per search() call")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    rows = []
+    common = ["--dim", args.dim, "--speakers", args.speakers, "--people", args.people, "--noise", args.noise,
+              "--names", args.names, "--batches", *args.batches, "--k", args.k, "--repeat", args.repeat]
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            rows.append(run_child("benchmarks.speaker_index", common + ["--size", size], cwd=tmp))
+        print(json.dumps(rows[-1]), flush=True)
+
+    print()
+    print_table(rows, ["rows", "insert_rows_s"] + [f"search_{batch}_ms" for batch in args.batches]
+                + [f"exact_{batch}" for batch in args.batches] + ["names_for_ms", "size_mb", "peak_rss_mb"])
+
+
+if __name__ == "__main__":
+    main()
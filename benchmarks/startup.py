@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Время запуска: импорт main/server, `main.py --help` и время до первого результата.
+
+Режим lazy — как модули работают сейчас (torch и NeMo импортируются при первом
+инференсе); eager воспроизводит прежнее поведение, импортируя их заранее.
+Каждый замер — отдельный процесс с пустой рабочей папкой.
+
+Запуск из корня репозитория:
+    python -m benchmarks.startup --backend nemo --language en --model_name stt_en_conformer_ctc_small
+"""
+import time
+
+_started = time.perf_counter()
+
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+from benchmarks.common import write_synthetic_speech, run_child, print_table
+
+MODES = ("lazy", "eager")
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def child(args):
+    if args.mode == "eager":
+        import torch  # noqa: F401
+        import nemo.collections.asr.models  # noqa: F401
+    import main
+    import_s = time.perf_counter() - _started
+    result = {"import_s": import_s, "model_load_s": None, "first_result_s": None}
+
+    if args.measure == "first_result":
+        main.set_backend(args.backend)
+        t0 = time.perf_counter()
+        asr_model = main.load_asr_model(args.language, args.model_type, args.model_name)
+        result["model_load_s"] = time.perf_counter() - t0
+        main.transcribe_audio(main.convert_to_wav(args.audio), asr_model)
+        result["first_result_s"] = time.perf_counter() - _started
+    print(json.dumps(result))
+
+
+def help_wall() -> float:
+    """Время `python main.py --help` в новом процессе."""
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        subprocess.run([sys.executable, str(REPO_ROOT / "main.py"), "--help"], cwd=tmp, capture_output=True, check=True)
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time and time-to-first-result benchmark")
+    parser.add_argument("--backend", default="stub", help="Model backend (stub or nemo)")
+    parser.add_argument("--language", choices=["ru", "en"], default="en")
+    parser.add_argument("--model_type", choices=["ctc", "transducer"], default="ctc")
+    parser.add_argument("--model_name", default="stt_en_conformer_ctc_small")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--measure", choices=("import", "first_result"), help=argparse.SUPPRESS)
+    parser.add_argument("--audio", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    common = ["--backend", args.backend, "--language", args.language, "--model_type", args.model_type,
+              "--model_name", args.model_name]
+    rows = [{"measure": "main.py --help", "mode": "lazy",
+             "wall_s": min(help_wall() for _ in range(args.repeat))}]
+    print(json.dumps(rows[-1]), flush=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        audio = write_synthetic_speech(Path(tmp) / "first.wav", 5.0)
+        for measure in ("import", "first_result"):
+            for mode in args.modes:
+                runs = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    try:
+                        result = run_child("benchmarks.startup", common + ["--mode", mode, "--measure", measure,
+                                                                           "--audio", audio], cwd=tmp)
+                    except RuntimeError as e:
+                        result = {"error": str(e).splitlines()[-1]}
+                    runs.append({"wall_s": time.perf_counter() - started, **result})
+                # Лучший из повторов — меньше шума от дискового кэша и планировщика
+                best = min(runs, key=lambda run: run["wall_s"])
+                rows.append({"measure": measure, "mode": mode, **best})
+                print(json.dumps(rows[-1]), flush=True)
+
+    print()
+    print_table(rows, ["measure", "mode", "wall_s", "import_s", "model_load_s", "first_result_s", "error"])
+
+
+if __name__ == "__main__":
+    main()
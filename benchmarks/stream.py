@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Задержка потокового распознавания: WAV проигрывается в WebSocket /stream в реальном времени.
+
+Клиент шлёт куски по --chunk_ms со скоростью --speed (1.0 — реальное время) и
+отмечает время прихода каждого события. Задержка события — время его прихода
+минус момент, когда был отправлен конец его аудио (end сегмента): для partial
+она ограничена partial_sec плюс шаг распознавания, для final — endpoint_sec
+(или max_segment_sec) плюс распознавание сегмента. Сервер запускается в
+процессе замера, модели загружаются до начала проигрывания. Каждый режим
+(asr — без спикеров, diarization — с онлайн-диаризацией) — отдельный процесс.
+
+Запуск из корня репозитория:
+    python -m benchmarks.stream --backend nemo --language en --model_type ctc \
+        --model_name stt_en_conformer_ctc_small --audio audio/meeting.wav
+"""
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from urllib.parse import urlencode
+
+import numpy as np
+import soundfile as sf
+
+from benchmarks.common import peak_rss_mb, write_synthetic_speech, run_child, print_table
+
+MODES = ("asr", "diarization")
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def percentile(values: list, q: float):
+    return float(np.percentile(values, q)) if values else None
+
+
+def child(args):
+    import simple_websocket
+    from werkzeug.serving import make_server
+    import main
+    import server
+
+    main.set_backend(args.backend)
+    diarization = args.mode == "diarization"
+    server.worker.get_asr_model(args.language, args.model_type, args.model_name)
+    if diarization:
+        server.worker.get_diarizer()
+    http = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+
+    samples, _ = sf.read(str(main.convert_to_wav(args.audio)), dtype="int16")
+    duration = len(samples) / 16000
+    query = urlencode({"language": args.language, "model_type": args.model_type, "model_name": args.model_name,
+                       "diarization": int(diarization)})
+    ws = simple_websocket.Client.connect(f"ws://127.0.0.1:{http.server_port}/stream?{query}")
+    step = int(args.chunk_ms * 16)
+    started = time.perf_counter()
+
+    def send():
+        for offset in range(0, len(samples), step):
+            # Кусок уходит не раньше, чем он «прозвучал бы» при проигрывании
+            delay = started + (offset + step) / 16000 / args.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            ws.send(samples[offset:offset + step].tobytes())
+        ws.send(json.dumps({"event": "end"}))
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    latency = {"partial": [], "final": []}
+    finals, speakers, done = 0, set(), None
+    while done is None:
+        event = json.loads(ws.receive())
+        received = time.perf_counter() - started
+        if event["event"] == "error":
+            raise RuntimeError(event["message"])
+        if event["event"] == "done":
+            done = event
+            continue
+        latency[event["event"]].append(received - event["end"] / args.speed)
+        if event["event"] == "final":
+            finals += 1
+            speakers.add(event["speaker"])
+    wall = time.perf_counter() - started
+    sender.join()
+    ws.close()
+    http.shutdown()
+
+    print(json.dumps({
+        "duration_s": duration,
+        "partial_p50_s": percentile(latency["partial"], 50),
+        "partial_p95_s": percentile(latency["partial"], 95),
+        "final_p50_s": percentile(latency["final"], 50),
+        "final_p95_s": percentile(latency["final"], 95),
+        "final_max_s": max(latency["final"], default=None),
+        "partials": len(latency["partial"]),
+        "finals": finals,
+        "speakers": len(speakers - {None}) if diarization else None,
+        "tail_s": wall - duration / args.speed,
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket streaming latency benchmark (real-time WAV replay)")
+    parser.add_argument("--backend", default="stub", help="Model backend (stub or nemo)")
+    parser.add_argument("--language", choices=["ru", "en"], default="en")
+    parser.add_argument("--model_type", choices=["ctc", "transducer"], default="ctc")
+    parser.add_argument("--model_name", default="stt_en_conformer_ctc_small")
+    parser.add_argument("--audio", type=Path, default=None, help="Audio file to replay (default: synthetic speech)")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of synthetic audio without --audio")
+    parser.add_argument("--speakers", type=int, default=3)
+    parser.add_argument("--chunk_ms", type=float, default=100.0, help="Audio per WebSocket message")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed (1.0 = real time)")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copy2(REPO_ROOT / "diarizer_config.yaml", Path(tmp) / "diarizer_config.yaml")
+        audio = args.audio.resolve() if args.audio is not None else write_synthetic_speech(
+            Path(tmp) / "stream.wav", args.duration, args.speakers)
+        common = ["--backend", args.backend, "--language", args.language, "--model_type", args.model_type,
+                  "--model_name", args.model_name, "--audio", audio, "--chunk_ms", args.chunk_ms,
+                  "--speed", args.speed]
+        for mode in args.modes:
+            rows.append({"mode": mode, **run_child("benchmarks.stream", common + ["--mode", mode], cwd=tmp)})
+            print(json.dumps(rows[-1]), flush=True)
+
+    print()
+    print_table(rows, ["mode", "duration_s", "partial_p50_s", "partial_p95_s", "final_p50_s", "final_p95_s",
+                       "final_max_s", "partials", "finals", "speakers", "tail_s", "peak_rss_mb"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Лёгкие CPU-заглушки моделей ASR и диаризатора для бенчмарков без GPU и сети.
+
+Заглушки повторяют интерфейс моделей NeMo, которым пользуется main.py, и делают
+работу, линейную по длине аудио (спектр по кадрам, энергетический VAD,
+эмбеддинги окон и кластеризация), поэтому замеры отражают накладные расходы
+конвейера, а не качество распознавания. Выбираются через main.set_backend("stub")
+или переменную окружения ASR_BACKEND=stub.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from audio_io import open_shared_audio
+
+SAMPLE_RATE = 16000
+ASR_FRAME = 320  # 20 мс
+WORD_FRAMES = 20  # Слово — до 0.4 с речи подряд
+VAD_FRAME = 800  # 50 мс
+SPEECH_RMS = 0.02
+MIN_GAP_SEC = 0.3
+MIN_SEGMENT_SEC = 0.2
+EMBEDDING_BANDS = 32
+SAME_SPEAKER_COSINE = 0.9
+
+
+class StubHypothesis:
+    """Гипотеза в формате NeMo: текст и таймстампы слов."""
+
+    def __init__(self, text: str, words: list):
+        self.text = text
+        self.timestamp = {"word": words}
+
+
+class StubASRModel:
+    """Заглушка EncDecRNNTBPEModel / EncDecCTCModelBPE: «слова» по участкам речи."""
+
+    def __init__(self, model_type: str, model_name: str):
+        self.model_type = model_type
+        self.model_name = model_name
+
+    def transcribe(self, audio: list, batch_size: int = 1, timestamps: bool = False, **kwargs) -> list:
+        return [self._transcribe_one(_as_array(item)) for item in audio]
+
+    def _transcribe_one(self, samples: np.ndarray) -> StubHypothesis:
+        frames = len(samples) // ASR_FRAME
+        if frames == 0:
+            return StubHypothesis("", [])
+        framed = samples[:frames * ASR_FRAME].reshape(frames, ASR_FRAME)
+        spectrum = np.abs(np.fft.rfft(framed, axis=1))
+        voiced = np.sqrt(np.mean(framed ** 2, axis=1)) > SPEECH_RMS
+
+        words = []
+        start = None
+        for i in range(frames + 1):
+            speaking = i < frames and voiced[i]
+            if speaking and start is None:
+                start = i
+            if start is not None and (not speaking or i - start >= WORD_FRAMES):
+                token = f"w{int(np.argmax(spectrum[start:i].mean(axis=0))) // 4}"
+                words.append({"word": token, "start": start * ASR_FRAME / SAMPLE_RATE,
+                              "end": i * ASR_FRAME / SAMPLE_RATE})
+                start = i if speaking else None
+        return StubHypothesis(" ".join(w["word"] for w in words), words)
+
+
+class StubDiarizer:
+    """Заглушка ClusteringDiarizer: энергетический VAD, эмбеддинги окон, жадная кластеризация.
+
+    Как и ClusteringDiarizer, сначала сохраняет VAD (vad_outputs/vad_out.json),
+    сабсегменты и эмбеддинги всех файлов манифеста в speaker_outputs, затем пишет
+    RTTM в pred_rttms по порядку манифеста.
+    """
+
+    def __init__(self, config):
+        self._cfg = config
+        self._diarizer_params = config.diarizer
+        params = config.diarizer.speaker_embeddings.parameters
+        self.window_sec = float(params.window_length_in_sec[0])
+        self.shift_sec = float(params.shift_length_in_sec[0])
+        self.max_speakers = int(config.diarizer.clustering.parameters.max_num_speakers)
+
+    def diarize(self):
+        out_dir = Path(self._diarizer_params.out_dir)
+        audio_paths, segments = self._perform_speech_activity_detection()
+
+        embeddings, timestamps = {}, {}
+        for audio_path in audio_paths:
+            uniq_id = audio_path.stem
+            embeddings[uniq_id], timestamps[uniq_id] = self._embed(open_shared_audio(audio_path), segments[uniq_id])
+
+        embeddings_dir = out_dir / "speaker_outputs" / "embeddings"
+        embeddings_dir.mkdir(parents=True, exist_ok=True)
+        _write_manifest(out_dir / "speaker_outputs" / "subsegments_scale0.json", audio_paths, timestamps)
+        torch.save(embeddings, embeddings_dir / "subsegments_scale0_embeddings.pt")
+
+        rttm_dir = out_dir / "pred_rttms"
+        rttm_dir.mkdir(parents=True, exist_ok=True)
+        for audio_path in audio_paths:
+            uniq_id = audio_path.stem
+            labels = _cluster(embeddings[uniq_id], timestamps[uniq_id], segments[uniq_id], self.max_speakers)
+            with open(rttm_dir / f"{uniq_id}.rttm", "w", encoding="utf-8") as f:
+                for (start, end), label in zip(segments[uniq_id], labels):
+                    f.write(f"SPEAKER {uniq_id} 1 {start:.3f} {end - start:.3f} <NA> <NA> speaker_{label} <NA> <NA>\n")
+
+    def _perform_speech_activity_detection(self) -> tuple:
+        """Энергетический VAD всех файлов манифеста; пишет vad_outputs/vad_out.json."""
+        out_dir = Path(self._diarizer_params.out_dir)
+        with open(self._diarizer_params.manifest_filepath, "r", encoding="utf-8") as f:
+            audio_paths = [Path(json.loads(line)["audio_filepath"]) for line in f if line.strip()]
+        segments = {audio_path.stem: self._speech_segments(open_shared_audio(audio_path)) for audio_path in audio_paths}
+        (out_dir / "vad_outputs").mkdir(parents=True, exist_ok=True)
+        self._speaker_manifest_path = str(out_dir / "vad_outputs" / "vad_out.json")
+        _write_manifest(Path(self._speaker_manifest_path), audio_paths, segments)
+        return audio_paths, segments
+
+    def _speech_segments(self, samples: np.ndarray) -> list:
+        frames = len(samples) // VAD_FRAME
+        if frames == 0:
+            return []
+        rms = np.sqrt(np.mean(samples[:frames * VAD_FRAME].reshape(frames, VAD_FRAME) ** 2, axis=1))
+        voiced = np.concatenate(([False], rms > SPEECH_RMS, [False]))
+        edges = np.flatnonzero(np.diff(voiced.astype(np.int8)))
+        frame_sec = VAD_FRAME / SAMPLE_RATE
+        segments = []
+        for start, end in zip(edges[::2] * frame_sec, edges[1::2] * frame_sec):
+            if segments and start - segments[-1][1] < MIN_GAP_SEC:
+                segments[-1] = (segments[-1][0], end)
+            else:
+                segments.append((start, end))
+        return [(start, end) for start, end in segments if end - start >= MIN_SEGMENT_SEC]
+
+    def _embed(self, samples: np.ndarray, segments: list) -> tuple:
+        """Нормированные логарифмы энергий полос для окон внутри сегментов речи."""
+        window = int(self.window_sec * SAMPLE_RATE)
+        shift = int(self.shift_sec * SAMPLE_RATE)
+        vectors, stamps = [], []
+        for start, end in segments:
+            first, last = int(start * SAMPLE_RATE), int(end * SAMPLE_RATE)
+            for offset in range(first, max(first + 1, last - window + 1), shift):
+                chunk = np.asarray(samples[offset:min(offset + window, last)])
+                power = np.abs(np.fft.rfft(chunk, n=window)) ** 2
+                bands = np.log1p(np.add.reduceat(power, np.linspace(0, len(power), EMBEDDING_BANDS, endpoint=False,
+                                                                    dtype=int)))
+                vectors.append(bands / (np.linalg.norm(bands) + 1e-9))
+                stamps.append([offset / SAMPLE_RATE, (offset + len(chunk)) / SAMPLE_RATE])
+        if not vectors:
+            return torch.zeros(0, EMBEDDING_BANDS), stamps
+        return torch.from_numpy(np.stack(vectors).astype(np.float32)), stamps
+
+
+class StubBackend:
+    """Бэкенд main.py с заглушками вместо моделей NeMo."""
+
+    name = "stub"
+
+    def load_asr(self, model_type: str, model_name: str):
+        return StubASRModel(model_type, model_name)
+
+    def create_diarizer(self, config):
+        return StubDiarizer(config)
+
+    def detect_speech(self, diarizer: StubDiarizer, manifest_path: Path, out_dir: Path) -> Path:
+        diarizer._diarizer_params.manifest_filepath = str(manifest_path)
+        diarizer._diarizer_params.out_dir = str(out_dir)
+        diarizer._perform_speech_activity_detection()
+        return Path(diarizer._speaker_manifest_path)
+
+    def embed_speech(self, diarizer: StubDiarizer, pieces: list) -> np.ndarray:
+        vectors = []
+        for piece in pieces:
+            windows, _ = diarizer._embed(piece, [(0.0, len(piece) / SAMPLE_RATE)])
+            vectors.append(windows.numpy().mean(axis=0) if len(windows) else np.zeros(EMBEDDING_BANDS, np.float32))
+        return np.stack(vectors)
+
+    def cluster(self, features_dir: Path, uniq_id: str, config, num_speakers: int = None) -> list:
+        embeddings = torch.load(features_dir / "embeddings" / "subsegments_scale0_embeddings.pt")[uniq_id]
+        stamps = _read_manifest(features_dir / "subsegments" / "subsegments_scale0.json")
+        segments = _read_manifest(features_dir / "vad.json")
+        max_speakers = num_speakers or int(config.diarizer.clustering.parameters.max_num_speakers)
+        labels = _cluster(embeddings, stamps, segments, max_speakers)
+        return [(start, end, f"speaker_{label}") for (start, end), label in zip(segments, labels)]
+
+
+def _cluster(embeddings: torch.Tensor, stamps: list, segments: list, max_speakers: int) -> list:
+    """Каждому сегменту — ближайший центроид по косинусу или новый спикер."""
+    vectors = embeddings.numpy()
+    starts = np.array([start for start, _ in stamps])
+    centroids, labels = [], []
+    for start, end in segments:
+        mask = (starts >= start) & (starts < end)
+        if not mask.any():
+            labels.append(labels[-1] if labels else 0)
+            continue
+        mean = vectors[mask].mean(axis=0)
+        mean /= np.linalg.norm(mean) + 1e-9
+        scores = [float(mean @ c) for c in centroids]
+        if scores and (max(scores) >= SAME_SPEAKER_COSINE or len(centroids) >= max_speakers):
+            labels.append(int(np.argmax(scores)))
+        else:
+            centroids.append(mean)
+            labels.append(len(centroids) - 1)
+    return labels
+
+
+def _write_manifest(path: Path, audio_paths: list, spans: dict):
+    """Манифест NeMo с отрезками (start, end) каждого файла, как vad_out.json и subsegments_scale*.json."""
+    with open(path, "w", encoding="utf-8") as f:
+        for audio_path in audio_paths:
+            for start, end in spans[audio_path.stem]:
+                f.write(json.dumps({"audio_filepath": str(audio_path), "offset": start, "duration": end - start,
+                                    "label": "UNK"}) + "\n")
+
+
+def _read_manifest(path: Path) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [(entry["offset"], entry["offset"] + entry["duration"])
+                for entry in map(json.loads, filter(str.strip, f))]
+
+
+def _as_array(item) -> np.ndarray:
+    if isinstance(item, (str, Path)):
+        return open_shared_audio(Path(item))
+    if isinstance(item, torch.Tensor):
+        return item.detach().cpu().numpy()
+    return np.asarray(item, dtype=np.float32)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Переключение между моделями ASR в воркере инференса с кэшем моделей и без него.
+
+Задания поочерёдно идут на --models (A, B, A, B…), каждое — со своим файлом,
+чтобы не попадать в кэш результатов. Режим cache — бюджет кэша моделей вмещает
+все модели; single — бюджет 1 МБ, резидентной остаётся только последняя модель
+(как до кэша моделей). Выводятся время загрузки моделей и задания по первому
+(холодному) проходу и по остальным. Каждый режим — отдельный процесс.
+
+Запуск из корня репозитория:
+    python -m benchmarks.switch --backend nemo --models stt_en_conformer_ctc_small stt_en_conformer_ctc_medium
+"""
+import json
+import argparse
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import peak_rss_mb, write_synthetic_speech, run_child, print_table
+
+MODES = ("cache", "single")
+
+
+def child(args):
+    import main
+    import registry
+    from cache import ResultCache
+    from model_cache import ModelCache
+    from worker import InferenceWorker, Job
+
+    main.set_backend(args.backend)
+    models = ModelCache(main.get_device(), budget_mb=None if args.mode == "cache" else 1.0,
+                        release=main.release_cuda_cache)
+    worker = InferenceWorker(cache=ResultCache(Path("cache")), models=models)
+    worker.start()
+    cold, warm = [], []
+    for i in range(args.rounds * len(args.models)):
+        info = registry.MODELS[args.models[i % len(args.models)]]
+        audio = write_synthetic_speech(Path("audio") / f"switch_{i:03d}.wav", args.duration, seed=i)
+        job = worker.submit(Job(info.language, info.decoder, info.name, diarization=False, audio_files=[audio],
+                                results_dir=Path("results") / f"job_{i:03d}"))
+        job.wait()
+        if job.status != "done":
+            raise RuntimeError(f"Задание {i} не выполнено: {job.errors}")
+        (cold if i < len(args.models) else warm).append(job.timings)
+
+    def mean(runs, name):
+        return sum(run[name] for run in runs) / len(runs) if runs else None
+
+    stats = models.stats()
+    print(json.dumps({
+        "cold_load_s": mean(cold, "asr_model_load"),
+        "warm_load_s": mean(warm, "asr_model_load"),
+        "warm_total_s": mean(warm, "total"),
+        "hit_rate": stats["hit_rate"],
+        "evictions": stats["evictions"],
+        "resident_mb": stats["resident_mb"],
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model switching cost with and without the resident model cache")
+    parser.add_argument("--backend", default="stub", help="Model backend (stub or nemo)")
+    parser.add_argument("--models", nargs="+", default=["stt_en_conformer_ctc_small", "stt_en_conformer_ctc_medium"])
+    parser.add_argument("--rounds", type=int, default=3, help="Passes over --models")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of synthetic audio per job")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    rows = []
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            (Path(tmp) / "audio").mkdir()
+            result = run_child("benchmarks.switch", ["--backend", args.backend, "--models", *args.models,
+                                                     "--rounds", args.rounds, "--duration", args.duration,
+                                                     "--mode", mode], cwd=tmp)
+        rows.append({"mode": mode, **result})
+        print(json.dumps(rows[-1]), flush=True)
+
+    print()
+    print_table(rows, ["mode", "cold_load_s", "warm_load_s", "warm_total_s", "hit_rate", "evictions",
+                       "resident_mb", "peak_rss_mb"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""Диаризация длинных записей по блокам со сквозными метками спикеров.
+
+ClusteringDiarizer кластеризует все мультимасштабные эмбеддинги записи разом:
+матрица сходства растёт квадратично, и на многочасовых записях память и время
+кластеризации уходят вверх даже с уменьшенными chunk_cluster_count и
+embeddings_per_chunk. В блочном режиме запись режется на блоки фиксированной
+длины, каждый блок диаризуется независимо (блоки одной волны идут одним прогоном
+diarize_many: VAD и эмбеддинги общими пакетами, кластеризация — по блоку), а
+локальные спикеры блоков связываются в глобальных по косинусу центроидов их
+эмбеддингов. Память кластеризации ограничена длиной блока, а не записи.
+
+Параметры — раздел block_diarization конфигурации диаризатора; режим включается
+флагом --block_diarization и действует на записи длиннее одного блока.
+"""
+import json
+import bisect
+import shutil
+import logging
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import soundfile as sf
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+WRITE_BLOCK_SEC = 60.0  # Блок записывается в WAV порциями, не копируя его в память целиком
+
+
+class BlockPlan(NamedTuple):
+    block_sec: float = 600.0  # Длина блока
+    blocks_per_run: int = 4  # Блоков в одном прогоне диаризатора (волна)
+    link_threshold: float = 0.7  # Косинус центроидов, начиная с которого локальный спикер — уже известный глобальный
+    min_speaker_sec: float = 5.0  # Локальный спикер с меньшим объёмом речи не заводит нового глобального
+
+
+def load_block_plan(config) -> BlockPlan:
+    """Параметры из раздела block_diarization конфигурации (OmegaConf)."""
+    section = config.get("block_diarization") or {}
+    return BlockPlan(**{name: type(default)(section[name]) for name, default in BlockPlan._field_defaults.items()
+                        if name in section})
+
+
+def block_ranges(duration_sec: float, block_sec: float) -> list:
+    """Границы блоков (start, end); хвост короче половины блока присоединяется к предыдущему."""
+    starts = [float(start) for start in np.arange(0.0, duration_sec, block_sec)]
+    if len(starts) > 1 and duration_sec - starts[-1] < block_sec / 2:
+        starts.pop()
+    return [(start, starts[i + 1] if i + 1 < len(starts) else duration_sec) for i, start in enumerate(starts)]
+
+
+def is_long(duration_sec: float, plan: BlockPlan) -> bool:
+    """Делится ли запись больше чем на один блок (иначе диаризуется целиком)."""
+    return len(block_ranges(duration_sec, plan.block_sec)) > 1
+
+
+def _write_block(audio_data, start: float, end: float, path: Path):
+    step = int(WRITE_BLOCK_SEC * SAMPLE_RATE)
+    first, last = int(start * SAMPLE_RATE), int(end * SAMPLE_RATE)
+    with sf.SoundFile(str(path), "w", samplerate=SAMPLE_RATE, channels=1, subtype="FLOAT") as f:
+        for offset in range(first, last, step):
+            f.write(np.asarray(audio_data[offset:min(offset + step, last)], dtype=np.float32))
+
+
+def speaker_centroids(file_dir: Path, uniq_id: str, segments: list) -> dict:
+    """Центроиды локальных спикеров блока: {метка: (нормированный центроид, секунды речи)}.
+
+    Берутся эмбеддинги самого длинного окна (subsegments_scale0) — они устойчивее
+    коротких; окно относится к спикеру сегмента RTTM, в который попадает его середина.
+    """
+    import torch
+    embeddings = torch.load(file_dir / "embeddings" / "subsegments_scale0_embeddings.pt")[uniq_id]
+    vectors = np.asarray(embeddings.float().cpu().numpy(), dtype=np.float32)
+    with open(file_dir / "subsegments" / "subsegments_scale0.json", "r", encoding="utf-8") as f:
+        stamps = [(entry["offset"], entry["offset"] + entry["duration"])
+                  for entry in map(json.loads, filter(str.strip, f))]
+    segments = sorted(segments)
+    starts = [start for start, _, _ in segments]
+    sums, seconds = {}, {}
+    for start, end, speaker in segments:
+        seconds[speaker] = seconds.get(speaker, 0.0) + end - start
+    for vector, (start, end) in zip(vectors, stamps):
+        middle = (start + end) / 2
+        k = bisect.bisect_right(starts, middle) - 1
+        if k < 0 or segments[k][1] < middle:
+            continue
+        speaker = segments[k][2]
+        sums[speaker] = sums.get(speaker, 0.0) + vector / (np.linalg.norm(vector) + 1e-9)
+    return {speaker: (total / (np.linalg.norm(total) + 1e-9), seconds[speaker]) for speaker, total in sums.items()}
+
+
+class SpeakerLinker:
+    """Связывает локальных спикеров блоков с глобальными по косинусу центроидов.
+
+    Внутри блока два локальных спикера не сливаются в одного глобального —
+    кластеризация блока их уже различила. Пары (локальный, глобальный) назначаются
+    жадно по убыванию сходства, пока оно не ниже link_threshold; оставшиеся
+    локальные спикеры заводят новых глобальных, а совсем короткие (меньше
+    min_speaker_sec речи) вместо этого присоединяются к ближайшему свободному.
+    Центроид глобального спикера — среднее, взвешенное секундами речи.
+    """
+
+    def __init__(self, plan: BlockPlan = BlockPlan()):
+        self.plan = plan
+        self.centroids = []
+        self.seconds = []
+        self.stats = {"linked": 0, "new": 0, "forced": 0}
+
+    def link(self, local: dict) -> dict:
+        """Возвращает {локальная метка: глобальная метка} для спикеров одного блока."""
+        labels = list(local)
+        mapping = {}
+        if self.centroids and labels:
+            scores = np.stack([local[label][0] for label in labels]) @ np.stack(self.centroids).T
+            used = set()
+            for flat in np.argsort(-scores, axis=None):
+                i, j = divmod(int(flat), scores.shape[1])
+                if scores[i, j] < self.plan.link_threshold:
+                    break
+                if labels[i] in mapping or j in used:
+                    continue
+                mapping[labels[i]] = j
+                used.add(j)
+                self.stats["linked"] += 1
+            for i, label in enumerate(labels):
+                if label in mapping or local[label][1] >= self.plan.min_speaker_sec:
+                    continue
+                free = [j for j in range(len(self.centroids)) if j not in used]
+                if free:
+                    j = max(free, key=lambda j: scores[i, j])
+                    mapping[label] = j
+                    used.add(j)
+                    self.stats["forced"] += 1
+        for label in labels:
+            if label not in mapping:
+                self.centroids.append(np.zeros_like(local[label][0]))
+                self.seconds.append(0.0)
+                mapping[label] = len(self.centroids) - 1
+                self.stats["new"] += 1
+        for label, j in mapping.items():
+            centroid, seconds = local[label]
+            total = self.centroids[j] * self.seconds[j] + centroid * seconds
+            self.centroids[j] = total / (np.linalg.norm(total) + 1e-9)
+            self.seconds[j] += seconds
+        return {label: f"speaker_{j}" for label, j in mapping.items()}
+
+    def nearest(self, centroid: np.ndarray) -> str:
+        """Ближайший глобальный спикер не ниже link_threshold (центроиды не меняются); None — такого нет."""
+        if not self.centroids:
+            return None
+        scores = np.stack(self.centroids) @ centroid
+        j = int(np.argmax(scores))
+        return f"speaker_{j}" if scores[j] >= self.plan.link_threshold else None
+
+
+def diarize_blocks(audio_path: Path, audio_data, diarize_many, diarizer, plan: BlockPlan, work_dir: Path) -> tuple:
+    """Диаризует запись по блокам; возвращает (сегменты (start, end, speaker) с глобальными метками, статистика).
+
+    diarize_many — main.diarize_many (передаётся, чтобы модуль не импортировал main).
+    Блоки пишутся в work_dir волнами по blocks_per_run и удаляются после волны,
+    так что на диске одновременно лежит не больше одной волны.
+    """
+    duration = len(audio_data) / SAMPLE_RATE
+    ranges = block_ranges(duration, plan.block_sec)
+    linker = SpeakerLinker(plan)
+    segments, failed = [], 0
+    logger.info(f"🧱 Блочная диаризация {audio_path.name}: {len(ranges)} блоков по {plan.block_sec:.0f} с")
+    for wave_start in range(0, len(ranges), max(1, plan.blocks_per_run)):
+        wave = ranges[wave_start:wave_start + max(1, plan.blocks_per_run)]
+        wave_dir = work_dir / f"blocks_{wave_start}"
+        wave_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            offsets = {}
+            for idx, (start, end) in enumerate(wave, start=wave_start):
+                block_path = wave_dir / f"{audio_path.stem}.block{idx:04d}.wav"
+                _write_block(audio_data, start, end, block_path)
+                offsets[block_path] = start
+
+            def on_result(block_path, block_segments, file_dir):
+                # Блоки приходят в порядке манифеста, поэтому глобальные метки растут по времени
+                if not block_segments:
+                    return
+                mapping = linker.link(speaker_centroids(file_dir, block_path.stem, block_segments))
+                if not mapping:
+                    return
+                offset = offsets[block_path]
+                mapped = [(start, end, mapping[speaker]) for start, end, speaker in block_segments
+                          if speaker in mapping]
+                for start, end, speaker in block_segments:
+                    # У спикера без окон эмбеддингов (очень короткого) — метка ближайшего по времени сегмента
+                    label = mapping.get(speaker) or min(
+                        mapped, key=lambda seg: max(seg[0] - end, start - seg[1], 0.0))[2]
+                    segments.append((start + offset, end + offset, label))
+
+            results = diarize_many(list(offsets), diarizer, on_result, wave_dir / "diarization")
+            failed += sum(1 for result in results.values() if result is None)
+        finally:
+            shutil.rmtree(wave_dir, ignore_errors=True)
+    if failed == len(ranges):
+        raise RuntimeError(f"Ни один блок {audio_path.name} не диаризован")
+    stats = dict(linker.stats, blocks=len(ranges), failed_blocks=failed, speakers=len(linker.centroids))
+    logger.info(f"🔗 {audio_path.name}: {stats['speakers']} глобальных спикеров из {len(ranges)} блоков "
+                f"(связано {stats['linked']}, новых {stats['new']}, присоединено коротких {stats['forced']}, "
+                f"блоков без результата {failed})")
+    return sorted(segments), stats
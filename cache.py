@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Кэш результатов на диске с адресацией по содержимому аудио, модели и конфигурации диаризатора."""
+import os
+import json
+import contextlib
+import time
+import shutil
+import hashlib
+import uuid
+import logging
+import threading
+from pathlib import Path
+
+import soundfile as sf
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path("cache")
+CACHE_MAX_MB = int(os.environ.get("RESULT_CACHE_MAX_MB", "2048"))
+HASH_BLOCK = 16000 * 60  # Хэшируем аудио блоками по минуте
+DIGEST_MEMO_MAX = 20000  # Файлов в памятке хэшей; старые вытесняются
+EVICT_TARGET = 0.9  # Вытеснение освобождает кэш до этой доли бюджета, чтобы не сканировать диск на каждой записи
+# Поля конфигурации, которые меняются от запуска к запуску и не влияют на результат
+VOLATILE_CONFIG_KEYS = ("manifest_filepath", "out_dir")
+# Разделы конфигурации, от которых зависят VAD и эмбеддинги (но не кластеризация)
+FEATURE_CONFIG_SECTIONS = ("oracle_vad", "vad", "speaker_embeddings")
+
+
+def audio_digest(wav_path: Path) -> str:
+    """SHA-256 декодированного 16 кГц PCM (float32), читаемого блоками."""
+    info = sf.info(str(wav_path))
+    if info.samplerate != 16000:
+        raise ValueError(f"Аудио должно быть 16kHz, а не {info.samplerate}Hz")
+    digest = hashlib.sha256()
+    for block in sf.blocks(str(wav_path), blocksize=HASH_BLOCK, dtype="float32"):
+        digest.update(block.tobytes())
+    return digest.hexdigest()
+
+
+def config_digest(config_path: Path, sections: tuple = None) -> str:
+    """Нормализованный дайджест конфигурации диаризатора (порядок ключей и форматирование не важны).
+
+    sections — учитывать только эти подразделы diarizer (и sample_rate).
+    """
+    from omegaconf import OmegaConf
+    config = OmegaConf.to_container(OmegaConf.load(config_path), resolve=True)
+    for key in VOLATILE_CONFIG_KEYS:
+        config.get("diarizer", {}).pop(key, None)
+    if sections is not None:
+        diarizer = config.get("diarizer", {})
+        config = {"sample_rate": config.get("sample_rate"),
+                  "diarizer": {key: diarizer[key] for key in sections if key in diarizer}}
+    normalized = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+class ResultCache:
+    """LRU-кэш результатов: каждая запись — папка cache/<ключ[:2]>/<ключ>.
+
+    Время последнего доступа хранится в mtime папки записи, поэтому кэш можно
+    безопасно делить между main.py и server.py без общего индекса. Размер кэша
+    процесс ведёт сам (запись добавляет свой размер, вытеснение вычитает); диск
+    сканируется один раз при первом сохранении и заново, только когда бюджет
+    превышен — чтобы учесть записи других процессов перед вытеснением.
+
+    Хэши аудио запоминаются в digests.jsonl (строка на файл, дописывается), по
+    последнему размеру и mtime каждого пути; файл сжимается, когда в нём вдвое
+    больше строк, чем актуальных записей.
+    """
+
+    def __init__(self, root: Path = CACHE_DIR, max_mb: int = CACHE_MAX_MB):
+        self.root = root
+        self.max_bytes = max_mb * 2 ** 20
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._digests_path = root / "digests.jsonl"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._digests, self._digest_lines = self._load_digests()
+        self._sizes = None  # {папка записи: байты}; None — ещё не сканировали
+        self._total = 0
+
+    def _load_digests(self) -> tuple:
+        """Памятка {путь: (размер, mtime_ns, хэш)} и число строк в файле."""
+        digests, lines = {}, 0
+        try:
+            with open(self._digests_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        path, size, mtime_ns, digest = json.loads(line)
+                    except ValueError:
+                        continue  # Недописанная строка после сбоя
+                    digests.pop(path, None)
+                    digests[path] = (size, mtime_ns, digest)
+                    lines += 1
+        except OSError:
+            pass
+        while len(digests) > DIGEST_MEMO_MAX:
+            digests.pop(next(iter(digests)))
+        return digests, lines
+
+    def _compact_digests(self):
+        tmp_path = self._digests_path.with_name(f".{self._digests_path.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for path, (size, mtime_ns, digest) in self._digests.items():
+                f.write(json.dumps([path, size, mtime_ns, digest]) + "\n")
+        os.replace(tmp_path, self._digests_path)
+        self._digest_lines = len(self._digests)
+
+    def file_digest(self, wav_path: Path) -> str:
+        """Хэш аудио с мемоизацией по пути, размеру и mtime файла."""
+        stat = wav_path.stat()
+        path = str(wav_path.resolve())
+        with self._lock:
+            memo = self._digests.get(path)
+        if memo is not None and memo[:2] == (stat.st_size, stat.st_mtime_ns):
+            return memo[2]
+        digest = audio_digest(wav_path)
+        with self._lock:
+            self._digests.pop(path, None)
+            self._digests[path] = (stat.st_size, stat.st_mtime_ns, digest)
+            while len(self._digests) > DIGEST_MEMO_MAX:
+                self._digests.pop(next(iter(self._digests)))
+            if self._digest_lines >= 2 * max(len(self._digests), 1000):
+                self._compact_digests()
+            else:
+                # Короткая строка одним write в режиме append не перемешивается с записями других процессов
+                with open(self._digests_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps([path, stat.st_size, stat.st_mtime_ns, digest]) + "\n")
+                self._digest_lines += 1
+        return digest
+
+    def key_for(self, wav_path: Path, language: str, model_type: str, model_name: str,
+                diarization: bool, config_path: Path = None, **options) -> str:
+        """Ключ записи: аудио + модель + (для диаризации) конфигурация + режимы обработки."""
+        parts = {
+            "audio": self.file_digest(wav_path),
+            "model": [language, model_type, model_name],
+            "diarization": config_digest(config_path) if diarization else None,
+            "options": options,
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def features_key(self, wav_path: Path, config_path: Path) -> str:
+        """Ключ признаков диаризации (VAD, сабсегменты, эмбеддинги): не зависит от параметров кластеризации."""
+        parts = {
+            "audio": self.file_digest(wav_path),
+            "features": config_digest(config_path, FEATURE_CONFIG_SECTIONS),
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def lookup(self, key: str) -> Path:
+        """Возвращает папку записи (и отмечает доступ) или None."""
+        entry = self._entry_dir(key)
+        with self._lock:
+            if entry.is_dir():
+                os.utime(entry)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def store(self, key: str, staging_dir: Path) -> Path:
+        """Переносит подготовленную папку в кэш атомарным переименованием и вытесняет старые записи."""
+        entry = self._entry_dir(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        size = _dir_size(staging_dir)
+        with self._lock:
+            if self._sizes is None:
+                self._scan()
+            try:
+                os.replace(staging_dir, entry)
+            except OSError:
+                # Запись уже сохранил другой поток или процесс — подготовленная копия не нужна
+                if not entry.exists():
+                    raise
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            else:
+                self._sizes[entry] = size
+                self._total += size
+            if self._total > self.max_bytes:
+                self._scan()
+                self._evict()
+        return entry
+
+    @contextlib.contextmanager
+    def staging(self):
+        """Временная папка внутри кэша (на том же диске, чтобы store() был атомарным).
+
+        Если запись так и не была сохранена через store() (например, из-за ошибки),
+        папка удаляется при выходе из блока.
+        """
+        path = self.root / "tmp" / f"{os.getpid()}-{threading.get_ident()}-{time.time_ns()}"
+        path.mkdir(parents=True)
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _entries(self) -> list:
+        return [entry for shard in self.root.iterdir() if shard.is_dir() and shard.name != "tmp"
+                for entry in shard.iterdir() if entry.is_dir()]
+
+    def _scan(self):
+        """Пересчитывает размеры записей с диска (учитывает записи других процессов)."""
+        self._sizes = {entry: _dir_size(entry) for entry in self._entries()}
+        self._total = sum(self._sizes.values())
+
+    def _evict(self):
+        """Удаляет давно не читанные записи, пока кэш не уменьшится до EVICT_TARGET бюджета."""
+        if self._total <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICT_TARGET
+        entries = []
+        for entry in self._sizes:
+            try:
+                entries.append((entry.stat().st_mtime, entry))
+            except OSError:
+                continue  # Уже удалена другим процессом
+        for _, entry in sorted(entries, key=lambda item: item[0]):
+            if self._total <= target:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            self._total -= self._sizes.pop(entry)
+            logger.info(f"🧹 Вытеснена запись кэша {entry.name[:12]}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._sizes is None:
+                self._scan()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._sizes),
+                "size_mb": self._total / 2 ** 20,
+                "max_mb": self.max_bytes / 2 ** 20,
+            }
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""CPU-бэкенд моделей ASR для узлов без GPU.
+
+Поверх NemoBackend добавляет:
+- динамическое int8-квантование линейных слоёв энкодера (внимание и feed-forward
+  Conformer — основная часть вычислений; свёртки остаются fp32);
+- экспорт энкодера в TorchScript или ONNX с артефактом, закэшированным в
+  MODELS_DIR/cpu (повторные запуски только загружают его);
+- явное число intra-op и inter-op потоков torch;
+- autocast bf16 там, где у процессора есть инструкции bf16 (AVX512-BF16, AMX).
+
+Выбирается через --backend cpu (параметры --cpu_*) или ASR_BACKEND=cpu с
+настройками из переменных окружения ниже. Диаризатор работает без изменений,
+но с теми же настройками потоков.
+"""
+import os
+import copy
+import logging
+from pathlib import Path
+
+import registry
+from main import NemoBackend
+
+logger = logging.getLogger(__name__)
+
+CPU_THREADS = int(os.environ.get("ASR_CPU_THREADS", "0"))  # 0 — оставить значение torch (по числу ядер)
+CPU_INTEROP_THREADS = int(os.environ.get("ASR_CPU_INTEROP_THREADS", "0"))
+CPU_QUANTIZE = os.environ.get("ASR_CPU_QUANTIZE", "int8")  # int8 или none
+CPU_BF16 = os.environ.get("ASR_CPU_BF16", "0") == "1"
+CPU_EXPORT = os.environ.get("ASR_CPU_EXPORT") or None  # torchscript или onnx
+EXPORT_DIR = registry.MODELS_DIR / "cpu"
+QUANTIZE_MODES = ("none", "int8")
+EXPORT_FORMATS = {"torchscript": ".ts", "onnx": ".onnx"}
+
+_threads_configured = False
+
+
+def bf16_supported() -> bool:
+    """Есть ли у процессора инструкции bf16; без них autocast bf16 на CPU медленнее fp32."""
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def configure_threads(threads: int = 0, interop_threads: int = 0):
+    """Задаёт число потоков torch один раз на процесс (0 — значение по умолчанию)."""
+    global _threads_configured
+    import torch
+    if _threads_configured:
+        return
+    _threads_configured = True
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            # Задаётся только до первой параллельной работы torch в процессе
+            logger.warning(f"⚠️ Не удалось задать межоператорные потоки: {e}")
+    logger.info(f"🧵 CPU: потоков {torch.get_num_threads()}, межоператорных {torch.get_num_interop_threads()}")
+
+
+class CpuASRModel:
+    """Модель NeMo, у которой transcribe() идёт в inference_mode и, при bf16, в autocast.
+
+    Остальные атрибуты (cfg, encoder и т.д.) берутся у исходной модели.
+    """
+
+    def __init__(self, model, bf16: bool = False):
+        self.model = model
+        self.bf16 = bf16
+
+    def transcribe(self, *args, **kwargs):
+        import torch
+        with torch.inference_mode(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.bf16):
+            return self.model.transcribe(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def _exported_encoder_class():
+    import torch
+
+    class ExportedEncoder(torch.nn.Module):
+        """Энкодер, forward которого выполняет экспортированный граф (TorchScript или сессия ONNX Runtime).
+
+        Атрибуты, которых нет у обёртки, берутся у исходного энкодера (subsampling,
+        размерности и т.п.). Если граф падает на входе (например, с кэшем
+        потокового режима), обёртка один раз предупреждает и дальше работает eager.
+        """
+
+        def __init__(self, encoder, runner, path: Path):
+            super().__init__()
+            self.eager = encoder
+            self.path = path
+            self._runner = runner
+            self._onnx = path.suffix == ".onnx"
+            self._failed = False
+
+        def forward(self, audio_signal, length, **kwargs):
+            if self._failed or any(value is not None for value in kwargs.values()):
+                return self.eager(audio_signal=audio_signal, length=length, **kwargs)
+            try:
+                if self._onnx:
+                    outputs = self._runner.run(None, {"audio_signal": audio_signal.cpu().numpy(),
+                                                      "length": length.cpu().numpy()})
+                    return torch.from_numpy(outputs[0]), torch.from_numpy(outputs[1])
+                return self._runner(audio_signal, length)
+            except Exception as e:
+                logger.warning(f"⚠️ Экспортированный энкодер {self.path.name} не сработал, дальше eager: {e}")
+                self._failed = True
+                return self.eager(audio_signal=audio_signal, length=length)
+
+        def __getattr__(self, name):
+            try:
+                return super().__getattr__(name)
+            except AttributeError:
+                return getattr(self._modules["eager"], name)
+
+    return ExportedEncoder
+
+
+class CpuBackend(NemoBackend):
+    """Модели NeMo на CPU с квантованием, экспортом энкодера, настройкой потоков и bf16."""
+
+    name = "cpu"
+    device = "cpu"
+
+    def __init__(self, threads: int = CPU_THREADS, interop_threads: int = CPU_INTEROP_THREADS,
+                 quantize: str = CPU_QUANTIZE, bf16: bool = CPU_BF16, export: str = CPU_EXPORT):
+        if quantize not in QUANTIZE_MODES:
+            raise ValueError(f"Квантование '{quantize}' не поддерживается. Доступно: {list(QUANTIZE_MODES)}")
+        if export is not None and export not in EXPORT_FORMATS:
+            raise ValueError(f"Формат экспорта '{export}' не поддерживается. Доступно: {list(EXPORT_FORMATS)}")
+        if bf16 and not bf16_supported():
+            logger.warning("⚠️ Процессор без инструкций bf16 (AVX512-BF16/AMX), bf16 отключён")
+            bf16 = False
+        self.threads = threads
+        self.interop_threads = interop_threads
+        self.quantize = quantize
+        self.bf16 = bf16
+        self.export = export
+
+    @property
+    def cache_tag(self) -> str:
+        """Метка для ключа кэша результатов: int8 и bf16 меняют текст, экспорт — нет."""
+        if self.quantize == "none" and not self.bf16:
+            return None
+        return "cpu-" + "-".join(part for part in (self.quantize if self.quantize != "none" else None,
+                                                  "bf16" if self.bf16 else None) if part)
+
+    def load_asr(self, model_type: str, model_name: str):
+        import torch
+        configure_threads(self.threads, self.interop_threads)
+        model = super().load_asr(model_type, model_name)
+        if self.export == "onnx":
+            # Динамически квантованные слои не экспортируются в ONNX: int8 делает ONNX Runtime
+            model.encoder = self._exported(model.encoder, model_name)
+        else:
+            if self.quantize == "int8":
+                model.encoder = torch.ao.quantization.quantize_dynamic(model.encoder, {torch.nn.Linear},
+                                                                       dtype=torch.qint8)
+            if self.export is not None:
+                model.encoder = self._exported(model.encoder, model_name)
+        logger.info(f"⚙️ CPU-модель {model_name}: квантование {self.quantize}, экспорт {self.export or 'нет'}, "
+                    f"bf16 {'да' if self.bf16 else 'нет'}")
+        return CpuASRModel(model, self.bf16)
+
+    def create_diarizer(self, config):
+        configure_threads(self.threads, self.interop_threads)
+        return super().create_diarizer(config)
+
+    def _exported(self, encoder, model_name: str):
+        """Подменяет энкодер экспортированным; артефакт создаётся при первом запуске."""
+        import torch
+        if self.export == "onnx":
+            try:
+                import onnxruntime  # noqa: F401
+            except ImportError:
+                raise RuntimeError("Для --cpu_export onnx нужен пакет onnxruntime (pip install onnxruntime)")
+        path = self._export_path(model_name)
+        if not path.exists():
+            self._export(encoder, path)
+        if self.export == "onnx":
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            if self.threads > 0:
+                options.intra_op_num_threads = self.threads
+            if self.interop_threads > 0:
+                options.inter_op_num_threads = self.interop_threads
+            runner = onnxruntime.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        else:
+            runner = torch.jit.load(str(path), map_location="cpu")
+        logger.info(f"📦 Экспортированный энкодер: {path}")
+        return _exported_encoder_class()(encoder, runner, path)
+
+    def _export_path(self, model_name: str) -> Path:
+        import torch
+        # Граф TorchScript привязан к версии torch, поэтому она входит в имя артефакта
+        version = torch.__version__.replace("+", "_")
+        return EXPORT_DIR / f"{model_name}.encoder.{self.quantize}.{version}{EXPORT_FORMATS[self.export]}"
+
+    def _export(self, encoder, path: Path):
+        logger.info(f"🛠️ Экспорт энкодера в {path.name} (один раз)...")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.tmp{path.suffix}")
+        # int8 для ONNX: сначала fp32-граф, затем квантование средствами ONNX Runtime
+        graph_path = tmp_path.with_name(f"{tmp_path.stem}.fp32{path.suffix}") if self._onnx_int8 else tmp_path
+        try:
+            # Экспорт NeMo перестраивает модули под граф — экспортируем копию, исходный энкодер остаётся eager
+            copy.deepcopy(encoder).export(str(graph_path))
+            if self._onnx_int8:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                quantize_dynamic(str(graph_path), str(tmp_path), weight_type=QuantType.QInt8)
+            os.replace(tmp_path, path)
+        finally:
+            for leftover in {graph_path, tmp_path}:
+                if leftover.exists():
+                    leftover.unlink()
+
+    @property
+    def _onnx_int8(self) -> bool:
+        return self.export == "onnx" and self.quantize == "int8"
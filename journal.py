@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Журнал пакетной обработки папки: состояние каждого файла на диске.
+
+Журнал — JSONL-файл в папке результатов: каждая смена состояния файла
+дописывается строкой, поэтому запись дешёвая даже для десятков тысяч файлов, а
+после падения процесса теряется не больше последней строки. При загрузке
+строки проигрываются по порядку, в конце прогона журнал сжимается до одной
+строки на файл.
+
+Состояния: pending → decoded → transcribed → diarized (с диаризацией), или
+failed. Файл считается готовым, если он дошёл до целевого состояния с той же
+конфигурацией, исходный файл не изменился (размер и mtime, а при их
+расхождении — SHA-256) и файлы результатов на месте. С resume готовые файлы
+пропускаются, а упавшие и прерванные повторяются, пока число попыток не
+достигнет max_attempts.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_NAME = "journal.jsonl"
+SUMMARY_NAME = "journal_summary.json"
+MAX_ATTEMPTS = 3
+STATES = ("pending", "decoded", "transcribed", "diarized", "failed")
+HASH_BLOCK = 2 ** 20
+
+
+def config_id(config: dict) -> str:
+    """Короткий дайджест параметров запуска (по нему сравниваются конфигурации прогонов)."""
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class Journal:
+    """Журнал одного прогона по папке (см. описание модуля).
+
+    config — параметры, от которых зависит результат (язык, модель, режимы);
+    готовность, записанная с другой конфигурацией, не засчитывается.
+    target — состояние, после которого файл готов: transcribed или diarized.
+    """
+
+    def __init__(self, path: Path, config: dict, target: str = "transcribed", resume: bool = False,
+                 max_attempts: int = MAX_ATTEMPTS):
+        if target not in STATES:
+            raise ValueError(f"Неизвестное состояние '{target}'. Доступно: {list(STATES)}")
+        self.path = path
+        self.config_id = config_id(config)
+        self.config = config
+        self.target = target
+        self.resume = resume
+        self.max_attempts = max(1, max_attempts)
+        self.started = time.time()
+        self.entries = self._load() if resume else {}
+        self.skipped = []
+        self.gave_up = []
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Без resume журнал начинается заново
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+
+    def _load(self) -> dict:
+        entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Недописанная строка после падения
+                    entries.setdefault(record["file"], {}).update(record)
+        except OSError:
+            pass
+        return entries
+
+    def plan(self, audio_files: list) -> list:
+        """Отмечает файлы прогона как pending и возвращает те, что нужно обработать."""
+        todo = []
+        for audio_file in audio_files:
+            entry = self.entries.get(str(audio_file))
+            if entry is not None and self._is_done(audio_file, entry):
+                self.skipped.append(audio_file)
+                continue
+            attempts = 0
+            if entry is not None and entry.get("config") == self.config_id and self._same_input(audio_file, entry):
+                attempts = entry.get("attempts", 0)
+                if entry.get("state") not in ("failed", self.target):
+                    # Прошлый прогон оборвался на этом файле — тоже попытка (файл мог уронить процесс)
+                    attempts += 1
+                if attempts >= self.max_attempts:
+                    self.gave_up.append(audio_file)
+                    logger.warning(f"⚠️ {audio_file.name}: {attempts} неудачных попыток, пропускаю "
+                                   f"(последняя ошибка: {entry.get('error')})")
+                    continue
+            todo.append(audio_file)
+            self.mark(audio_file, "pending", attempts=attempts, error=None)
+        if self.resume:
+            logger.info(f"📒 Журнал: готово {len(self.skipped)}, к обработке {len(todo)}, "
+                        f"пропущено после {self.max_attempts} попыток {len(self.gave_up)}")
+        return todo
+
+    def _is_done(self, audio_file: Path, entry: dict) -> bool:
+        return (entry.get("state") == self.target and entry.get("config") == self.config_id
+                and self._same_input(audio_file, entry)
+                and all(Path(result).exists() for result in entry.get("results", ())))
+
+    def _same_input(self, audio_file: Path, entry: dict) -> bool:
+        try:
+            stat = audio_file.stat()
+        except OSError:
+            return False
+        if entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+            return True
+        # Файл трогали (скопировали, восстановили из архива) — решает содержимое
+        return entry.get("sha256") is not None and entry["sha256"] == file_sha256(audio_file)
+
+    def mark(self, audio_file: Path, state: str, **data):
+        """Записывает новое состояние файла.
+
+        decoded дополнительно сохраняет размер, mtime и SHA-256 исходного файла
+        (дайджест лучше посчитать заранее в воркерах декодирования и передать как
+        sha256; без него файл хэшируется здесь), failed увеличивает число попыток,
+        целевое состояние сбрасывает их.
+        """
+        if state not in STATES:
+            raise ValueError(f"Неизвестное состояние '{state}'. Доступно: {list(STATES)}")
+        key = str(audio_file)
+        record = {"file": key, "state": state, "config": self.config_id, "time": time.time(), **data}
+        if state == "decoded":
+            stat = audio_file.stat()
+            record.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            if record.get("sha256") is None:
+                record["sha256"] = file_sha256(audio_file)
+        if "results" in record:
+            record["results"] = [str(result) for result in record["results"]]
+        with self._lock:
+            entry = self.entries.setdefault(key, {})
+            if state == "failed":
+                record["attempts"] = entry.get("attempts", 0) + 1
+            elif state == self.target:
+                record["attempts"] = 0
+                record["error"] = None
+            entry.update(record)
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            if state in ("failed", self.target):
+                os.fsync(self._file.fileno())
+
+    def fail(self, audio_file: Path, error):
+        self.mark(audio_file, "failed", error=str(error))
+
+    def summary(self, audio_files: list) -> dict:
+        """Сводка прогона по файлам audio_files."""
+        with self._lock:
+            entries = [self.entries.get(str(audio_file), {}) for audio_file in audio_files]
+        states = {state: 0 for state in STATES}
+        for entry in entries:
+            if entry.get("state") in states:
+                states[entry["state"]] += 1
+        return {
+            "config": self.config,
+            "target": self.target,
+            "resume": self.resume,
+            "files": len(audio_files),
+            "done": states[self.target],
+            "skipped_done": len(self.skipped),
+            "gave_up": [str(audio_file) for audio_file in self.gave_up],
+            "states": states,
+            "failed": [{"file": entry["file"], "error": entry.get("error"), "attempts": entry.get("attempts", 0)}
+                       for entry in entries if entry.get("state") == "failed"],
+            "wall_s": time.time() - self.started,
+        }
+
+    def close(self, audio_files: list, summary_path: Path = None) -> dict:
+        """Сжимает журнал до строки на файл и пишет сводку (по умолчанию journal_summary.json рядом)."""
+        summary = self.summary(audio_files)
+        with self._lock:
+            self._file.close()
+            tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+        summary_path = summary_path if summary_path is not None else self.path.with_name(SUMMARY_NAME)
+        tmp_path = summary_path.with_name(f".{summary_path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, summary_path)
+        return summary
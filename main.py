@@ -1,15 +1,41 @@
 #!/usr/bin/env python3
+from __future__ import annotations
+
 import os
 import sys
-import torch
+import json
+import time
+import importlib
+import shutil
+import bisect
+import contextlib
+import contextvars
+import difflib
+import tempfile
+import threading
+import weakref
 import soundfile as sf
-from pydub import AudioSegment
 from pathlib import Path
-from nemo.collections.asr.models import EncDecRNNTBPEModel, EncDecCTCModelBPE
-from nemo.collections.asr.models import ClusteringDiarizer
-from omegaconf import OmegaConf
+from typing import TYPE_CHECKING
+from collections.abc import Sequence
 import logging
 import argparse
+import registry
+from cache import ResultCache, config_digest
+from metrics import (span, timed, instrument, job_report, observe_file, JobReport, FILES, MODEL_LOAD_SECONDS, SEGMENTS,
+                     ASR_CALLS_SAVED, VAD_SKIPPED_SECONDS)
+from audio_io import decode_to_wav, open_shared_audio
+from batching import get_sizer, is_oom, release_memory, run_adaptive
+from journal import Journal, JOURNAL_NAME, MAX_ATTEMPTS
+from segment_plan import SegmentPlan, load_plan, log_plan, plan_segments
+from block_diarization import BlockPlan, diarize_blocks, is_long, load_block_plan, speaker_centroids
+from streaming import StreamPlan, load_stream_plan
+from speaker_index import SpeakerIndex, relabel_text
+
+# torch и NeMo импортируются при первом инференсе, а не при запуске (--help, проверка аргументов, кэш)
+if TYPE_CHECKING:
+    import torch
+    from nemo.collections.asr.models import ClusteringDiarizer
 
 # Настройка кодировки консоли для Windows
 if sys.platform == "win32":
@@ -22,147 +48,324 @@ logger = logging.getLogger(__name__)
 
 AUDIO_DIR = Path("audio")
 RESULTS_DIR = Path("results")
+DIARIZER_CONFIG = Path("diarizer_config.yaml")
+SEGMENT_BATCH_SECONDS = 120.0  # Бюджет аудио (с учётом паддинга) на один пакет сегментов
+LONG_FORM_CHUNK_SEC = 30.0  # Длина окна для длинных записей
+LONG_FORM_OVERLAP_SEC = 4.0  # Перекрытие соседних окон
+LONG_FORM_BATCH = 8  # Окон в одном вызове ASR
+CACHED_RESULTS = ("transcript.txt", "diarization.txt")  # Имена результатов внутри записи кэша
+FEATURE_ARTIFACTS = ("vad.json", "subsegments", "embeddings")  # Признаки диаризации для повторной кластеризации
+# Параметры кластеризации, которые можно переопределить при recluster()
+CLUSTERING_OVERRIDES = ("max_num_speakers", "max_rp_threshold", "sparse_search_volume", "enhanced_count_thres")
+_diarize_lock = threading.Lock()
+_model_locks = weakref.WeakKeyDictionary()  # Модель ASR -> блокировка transcribe()
+_model_locks_guard = threading.Lock()
+DIARIZE_POLL_SEC = 0.5  # Как часто проверять появление RTTM при пакетной диаризации
+PINNED_MAX_SAMPLES = 16000 * 600  # Длиннее 10 минут — копируем напрямую, не раздувая pinned-буфер
+_pinned = threading.local()  # Pinned-буфер для копирования аудио на GPU, свой у каждого потока
 AUDIO_DIR.mkdir(exist_ok=True)
 RESULTS_DIR.mkdir(exist_ok=True)
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
-if device == "cpu":
-    logger.warning("⚠️ GPU не обнаружен! Работа будет происходить на CPU — это очень медленно!")
-else:
-    logger.info(f"✅ Используется GPU: {torch.cuda.get_device_name(0)}")
+_device = None
 
-def load_asr_model(language: str, model_type: str, model_name: str) -> object:
-    transducer_models_en = [
-        "stt_en_conformer_transducer_large", "stt_en_conformer_transducer_large_ls",
-        "stt_en_conformer_transducer_medium", "stt_en_conformer_transducer_small",
-        "stt_en_conformer_transducer_xlarge", "stt_en_conformer_transducer_xxlarge",
-        "stt_en_contextnet_1024", "stt_en_contextnet_1024_mls",
-        "stt_en_contextnet_256", "stt_en_contextnet_256_mls",
-        "stt_en_contextnet_512", "stt_en_contextnet_512_mls",
-        "stt_en_fastconformer_transducer_large", "stt_en_fastconformer_transducer_large_ls",
-        "stt_en_fastconformer_transducer_xlarge", "stt_en_fastconformer_transducer_xxlarge",
-        "stt_enes_conformer_transducer_large", "stt_enes_conformer_transducer_large_codesw",
-        "stt_enes_contextnet_large"
-    ]
-    ctc_models_en = [
-        "stt_en_citrinet_1024", "stt_en_citrinet_1024_gamma_0_25",
-        "stt_en_citrinet_256", "stt_en_citrinet_256_gamma_0_25",
-        "stt_en_citrinet_512", "stt_en_citrinet_512_gamma_0_25",
-        "stt_en_conformer_ctc_large", "stt_en_conformer_ctc_large_ls",
-        "stt_en_conformer_ctc_medium", "stt_en_conformer_ctc_medium_ls",
-        "stt_en_conformer_ctc_small", "stt_en_conformer_ctc_small_ls",
-        "stt_en_conformer_ctc_xlarge", "stt_en_fastconformer_ctc_large",
-        "stt_en_fastconformer_ctc_large_ls", "stt_en_fastconformer_ctc_xlarge",
-        "stt_en_fastconformer_ctc_xxlarge", "stt_en_squeezeformer_ctc_large_ls",
-        "stt_en_squeezeformer_ctc_medium_large_ls", "stt_en_squeezeformer_ctc_medium_ls",
-        "stt_en_squeezeformer_ctc_small_ls", "stt_en_squeezeformer_ctc_small_medium_ls",
-        "stt_en_squeezeformer_ctc_xsmall_ls", "stt_enes_conformer_ctc_large",
-        "stt_enes_conformer_ctc_large_codesw", "stt_fr_no_hyphen_citrinet_1024_gamma_0_25",
-        "stt_fr_no_hyphen_conformer_ctc_large"
-    ]
-    transducer_models_ru = ["stt_ru_conformer_transducer_large"]
-    ctc_models_ru = ["stt_ru_conformer_ctc_large"]
-
-    if language == "ru":
-        if model_type == "transducer":
-            if model_name not in transducer_models_ru:
-                raise ValueError(f"Модель '{model_name}' не поддерживается для ru (transducer). Доступно: {transducer_models_ru}")
-            model_class = EncDecRNNTBPEModel
-        elif model_type == "ctc":
-            if model_name not in ctc_models_ru:
-                raise ValueError(f"Модель '{model_name}' не поддерживается для ru (ctc). Доступно: {ctc_models_ru}")
-            model_class = EncDecCTCModelBPE
+def model_lock(model) -> threading.Lock:
+    """Блокировка модели: transcribe() одной модели NeMo не потокобезопасен (задания воркера, поток)."""
+    with _model_locks_guard:
+        lock = _model_locks.get(model)
+        if lock is None:
+            lock = _model_locks[model] = threading.Lock()
+        return lock
+
+def get_device() -> str:
+    """Устройство для инференса; определяется (и импортирует torch) при первом обращении."""
+    global _device
+    if _device is None:
+        import torch
+        # Бэкенд может закрепить устройство (cpu_backend.CpuBackend)
+        pinned = getattr(get_backend(), "device", None)
+        _device = pinned or ("cuda" if torch.cuda.is_available() else "cpu")
+        if pinned is not None:
+            logger.info(f"🖥️ Инференс на {pinned} (бэкенд {get_backend().name})")
+        elif _device == "cpu":
+            logger.warning("⚠️ GPU не обнаружен! Работа будет происходить на CPU — это очень медленно! "
+                           "Попробуйте --backend cpu (int8-квантование и настройка потоков)")
         else:
-            raise ValueError(f"Тип модели '{model_type}' не поддерживается. Используйте 'transducer' или 'ctc'.")
-    elif language == "en":
-        if model_type == "transducer":
-            if model_name not in transducer_models_en:
-                raise ValueError(f"Модель '{model_name}' не поддерживается для en (transducer). Доступно: {transducer_models_en}")
-            model_class = EncDecRNNTBPEModel
-        elif model_type == "ctc":
-            if model_name not in ctc_models_en:
-                raise ValueError(f"Модель '{model_name}' не поддерживается для en (ctc). Доступно: {ctc_models_en}")
-            model_class = EncDecCTCModelBPE
+            logger.info(f"✅ Используется GPU: {torch.cuda.get_device_name(0)}")
+    return _device
+
+class NemoBackend:
+    """Бэкенд моделей по умолчанию: предобученные модели NeMo.
+
+    Бэкенд — любой объект с полем name и методами load_asr(model_type, model_name),
+    create_diarizer(config), detect_speech(diarizer, manifest_path, out_dir),
+    cluster(features_dir, uniq_id, config, num_speakers) и embed_speech(diarizer, pieces).
+    Модель ASR должна поддерживать transcribe() как у моделей NeMo, диаризатор —
+    _diarizer_params и diarize() как ClusteringDiarizer.
+    """
+
+    name = "nemo"
+
+    def load_asr(self, model_type: str, model_name: str):
+        from nemo.collections.asr.models import EncDecRNNTBPEModel, EncDecCTCModelBPE
+        model_class = EncDecRNNTBPEModel if model_type == "transducer" else EncDecCTCModelBPE
+        checkpoint = registry.local_checkpoint(model_name)
+        if checkpoint is not None:
+            # Локальный чекпойнт: без обращения к NGC / Hugging Face
+            logger.info(f"📦 Локальный чекпойнт {checkpoint}")
+            model = model_class.restore_from(str(checkpoint), map_location=get_device())
         else:
-            raise ValueError(f"Тип модели '{model_type}' не поддерживается. Используйте 'transducer' или 'ctc'.")
-    else:
-        raise ValueError(f"Язык '{language}' не поддерживается. Используйте 'ru' или 'en'.")
+            model = model_class.from_pretrained(model_name=model_name)
+            self._save_checkpoint(model, model_name)
+        model = model.to(get_device())
+        model.eval()
+        return model
+
+    def _save_checkpoint(self, model, model_name: str):
+        """Сохраняет скачанную модель в локальный кэш чекпойнтов для следующих запусков."""
+        path = registry.MODELS[model_name].local_path
+        tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.tmp.nemo")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            model.save_to(str(tmp_path))
+            os.replace(tmp_path, path)
+            registry.register_checkpoint(model_name, path)
+            logger.info(f"💾 Чекпойнт сохранён: {path}")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить чекпойнт {model_name}: {e}")
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
 
-    logger.info(f"📥 Загрузка модели ASR ({language}, {model_type}, {model_name})...")
-    model = model_class.from_pretrained(model_name=model_name)
-    model = model.to(device)
-    model.eval()
+    def create_diarizer(self, config):
+        from nemo.collections.asr.models import ClusteringDiarizer
+        return ClusteringDiarizer(cfg=config)
+
+    def detect_speech(self, diarizer, manifest_path: Path, out_dir: Path) -> Path:
+        """Только стадия VAD ClusteringDiarizer; возвращает манифест участков речи (vad_out.json)."""
+        from nemo.collections.asr.parts.utils.speaker_utils import audio_rttm_map
+        diarizer._diarizer_params.manifest_filepath = str(manifest_path)
+        diarizer._diarizer_params.out_dir = str(out_dir)
+        # Поля, которые diarize() заполняет перед VAD
+        diarizer._out_dir = str(out_dir)
+        diarizer._speaker_dir = str(out_dir / "speaker_outputs")
+        diarizer._vad_dir = str(out_dir / "vad_outputs")
+        diarizer._vad_out_file = str(out_dir / "vad_outputs" / "vad_out.json")
+        diarizer.AUDIO_RTTM_MAP = audio_rttm_map(str(manifest_path))
+        diarizer._perform_speech_activity_detection()
+        return Path(diarizer._speaker_manifest_path)
+
+    def cluster(self, features_dir: Path, uniq_id: str, config, num_speakers: int = None) -> list:
+        """Кластеризация ClusteringDiarizer по сохранённым эмбеддингам и таймстампам сабсегментов."""
+        import tempfile
+        import torch
+        from nemo.collections.asr.parts.utils.speaker_utils import (get_embs_and_timestamps, parse_scale_configs,
+                                                                    perform_clustering)
+        params = config.diarizer.speaker_embeddings.parameters
+        scales = parse_scale_configs(params.window_length_in_sec, params.shift_length_in_sec, params.multiscale_weights)
+        multiscale = {}
+        for scale_idx in scales["scale_dict"]:
+            name = f"subsegments_scale{scale_idx}"
+            embeddings = torch.load(features_dir / "embeddings" / f"{name}_embeddings.pt")
+            with open(features_dir / "subsegments" / f"{name}.json", "r", encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+            multiscale[scale_idx] = [embeddings, {uniq_id: [[e["offset"], e["offset"] + e["duration"]] for e in lines]}]
+        audio_rttm_map = {uniq_id: {"audio_filepath": uniq_id, "rttm_filepath": None, "num_speakers": num_speakers}}
+        with tempfile.TemporaryDirectory() as out_dir:
+            perform_clustering(get_embs_and_timestamps(multiscale, scales), audio_rttm_map, out_dir,
+                               config.diarizer.clustering.parameters, torch.device(get_device()), verbose=False)
+            return read_rttm(Path(out_dir) / f"{uniq_id}.rttm")
+
+    def embed_speech(self, diarizer, pieces: list):
+        """Эмбеддинги спикера (TitaNet диаризатора) для фрагментов аудио одним пакетом."""
+        import torch
+        device = get_device()
+        lengths = torch.tensor([len(piece) for piece in pieces], device=device)
+        batch = torch.zeros(len(pieces), int(lengths.max()), device=device)
+        for i, piece in enumerate(pieces):
+            batch[i, :len(piece)] = as_model_input(piece)
+        with torch.no_grad():
+            _, embeddings = diarizer._speaker_model.forward(input_signal=batch, input_signal_length=lengths)
+        return embeddings.float().cpu().numpy()
+
+# Бэкенды по имени: класс или "модуль:Класс" (импортируется при выборе)
+BACKENDS = {"nemo": NemoBackend, "cpu": "cpu_backend:CpuBackend", "stub": "benchmarks.stubs:StubBackend"}
+_backend = None
+
+def set_backend(name: str, **options):
+    """Выбирает бэкенд моделей для последующих load_asr_model() и load_diarizer().
+
+    options передаются конструктору бэкенда (например, threads и quantize для cpu).
+    """
+    global _backend, _device
+    if name not in BACKENDS:
+        raise ValueError(f"Бэкенд '{name}' не поддерживается. Доступно: {list(BACKENDS)}")
+    backend_class = BACKENDS[name]
+    if isinstance(backend_class, str):
+        module_name, class_name = backend_class.split(":")
+        backend_class = getattr(importlib.import_module(module_name), class_name)
+    _backend = backend_class(**options)
+    _device = None
+    return _backend
+
+def get_backend():
+    """Текущий бэкенд; по умолчанию берётся из переменной окружения ASR_BACKEND (nemo)."""
+    if _backend is None:
+        return set_backend(os.environ.get("ASR_BACKEND", "nemo"))
+    return _backend
+
+def load_asr_model(language: str, model_type: str, model_name: str) -> object:
+    registry.resolve(language, model_type, model_name)
+    logger.info(f"📥 Загрузка модели ASR ({language}, {model_type}, {model_name}, бэкенд {get_backend().name})...")
+    started = time.perf_counter()
+    with span("asr_model_load"):
+        model = get_backend().load_asr(model_type, model_name)
+    MODEL_LOAD_SECONDS.observe(time.perf_counter() - started, model=model_name)
     return model
 
+@timed("decode")
 def convert_to_wav(audio_path: Path) -> Path:
-    if audio_path.suffix.lower() != ".wav":
-        logger.info(f">> Конвертация {audio_path.name} в WAV...")
-        audio = AudioSegment.from_file(audio_path)
-        audio = audio.set_frame_rate(16000).set_channels(1)
-        wav_path = audio_path.with_suffix(".wav")
-        audio.export(wav_path, format="wav")
-        logger.info(f"✅ Сохранено: {wav_path.name}")
-        audio_path.unlink()
-        return wav_path
-    return audio_path
-
-def transcribe_audio(audio_path: Path, asr_model) -> str:
+    """Возвращает 16 кГц моно WAV для файла; исходный файл не удаляется.
+
+    Сжатые форматы и WAV с другой частотой потоково декодируются в DECODED_DIR.
+    """
+    return decode_to_wav(audio_path)
+
+def read_audio(audio_path: Path, audio_data=None):
+    """Возвращает уже открытый общий буфер аудио или отображает 16 кГц файл в память."""
+    if audio_data is not None:
+        return audio_data
+    return open_shared_audio(audio_path)
+
+def as_model_input(samples) -> torch.Tensor:
+    """Тензор для ASR без лишних копий.
+
+    На CPU это представление над массивом (в том числе над memmap). На GPU отсчёты
+    проходят через переиспользуемый pinned-буфер потока, из которого копирование
+    на устройство быстрее, чем из обычной памяти.
+    """
+    import torch
+    device = get_device()
+    tensor = torch.from_numpy(samples)
+    if device == "cpu" or tensor.numel() > PINNED_MAX_SAMPLES:
+        return tensor.to(device)
+    pinned = getattr(_pinned, "buffer", None)
+    if pinned is None or pinned.numel() < tensor.numel():
+        pinned = _pinned.buffer = torch.empty(tensor.numel(), dtype=torch.float32).pin_memory()
+    staged = pinned[:tensor.numel()]
+    staged.copy_(tensor)
+    return staged.to(device)
+
+def batch_sizer(kind: str):
+    """Общий BatchSizer вида работы (asr, embeddings) для текущего устройства."""
+    return get_sizer(kind, get_device())
+
+def release_cuda_cache():
+    """Отдаёт кэш CUDA-аллокатора; время вызова учитывается как стадия empty_cache.
+
+    Нужен только при выгрузке модели (model_cache): между пакетами и файлами кэш переиспользуется.
+    """
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return  # Инференса ещё не было
+    with span("empty_cache"):
+        torch.cuda.empty_cache()
+
+@timed("asr")
+def transcribe_audio(audio_path: Path, asr_model, audio_data=None) -> str:
+    import torch
     logger.info(f"🎙️ Распознавание речи для {audio_path.name}...")
-    audio_data, sample_rate = sf.read(audio_path)
-    if sample_rate != 16000:
-        raise ValueError(f"Аудио должно быть 16kHz, а не {sample_rate}Hz")
+    audio_data = read_audio(audio_path, audio_data)
 
-    audio_tensor = torch.tensor(audio_data, dtype=torch.float32).to(device)
-    with torch.no_grad():
-        hypotheses = asr_model.transcribe([audio_tensor], batch_size=1)
+    audio_tensor = as_model_input(audio_data)
+    try:
+        with model_lock(asr_model), torch.no_grad():
+            hypotheses = asr_model.transcribe([audio_tensor], batch_size=1)
+    except Exception as e:
+        if not is_oom(e):
+            raise
+        # Файл целиком не помещается в память — окна с ограниченным потреблением
+        del audio_tensor
+        release_memory(get_device())
+        batch_sizer("asr").oom(len(audio_data) / 16000)
+        logger.warning(f"⚠️ Не хватило памяти на {audio_path.name} целиком, распознаю окнами")
+        return transcribe_long_audio(audio_path, asr_model)
     text = hypotheses[0].text if hasattr(hypotheses[0], 'text') else hypotheses[0]
     logger.info(f"📝 Распознано: {text[:100]}...")
-    torch.cuda.empty_cache()
     return text
 
-def diarize_and_transcribe(audio_path: Path, asr_model) -> str:
-    logger.info(f"🗣️ Диаризация и распознавание для {audio_path.name}...")
+def stitch_words(previous: list, current: list, max_overlap_words: int) -> list:
+    """Склеивает слова соседних окон, убирая дубликат в зоне перекрытия."""
+    if not previous or not current:
+        return previous + current
+    tail = previous[-max_overlap_words:]
+    head = current[:max_overlap_words]
+    match = difflib.SequenceMatcher(None, tail, head, autojunk=False).find_longest_match(0, len(tail), 0, len(head))
+    if match.size == 0:
+        return previous + current
+    cut = len(previous) - len(tail) + match.a
+    return previous[:cut] + current[match.b:]
 
-    temp_dir = RESULTS_DIR / "temp_diarization"
-    temp_dir.mkdir(exist_ok=True)
+@timed("asr")
+def transcribe_long_audio(audio_path: Path, asr_model, chunk_sec: float = LONG_FORM_CHUNK_SEC,
+                          overlap_sec: float = LONG_FORM_OVERLAP_SEC, batch_size: int = LONG_FORM_BATCH) -> str:
+    """Распознаёт длинный файл перекрывающимися окнами с ограниченным потреблением памяти.
 
-    manifest_path = temp_dir / "manifest.json"
-    with open(manifest_path, "w", encoding="utf-8") as f:
-        import json
-        entry = {
-            "audio_filepath": str(audio_path.resolve()),
-            "offset": 0,
-            "duration": None,
-            "label": "infer",
-            "text": "-",
-            "rttm_filepath": "",
-            "uem_filepath": ""
-        }
-        f.write(json.dumps(entry) + "\n")
-
-    config_path = Path("diarizer_config.yaml")
+    Окна читаются с диска блоками через soundfile и распознаются пакетами, размер
+    которых подбирается по свободной памяти (не больше batch_size окон), а текст
+    соседних окон склеивается по совпадающим словам в зоне перекрытия.
+    """
+    import torch
+    logger.info(f"🎙️ Распознавание длинного файла {audio_path.name} окнами по {chunk_sec:.0f} с...")
+    info = sf.info(str(audio_path))
+    if info.samplerate != 16000:
+        raise ValueError(f"Аудио должно быть 16kHz, а не {info.samplerate}Hz")
+    if overlap_sec >= chunk_sec:
+        raise ValueError("Перекрытие окон должно быть меньше длины окна")
+
+    window = int(chunk_sec * info.samplerate)
+    overlap = int(overlap_sec * info.samplerate)
+    # Верхняя оценка числа слов в перекрытии (~4 слова в секунду)
+    max_overlap_words = int(overlap_sec * 4) + 2
+
+    words = []
+    blocks = (block.mean(axis=1) if block.ndim > 1 else block
+              for block in sf.blocks(str(audio_path), blocksize=window, overlap=overlap, dtype="float32"))
+
+    def run(batch):
+        nonlocal words
+        with model_lock(asr_model), torch.no_grad():
+            hypotheses = asr_model.transcribe([torch.from_numpy(block).to(get_device()) for block in batch],
+                                              batch_size=len(batch))
+        for hyp in hypotheses:
+            text = hyp.text if hasattr(hyp, 'text') else hyp
+            words = stitch_words(words, text.split(), max_overlap_words)
+
+    run_adaptive(blocks, run, batch_sizer("asr"), lambda block: len(block) / info.samplerate, max_items=batch_size)
+
+    text = " ".join(words)
+    logger.info(f"📝 Распознано: {text[:100]}...")
+    return text
+
+@timed("diarizer_load")
+def load_diarizer(config_path: Path = DIARIZER_CONFIG) -> ClusteringDiarizer:
+    """Загружает конфигурацию и создаёт ClusteringDiarizer (модели VAD и TitaNet)."""
     if not config_path.exists():
         logger.error(f"❌ Файл конфигурации {config_path} не найден!")
         raise FileNotFoundError(f"Файл {config_path} необходим для диаризации")
-    
+
+    from omegaconf import OmegaConf
     logger.info(f"📄 Загрузка конфигурации из {config_path}...")
     config = OmegaConf.load(config_path)
     logger.info(f"🔍 Конфигурация VAD: {config.diarizer.vad}")
+    started = time.perf_counter()
+    diarizer = get_backend().create_diarizer(config)
+    MODEL_LOAD_SECONDS.observe(time.perf_counter() - started, model="diarizer")
+    # Стадии внутри diarize(); остаток времени прогона учитывается как кластеризация
+    return instrument(diarizer, {"_perform_speech_activity_detection": "vad", "_run_segmentation": "segmentation",
+                                 "_extract_embeddings": "embeddings"})
 
-    config.diarizer.manifest_filepath = str(manifest_path)
-    config.diarizer.out_dir = str(temp_dir)
-
-    try:
-        diarizer = ClusteringDiarizer(cfg=config)
-        diarizer.diarize()
-    except Exception as e:
-        logger.error(f"❌ Ошибка диаризации: {e}")
-        raise
-
-    rttm_file = temp_dir / "pred_rttms" / (audio_path.stem + ".rttm")
-    if not rttm_file.exists():
-        raise FileNotFoundError(f"RTTM файл не создан: {rttm_file}")
-
+def read_rttm(rttm_file: Path) -> list:
+    """Читает RTTM и возвращает список сегментов (start, end, speaker) в порядке файла."""
     segments = []
     with open(rttm_file, "r", encoding="utf-8") as f:
         for line in f:
@@ -174,33 +377,743 @@ def diarize_and_transcribe(audio_path: Path, asr_model) -> str:
             end = start + duration
             speaker = parts[7]
             segments.append((start, end, speaker))
+    return segments
 
-    audio_data, sr = sf.read(audio_path)
-    if sr != 16000:
-        raise ValueError("Аудио должно быть 16kHz")
+@timed("segment_asr")
+def transcribe_batched(pieces: list, asr_model, batch_seconds: float = SEGMENT_BATCH_SECONDS,
+                       on_result=None, sample_rate: int = 16000) -> dict:
+    """Распознаёт фрагменты аудио пакетами и возвращает {ключ: текст}.
 
-    full_text = []
-    for start, end, speaker in segments:
-        start_sample = int(start * sr)
-        end_sample = int(end * sr)
-        if start_sample >= len(audio_data):
-            continue
-        segment_audio = audio_data[start_sample:end_sample]
-        if len(segment_audio) == 0:
+    pieces — список (ключ, массив отсчётов). Фрагменты сортируются по длительности,
+    чтобы в пакете было минимум паддинга, и группируются так, чтобы длина пакета с
+    учётом паддинга (самый длинный фрагмент × число фрагментов) укладывалась в
+    бюджет по свободной памяти (batching.py), но не больше batch_seconds секунд
+    аудио. При нехватке памяти пакет повторяется вдвое меньшим.
+    on_result(ключ, текст) вызывается для каждого фрагмента сразу после
+    распознавания его пакета.
+    """
+    import torch
+    pieces = sorted(pieces, key=lambda item: len(item[1]))
+    SEGMENTS.inc(len(pieces), kind="asr")
+    texts = {}
+    batches = 0
+
+    def run(batch):
+        nonlocal batches
+        tensors = [as_model_input(samples) for _, samples in batch]
+        with model_lock(asr_model), torch.no_grad():
+            hypotheses = asr_model.transcribe(tensors, batch_size=len(tensors))
+        batches += 1
+        for (key, _), hyp in zip(batch, hypotheses):
+            texts[key] = hyp.text if hasattr(hyp, 'text') else hyp
+            if on_result is not None:
+                on_result(key, texts[key])
+
+    run_adaptive(pieces, run, batch_sizer("asr"), lambda item: len(item[1]) / sample_rate, batch_seconds)
+    logger.info(f"📦 {len(pieces)} фрагментов в {batches} пакетах (бюджет до {batch_seconds:.0f} с)")
+    return texts
+
+def transcribe_segments(audio_data, segments: list, asr_model, sample_rate: int = 16000,
+                        batch_seconds: float = SEGMENT_BATCH_SECONDS, on_result=None) -> list:
+    """Распознаёт сегменты пакетами (см. transcribe_batched) и возвращает тексты в исходном порядке.
+
+    on_result(idx, text) вызывается для каждого сегмента сразу после распознавания его пакета.
+    """
+    pieces = []
+    for idx, (start, end, _) in enumerate(segments):
+        start_sample = int(start * sample_rate)
+        end_sample = int(end * sample_rate)
+        if start_sample >= len(audio_data) or end_sample <= start_sample:
             continue
-        segment_tensor = torch.tensor(segment_audio, dtype=torch.float32).to(device)
+        pieces.append((idx, audio_data[start_sample:end_sample]))
+    texts = transcribe_batched(pieces, asr_model, batch_seconds, on_result, sample_rate)
+    return [texts.get(idx, "") for idx in range(len(segments))]
 
-        with torch.no_grad():
-            hyp = asr_model.transcribe([segment_tensor], batch_size=1)
-        text = hyp[0].text if hasattr(hyp[0], 'text') else hyp[0]
-        if text:
-            full_text.append(f"[{speaker}] {start:.2f}-{end:.2f}s: {text}")
-        torch.cuda.empty_cache()
+def run_diarization(audio_path: Path, diarizer: ClusteringDiarizer = None, artifacts_dir: Path = None,
+                    block_plan: BlockPlan = None) -> list:
+    """Запускает диаризацию одного файла и возвращает сегменты (start, end, speaker).
+
+    Если задан artifacts_dir, туда копируются RTTM и признаки диаризации (VAD,
+    сабсегменты и эмбеддинги спикеров) до удаления временной папки.
+    С block_plan запись длиннее блока диаризуется по блокам (diarize_long).
+    """
+    if block_plan is not None and is_long(sf.info(str(audio_path)).duration, block_plan):
+        return diarize_long(audio_path, diarizer, block_plan, artifacts_dir=artifacts_dir)
+    # ClusteringDiarizer хранит состояние прогона в себе, поэтому параллельные вызовы сериализуются
+    with _diarize_lock:
+        return _run_diarization(audio_path, diarizer, artifacts_dir)
+
+def run_sized(diarizer: ClusteringDiarizer, run):
+    """Выполняет run() с размером пакета VAD и эмбеддингов диаризатора по свободной памяти.
+
+    batch_size из diarizer_config.yaml — верхняя граница. При нехватке памяти
+    прогон повторяется с вдвое меньшим пакетом.
+    """
+    if not hasattr(diarizer, "max_batch_size"):
+        diarizer.max_batch_size = int(diarizer._cfg.batch_size)
+    windows = diarizer._cfg.diarizer.speaker_embeddings.parameters.window_length_in_sec
+    # Окна мультимасштабных эмбеддингов — список; стоимость считаем по самому длинному
+    window = max(windows) if isinstance(windows, Sequence) else float(windows)
+    sizer = batch_sizer("embeddings")
+    batch_size = sizer.items(window, diarizer.max_batch_size)
+    while True:
+        diarizer._cfg.batch_size = batch_size
+        try:
+            with sizer.measure(batch_size * window):
+                return run()
+        except Exception as e:
+            if batch_size == 1 or not is_oom(e):
+                raise
+            release_memory(sizer.device)
+            sizer.oom(batch_size * window)
+            batch_size //= 2
+            logger.warning(f"⚠️ Нехватка памяти в диаризаторе, повтор с пакетом {batch_size}")
+
+@contextlib.contextmanager
+def scratch_dir(prefix: str = "artifacts_"):
+    """Своя на каждый вызов временная папка в RESULTS_DIR, удаляется на выходе.
+
+    Имя уникально (tempfile.mkdtemp), поэтому задания воркера и процессы с общей
+    рабочей папкой не удаляют чужие выходы диаризатора.
+    """
+    path = Path(tempfile.mkdtemp(prefix=prefix, dir=RESULTS_DIR))
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def diarize_long(audio_path: Path, diarizer: ClusteringDiarizer = None, plan: BlockPlan = BlockPlan(),
+                 audio_data=None, artifacts_dir: Path = None) -> list:
+    """Блочная диаризация длинной записи (block_diarization.py): сегменты с метками, общими для всех блоков.
+
+    В artifacts_dir пишется только итоговый RTTM: признаки блоков не подходят для recluster().
+    """
+    audio_data = read_audio(audio_path, audio_data)
+    if diarizer is None:
+        diarizer = load_diarizer()
+    with scratch_dir("temp_block_diarization_") as work_dir:
+        segments, _ = diarize_blocks(audio_path, audio_data, diarize_many, diarizer, plan, work_dir)
+    if artifacts_dir is not None:
+        write_rttm(artifacts_dir / "diarization.rttm", audio_path.stem, segments)
+    return segments
+
+def write_rttm(rttm_file: Path, uniq_id: str, segments: list):
+    with open(rttm_file, "w", encoding="utf-8") as f:
+        for start, end, speaker in segments:
+            f.write(f"SPEAKER {uniq_id} 1 {start:.3f} {end - start:.3f} <NA> <NA> {speaker} <NA> <NA>\n")
+
+def _write_manifest(manifest_path: Path, audio_paths: list):
+    """Пишет манифест NeMo: по строке на файл."""
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        for audio_path in audio_paths:
+            entry = {
+                "audio_filepath": str(audio_path.resolve()),
+                "offset": 0,
+                "duration": None,
+                "label": "infer",
+                "text": "-",
+                "rttm_filepath": "",
+                "uem_filepath": ""
+            }
+            f.write(json.dumps(entry) + "\n")
+
+def _run_diarization(audio_path: Path, diarizer: ClusteringDiarizer, artifacts_dir: Path) -> list:
+    with scratch_dir("temp_diarization_") as temp_dir:
+        return _diarize_in(audio_path, diarizer, artifacts_dir, temp_dir)
+
+def _diarize_in(audio_path: Path, diarizer: ClusteringDiarizer, artifacts_dir: Path, temp_dir: Path) -> list:
+    manifest_path = temp_dir / "manifest.json"
+    _write_manifest(manifest_path, [audio_path])
+
+    if diarizer is None:
+        diarizer = load_diarizer()
+
+    # Диаризатор переиспользуется между файлами: меняем только манифест и выходную папку
+    diarizer._diarizer_params.manifest_filepath = str(manifest_path)
+    diarizer._diarizer_params.out_dir = str(temp_dir)
+
+    try:
+        with span("diarize", rest="clustering"):
+            run_sized(diarizer, diarizer.diarize)
+    except Exception as e:
+        logger.error(f"❌ Ошибка диаризации: {e}")
+        raise
+
+    rttm_file = temp_dir / "pred_rttms" / (audio_path.stem + ".rttm")
+    if not rttm_file.exists():
+        raise FileNotFoundError(f"RTTM файл не создан: {rttm_file}")
+
+    segments = read_rttm(rttm_file)
+    SEGMENTS.inc(len(segments), kind="diarization")
+
+    if artifacts_dir is not None:
+        _save_artifacts(temp_dir, audio_path.stem, rttm_file, artifacts_dir)
 
-    import shutil
-    shutil.rmtree(temp_dir, ignore_errors=True)
+    return segments
 
-    return "\n".join(full_text)
+def diarize_many(audio_paths: list, diarizer: ClusteringDiarizer = None, on_result=None,
+                 out_dir: Path = None) -> dict:
+    """Диаризует несколько файлов одним прогоном ClusteringDiarizer по общему манифесту.
+
+    VAD и извлечение эмбеддингов идут пакетами сразу по всем файлам. Для каждого
+    файла создаётся своя папка (diarization.rttm и его признаки), и как только
+    RTTM файла готов, вызывается on_result(audio_path, segments, file_dir) — не
+    дожидаясь кластеризации остальных. Папки удаляются после возврата из функции.
+    Без out_dir выходы пишутся в свою временную папку (scratch_dir).
+    Возвращает {audio_path: segments}; для файлов без RTTM значение None.
+    """
+    scratch = contextlib.nullcontext(out_dir) if out_dir is not None else scratch_dir("temp_diarization_batch_")
+    with _diarize_lock, scratch as out_dir:
+        if diarizer is None:
+            diarizer = load_diarizer()
+        results = {}
+        for group in _unique_stem_groups(audio_paths):
+            results.update(_diarize_group(group, diarizer, on_result, out_dir))
+        return results
+
+def _unique_stem_groups(audio_paths: list) -> list:
+    """Делит файлы на группы без повторяющихся имён.
+
+    NeMo именует выходы по имени файла без расширения, поэтому одноимённые файлы
+    идут разными прогонами.
+    """
+    groups = []
+    for audio_path in audio_paths:
+        group = next((g for g in groups if all(p.stem != audio_path.stem for p in g)), None)
+        if group is None:
+            group = []
+            groups.append(group)
+        group.append(audio_path)
+    return groups
+
+def _diarize_group(audio_paths: list, diarizer: ClusteringDiarizer, on_result, out_dir: Path) -> dict:
+    shutil.rmtree(out_dir, ignore_errors=True)
+    out_dir.mkdir(parents=True)
+    manifest_path = out_dir / "manifest.json"
+    _write_manifest(manifest_path, audio_paths)
+    diarizer._diarizer_params.manifest_filepath = str(manifest_path)
+    diarizer._diarizer_params.out_dir = str(out_dir)
+    logger.info(f"🗣️ Пакетная диаризация {len(audio_paths)} файлов...")
+
+    failure = []
+
+    def run():
+        try:
+            with span("diarize", rest="clustering"):
+                run_sized(diarizer, diarizer.diarize)
+        except Exception as e:
+            failure.append(e)
+
+    # Копия контекста — чтобы тайминги диаризации попали в отчёт текущего задания
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(run,), name="diarize-batch", daemon=True)
+    thread.start()
+    rttm_dir = out_dir / "pred_rttms"
+    embeddings = None
+    results = {}
+    pending = list(audio_paths)
+    try:
+        while pending:
+            finished = not thread.is_alive()
+            if failure:
+                logger.error(f"❌ Ошибка диаризации: {failure[0]}")
+                raise failure[0]
+            # RTTM пишутся в порядке манифеста: файл дописан, если появился RTTM одного из следующих
+            rttm_file = rttm_dir / (pending[0].stem + ".rttm")
+            later = finished or any((rttm_dir / (p.stem + ".rttm")).exists() for p in pending[1:])
+            if not later:
+                thread.join(DIARIZE_POLL_SEC)
+                continue
+            audio_path = pending.pop(0)
+            if not rttm_file.exists():
+                logger.error(f"❌ RTTM файл не создан: {rttm_file}")
+                results[audio_path] = None
+                continue
+            # К началу кластеризации VAD и эмбеддинги всех файлов уже сохранены
+            file_dir = out_dir / "files" / audio_path.stem
+            file_dir.mkdir(parents=True)
+            embeddings = _save_artifacts(out_dir, audio_path.stem, rttm_file, file_dir, embeddings)
+            results[audio_path] = read_rttm(rttm_file)
+            SEGMENTS.inc(len(results[audio_path]), kind="diarization")
+            if on_result is not None:
+                on_result(audio_path, results[audio_path], file_dir)
+    finally:
+        thread.join()
+        shutil.rmtree(out_dir, ignore_errors=True)
+    return results
+
+def _filter_manifest(manifest_path: Path, uniq_id: str, dest: Path):
+    """Копирует строки манифеста NeMo, относящиеся к одному файлу."""
+    with open(manifest_path, "r", encoding="utf-8") as src, open(dest, "w", encoding="utf-8") as f:
+        for line in src:
+            if line.strip() and Path(json.loads(line)["audio_filepath"]).stem == uniq_id:
+                f.write(line)
+
+def _save_artifacts(out_dir: Path, uniq_id: str, rttm_file: Path, dest: Path, embeddings: dict = None) -> dict:
+    """Копирует из выходной папки диаризатора RTTM и признаки одного файла.
+
+    Признаки — то, из чего можно заново кластеризовать без VAD и извлечения
+    эмбеддингов (см. recluster): vad.json, subsegments/ (таймстампы окон по
+    масштабам) и embeddings/. embeddings — уже загруженные файлы эмбеддингов
+    прогона (имя → {uniq_id: тензор}); возвращаются, чтобы пакетный прогон
+    читал их с диска один раз.
+    """
+    import torch
+    speaker_dir = out_dir / "speaker_outputs"
+    if embeddings is None:
+        embeddings = {f.name: torch.load(f) for f in sorted((speaker_dir / "embeddings").glob("*.pt"))}
+    shutil.copy2(rttm_file, dest / "diarization.rttm")
+    (dest / "embeddings").mkdir(exist_ok=True)
+    for name, per_file in embeddings.items():
+        if uniq_id in per_file:
+            torch.save({uniq_id: per_file[uniq_id]}, dest / "embeddings" / name)
+    (dest / "subsegments").mkdir(exist_ok=True)
+    for manifest_path in sorted(speaker_dir.glob("subsegments_scale*.json")):
+        _filter_manifest(manifest_path, uniq_id, dest / "subsegments" / manifest_path.name)
+    vad_manifest = out_dir / "vad_outputs" / "vad_out.json"
+    if vad_manifest.is_file():
+        _filter_manifest(vad_manifest, uniq_id, dest / "vad.json")
+    return embeddings
+
+@timed("vad_gate")
+def detect_speech(audio_paths: list, diarizer: ClusteringDiarizer = None, out_dir: Path = None) -> dict:
+    """Находит участки речи стадией VAD диаризатора (настройки diarizer.vad из diarizer_config.yaml).
+
+    Все файлы проходят VAD одним прогоном. Возвращает {audio_path: [(start, end), ...]}
+    в порядке времени; у файлов без речи список пуст.
+    """
+    scratch = contextlib.nullcontext(out_dir) if out_dir is not None else scratch_dir("temp_vad_")
+    regions = {}
+    with _diarize_lock, scratch as out_dir:
+        if diarizer is None:
+            diarizer = load_diarizer()
+        for group in _unique_stem_groups(audio_paths):
+            shutil.rmtree(out_dir, ignore_errors=True)
+            out_dir.mkdir(parents=True)
+            try:
+                manifest_path = out_dir / "manifest.json"
+                _write_manifest(manifest_path, group)
+                speech = {audio_path.stem: [] for audio_path in group}
+                vad_manifest = run_sized(diarizer, lambda: get_backend().detect_speech(diarizer, manifest_path, out_dir))
+                with open(vad_manifest, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        entry = json.loads(line)
+                        stem = Path(entry["audio_filepath"]).stem
+                        if stem in speech:
+                            speech[stem].append((entry["offset"], entry["offset"] + entry["duration"]))
+                regions.update((audio_path, sorted(speech[audio_path.stem])) for audio_path in group)
+            finally:
+                shutil.rmtree(out_dir, ignore_errors=True)
+    return regions
+
+def transcribe_speech(files: list, asr_model, batch_seconds: float = SEGMENT_BATCH_SECONDS,
+                      sample_rate: int = 16000) -> dict:
+    """Распознаёт только участки речи нескольких файлов общими пакетами (см. transcribe_batched).
+
+    files — список (ключ, аудио, [(start, end), ...]); возвращает {ключ: [(start, end, текст), ...]}.
+    """
+    pieces = []
+    for key, audio_data, regions in files:
+        for idx, (start, end) in enumerate(regions):
+            samples = audio_data[int(start * sample_rate):int(end * sample_rate)]
+            if len(samples):
+                pieces.append(((key, idx), samples))
+    texts = transcribe_batched(pieces, asr_model, batch_seconds, sample_rate=sample_rate)
+    return {key: [(start, end, texts.get((key, idx), "")) for idx, (start, end) in enumerate(regions)]
+            for key, _, regions in files}
+
+def format_speech(regions) -> str:
+    """Склеивает распознанные участки речи (start, end, text) в текст с таймстампами."""
+    return "\n".join(f"{start:.2f}-{end:.2f}s: {text}" for start, end, text in regions if text)
+
+def report_skipped(name: str, audio_seconds: float, regions: list) -> float:
+    """Учитывает аудио без речи, которое не пошло в ASR, и возвращает его долю."""
+    skipped = max(0.0, audio_seconds - sum(end - start for start, end in regions))
+    VAD_SKIPPED_SECONDS.inc(skipped)
+    fraction = skipped / audio_seconds if audio_seconds > 0 else 0.0
+    logger.info(f"🔇 {name}: пропущено {fraction:.0%} аудио без речи ({skipped:.1f} из {audio_seconds:.1f} с)")
+    return fraction
+
+def transcribe_gated(audio_path: Path, asr_model, diarizer: ClusteringDiarizer = None,
+                     batch_seconds: float = SEGMENT_BATCH_SECONDS, audio_data=None) -> tuple:
+    """ASR только по участкам речи одного файла: возвращает (текст с таймстампами, доля пропущенного аудио)."""
+    logger.info(f"🎙️ Распознавание участков речи {audio_path.name}...")
+    audio_data = read_audio(audio_path, audio_data)
+    regions = detect_speech([audio_path], diarizer)[audio_path]
+    skipped = report_skipped(audio_path.name, len(audio_data) / 16000, regions)
+    turns = transcribe_speech([(audio_path, audio_data, regions)], asr_model, batch_seconds)[audio_path]
+    return format_speech(turns), skipped
+
+def load_block_diarization(config_path: Path = DIARIZER_CONFIG) -> BlockPlan:
+    """Параметры блочной диаризации из конфигурации диаризатора (без файла — значения по умолчанию)."""
+    if not config_path.exists():
+        return BlockPlan()
+    from omegaconf import OmegaConf
+    return load_block_plan(OmegaConf.load(config_path))
+
+def load_streaming(config_path: Path = DIARIZER_CONFIG) -> StreamPlan:
+    """Параметры потокового режима из конфигурации диаризатора (без файла — значения по умолчанию)."""
+    if not config_path.exists():
+        return StreamPlan()
+    from omegaconf import OmegaConf
+    return load_stream_plan(OmegaConf.load(config_path))
+
+def transcribe_chunk(samples, asr_model) -> str:
+    """Распознаёт короткий фрагмент потока (без логов на каждый вызов, как у transcribe_audio)."""
+    import torch
+    with span("stream_asr"), model_lock(asr_model), torch.no_grad():
+        hypothesis = asr_model.transcribe([as_model_input(samples)], batch_size=1)[0]
+    return hypothesis.text if hasattr(hypothesis, 'text') else hypothesis
+
+def embed_speech(pieces: list, diarizer: ClusteringDiarizer):
+    """Эмбеддинги спикера для фрагментов потока (см. NemoBackend.embed_speech).
+
+    Модель спикера общая с пакетной диаризацией, поэтому вызов ждёт _diarize_lock.
+    """
+    with span("stream_embeddings"), _diarize_lock:
+        return get_backend().embed_speech(diarizer, pieces)
+
+def load_segment_plan(config_path: Path = DIARIZER_CONFIG) -> SegmentPlan:
+    """Параметры плана сегментов из конфигурации диаризатора (без файла — значения по умолчанию)."""
+    if not config_path.exists():
+        return SegmentPlan()
+    from omegaconf import OmegaConf
+    return load_plan(OmegaConf.load(config_path))
+
+def format_diarization(turns) -> str:
+    """Форматирует реплики (start, end, speaker, text) в текст диаризации."""
+    return "\n".join(f"[{speaker}] {start:.2f}-{end:.2f}s: {text}" for start, end, speaker, text in turns if text)
+
+def diarize_and_transcribe(audio_path: Path, asr_model, diarizer: ClusteringDiarizer = None,
+                           batch_seconds: float = SEGMENT_BATCH_SECONDS, progress=None,
+                           artifacts_dir: Path = None, audio_data=None, segments: list = None,
+                           block_plan: BlockPlan = None) -> str:
+    logger.info(f"🗣️ Диаризация и распознавание для {audio_path.name}...")
+
+    if segments is None:
+        segments = run_diarization(audio_path, diarizer, artifacts_dir, block_plan)
+    audio_data = read_audio(audio_path, audio_data)
+    sr = 16000
+    plan = load_segment_plan()
+    if plan is not None:
+        segments, stats = plan_segments(segments, audio_data, plan, sr)
+        log_plan(audio_path.name, stats)
+        ASR_CALLS_SAVED.inc(max(0, stats["calls_saved"]))
+        if progress is not None:
+            progress("segment_plan", file=audio_path.name, **stats)
+
+    on_result = None
+    if progress is not None:
+        def on_result(idx, text):
+            start, end, speaker = segments[idx]
+            progress("segment", file=audio_path.name, index=idx, total=len(segments),
+                     start=start, end=end, speaker=speaker, text=text)
+
+    texts = transcribe_segments(audio_data, segments, asr_model, sr, batch_seconds, on_result)
+    return format_diarization((start, end, speaker, text) for (start, end, speaker), text in zip(segments, texts))
+
+@timed("asr")
+def transcribe_with_words(audio_path: Path, asr_model, audio_data=None) -> tuple:
+    """Распознаёт файл один раз с таймстампами слов: возвращает (текст, [(start, end, word), ...])."""
+    import torch
+    logger.info(f"🎙️ Распознавание речи с таймстампами для {audio_path.name}...")
+    audio_data = read_audio(audio_path, audio_data)
+
+    audio_tensor = as_model_input(audio_data)
+    with model_lock(asr_model), torch.no_grad():
+        hypotheses = asr_model.transcribe([audio_tensor], batch_size=1, timestamps=True)
+    hyp = hypotheses[0]
+
+    # Старые версии NeMo отдают только смещения в кадрах энкодера
+    frame_sec = asr_model.cfg.preprocessor.window_stride * asr_model.cfg.encoder.get("subsampling_factor", 1)
+    words = []
+    for stamp in hyp.timestamp.get("word", []):
+        start = stamp["start"] if "start" in stamp else stamp["start_offset"] * frame_sec
+        end = stamp["end"] if "end" in stamp else stamp["end_offset"] * frame_sec
+        words.append((start, end, stamp["word"]))
+    logger.info(f"📝 Распознано: {hyp.text[:100]}... ({len(words)} слов)")
+    return hyp.text, words
+
+@timed("assign_speakers")
+def assign_speakers(words: list, segments: list) -> list:
+    """Назначает словам спикеров по максимальному пересечению с сегментами RTTM.
+
+    Подряд идущие слова одного спикера склеиваются в реплики (start, end, speaker, text).
+    Слова вне всех сегментов получают спикера ближайшего сегмента.
+    """
+    if not segments:
+        return []
+    segments = sorted(segments)
+    starts = [start for start, _, _ in segments]
+    max_len = max(end - start for start, end, _ in segments)
+
+    turns = []
+    for w_start, w_end, word in words:
+        best, best_overlap = None, 0.0
+        # Кандидаты — сегменты, начавшиеся до конца слова и не раньше, чем за max_len до его начала
+        k = bisect.bisect_left(starts, w_end) - 1
+        while k >= 0 and starts[k] >= w_start - max_len:
+            start, end, speaker = segments[k]
+            overlap = min(end, w_end) - max(start, w_start)
+            if overlap > best_overlap:
+                best, best_overlap = speaker, overlap
+            k -= 1
+        if best is None:
+            middle = (w_start + w_end) / 2
+            best = min(segments, key=lambda seg: min(abs(seg[0] - middle), abs(seg[1] - middle)))[2]
+
+        if turns and turns[-1][2] == best:
+            start, _, speaker, text = turns[-1]
+            turns[-1] = (start, w_end, speaker, f"{text} {word}")
+        else:
+            turns.append((w_start, w_end, best, word))
+    return turns
+
+def write_text_atomic(path: Path, text: str):
+    """Записывает текст во временный файл и атомарно заменяет им path."""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def process_file(audio_file: Path, asr_model, use_diarization: bool, diarizer: ClusteringDiarizer = None,
+                 segment_batch_sec: float = SEGMENT_BATCH_SECONDS, single_pass: bool = False,
+                 long_form: bool = False, results_dir: Path = RESULTS_DIR, progress=None,
+                 cache: ResultCache = None, cache_key: str = None, audio_data=None, diarized: tuple = None,
+                 vad_gate: bool = False, block_plan: BlockPlan = None, speaker_index: SpeakerIndex = None) -> list:
+    """Обрабатывает один аудиофайл и возвращает список созданных файлов результатов.
+
+    progress(event, **data), если задан, получает промежуточные результаты: готовый
+    текст файла ("transcript") и распознанные сегменты диаризации ("segment").
+    Если заданы cache и cache_key, результаты и RTTM сохраняются в кэш, а признаки
+    диаризации — в отдельную запись для recluster().
+    audio_data — общий буфер аудио (open_shared_audio), который разделяют все стадии.
+    diarized — готовый результат diarize_many: (сегменты, папка файла с RTTM и эмбеддингами).
+    vad_gate — без диаризации распознавать только участки речи, найденные VAD (transcribe_gated).
+    block_plan — диаризовать записи длиннее блока по блокам (diarize_long).
+    speaker_index — сохранить спикеров записи в индекс и подставить имена известных (index_speakers).
+    """
+    started = time.perf_counter()
+    skipped = None
+    wav_path = convert_to_wav(audio_file)
+    # Папка для артефактов записи кэша; при ошибке удаляется автоматически
+    if cache is not None:
+        staging_ctx = cache.staging()
+    elif speaker_index is not None and use_diarization:
+        # Без кэша эмбеддинги диаризации нужны только индексу спикеров
+        staging_ctx = scratch_dir()
+    else:
+        staging_ctx = contextlib.nullcontext()
+    with staging_ctx as staging:
+        output_file = results_dir / (wav_path.stem + ".txt")
+
+        if use_diarization and single_pass:
+            # Один проход ASR с таймстампами слов обслуживает оба результата
+            simple_asr, words = transcribe_with_words(wav_path, asr_model, audio_data)
+        elif vad_gate and not use_diarization:
+            simple_asr, skipped = transcribe_gated(wav_path, asr_model, diarizer, segment_batch_sec, audio_data)
+        elif long_form:
+            simple_asr = transcribe_long_audio(wav_path, asr_model)
+        else:
+            simple_asr = transcribe_audio(wav_path, asr_model, audio_data)
+        write_text_atomic(output_file, simple_asr)
+        print(f"✅ Сохранено: {output_file.name}")
+        result_files = [output_file]
+        if progress is not None:
+            progress("transcript", file=audio_file.name, text=simple_asr)
+
+        if use_diarization:
+            segments = None
+            if diarized is not None:
+                segments, diarized_dir = diarized
+                if staging is not None:
+                    shutil.copytree(diarized_dir, staging, dirs_exist_ok=True)
+            if single_pass:
+                logger.info(f"🗣️ Диаризация для {wav_path.name} (без повторного ASR)...")
+                if segments is None:
+                    segments = run_diarization(wav_path, diarizer, staging, block_plan)
+                diar_result = format_diarization(assign_speakers(words, segments))
+            else:
+                diar_result = diarize_and_transcribe(wav_path, asr_model, diarizer, segment_batch_sec, progress, staging,
+                                                    audio_data, segments, block_plan)
+            if speaker_index is not None:
+                diar_result = relabel_text(diar_result, index_speakers(speaker_index, wav_path, staging))
+            diar_output_file = results_dir / (wav_path.stem + "-diarization.txt")
+            write_text_atomic(diar_output_file, diar_result)
+            print(f"✅ Сохранено: {diar_output_file.name}")
+            result_files.append(diar_output_file)
+
+        if cache is not None:
+            for result_file, cached_name in zip(result_files, CACHED_RESULTS):
+                shutil.copy2(result_file, staging / cached_name)
+            if use_diarization:
+                store_features(cache, wav_path, staging)
+            cache.store(cache_key, staging)
+
+    audio_seconds = len(audio_data) / 16000 if audio_data is not None else sf.info(str(wav_path)).duration
+    if skipped is not None:
+        observe_file(audio_seconds, time.perf_counter() - started, file=wav_path.name, vad_skipped=skipped)
+    else:
+        observe_file(audio_seconds, time.perf_counter() - started, file=wav_path.name)
+    return result_files
+
+def index_speakers(speaker_index: SpeakerIndex, wav_path: Path, features_dir: Path, segments: list = None) -> dict:
+    """Сохраняет центроиды спикеров записи в индекс; возвращает {метка: имя} для известных спикеров.
+
+    Нужны признаки диаризации в features_dir (embeddings/, subsegments/ и, без
+    segments, diarization.rttm). Без них (блочная диаризация) и при ошибке индекса
+    запись не индексируется, а метки остаются как есть.
+    """
+    if features_dir is None or not (features_dir / "embeddings").is_dir():
+        logger.warning(f"⚠️ Нет эмбеддингов диаризации {wav_path.name}: запись не добавлена в индекс спикеров")
+        return {}
+    try:
+        if segments is None:
+            segments = read_rttm(features_dir / "diarization.rttm")
+        speaker_index.add(wav_path.stem, speaker_centroids(features_dir, wav_path.stem, segments))
+        return speaker_index.names_for(wav_path.stem)
+    except Exception as e:
+        logger.warning(f"⚠️ Индекс спикеров: {wav_path.name} не добавлен: {e}")
+        return {}
+
+def store_features(cache: ResultCache, wav_path: Path, artifacts_dir: Path):
+    """Переносит признаки диаризации из папки артефактов в отдельную запись кэша.
+
+    Ключ признаков не зависит от модели ASR и параметров кластеризации, поэтому
+    recluster() находит их при любых новых настройках числа спикеров.
+    """
+    if not (artifacts_dir / "embeddings").is_dir():
+        return
+    with cache.staging() as features:
+        for name in FEATURE_ARTIFACTS:
+            if (artifacts_dir / name).exists():
+                shutil.move(str(artifacts_dir / name), str(features / name))
+        cache.store(cache.features_key(wav_path, DIARIZER_CONFIG), features)
+
+@timed("clustering")
+def cluster_features(features_dir: Path, uniq_id: str, overrides: dict = None, num_speakers: int = None) -> list:
+    """Кластеризует сохранённые эмбеддинги файла и возвращает сегменты (start, end, speaker).
+
+    overrides — новые значения параметров кластеризации (CLUSTERING_OVERRIDES),
+    num_speakers — известное число спикеров (oracle_num_speakers).
+    """
+    from omegaconf import OmegaConf
+    config = OmegaConf.load(DIARIZER_CONFIG)
+    params = config.diarizer.clustering.parameters
+    for name, value in (overrides or {}).items():
+        if name not in CLUSTERING_OVERRIDES:
+            raise ValueError(f"Параметр кластеризации '{name}' нельзя переопределить. Доступно: {list(CLUSTERING_OVERRIDES)}")
+        params[name] = value
+    if num_speakers is not None:
+        params.oracle_num_speakers = True
+        params.max_num_speakers = max(int(params.max_num_speakers), num_speakers)
+    segments = get_backend().cluster(features_dir, uniq_id, config, num_speakers)
+    SEGMENTS.inc(len(segments), kind="diarization")
+    return segments
+
+def recluster(audio_file: Path, asr_model, cache: ResultCache, overrides: dict = None, num_speakers: int = None,
+              segment_batch_sec: float = SEGMENT_BATCH_SECONDS, results_dir: Path = RESULTS_DIR, progress=None,
+              audio_data=None, speaker_index: SpeakerIndex = None, features: Path = None) -> list:
+    """Повторная диаризация файла с новыми параметрами кластеризации без VAD и эмбеддингов.
+
+    Берёт из кэша признаки, сохранённые прошлой диаризацией (store_features),
+    заново кластеризует их и распознаёт получившиеся сегменты. Перезаписывает
+    результат диаризации и возвращает список созданных файлов. С speaker_index
+    спикеры новой кластеризации заменяют в индексе прежних спикеров записи.
+    features — уже найденная запись признаков (иначе ищется в кэше).
+    """
+    started = time.perf_counter()
+    wav_path = convert_to_wav(audio_file)
+    if features is None:
+        features = cache.lookup(cache.features_key(wav_path, DIARIZER_CONFIG))
+    if features is None:
+        raise LookupError(f"Нет сохранённых эмбеддингов для {wav_path.name}: сначала выполните диаризацию с кэшем")
+    logger.info(f"🔁 Повторная кластеризация {wav_path.name} из кэша признаков...")
+    segments = cluster_features(features, wav_path.stem, overrides, num_speakers)
+    diar_result = diarize_and_transcribe(wav_path, asr_model, None, segment_batch_sec, progress,
+                                         audio_data=audio_data, segments=segments)
+    if speaker_index is not None:
+        diar_result = relabel_text(diar_result, index_speakers(speaker_index, wav_path, features, segments))
+    diar_output_file = results_dir / (wav_path.stem + "-diarization.txt")
+    write_text_atomic(diar_output_file, diar_result)
+    print(f"✅ Сохранено: {diar_output_file.name}")
+
+    audio_seconds = len(audio_data) / 16000 if audio_data is not None else sf.info(str(wav_path)).duration
+    observe_file(audio_seconds, time.perf_counter() - started, file=wav_path.name, recluster=True)
+    return [diar_output_file]
+
+def result_cache_key(cache: ResultCache, wav_path: Path, language: str, model_type: str, model_name: str,
+              use_diarization: bool, single_pass: bool = False, long_form: bool = False,
+              vad_gate: bool = False, block_diarization: bool = False) -> str:
+    """Ключ кэша для файла с учётом режимов, влияющих на результат."""
+    single_pass = single_pass and use_diarization
+    # int8 и bf16 бэкенда cpu меняют текст; у остальных бэкендов ключи остаются прежними
+    backend_tag = getattr(get_backend(), "cache_tag", None)
+    extra = {"backend": backend_tag} if backend_tag else {}
+    if block_diarization and use_diarization:
+        # Параметры блоков входят в дайджест конфигурации диаризатора, здесь — только сам режим
+        extra["block_diarization"] = True
+    if vad_gate and not use_diarization:
+        # Результат зависит от настроек VAD; ключи без этого режима остаются прежними
+        return cache.key_for(wav_path, language, model_type, model_name, use_diarization, DIARIZER_CONFIG,
+                             single_pass=False, long_form=False,
+                             vad_gate=config_digest(DIARIZER_CONFIG, ("oracle_vad", "vad")), **extra)
+    return cache.key_for(wav_path, language, model_type, model_name, use_diarization, DIARIZER_CONFIG,
+                         single_pass=single_pass, long_form=long_form and not single_pass, **extra)
+
+def restore_cached(entry: Path, wav_path: Path, use_diarization: bool, results_dir: Path = RESULTS_DIR,
+                   progress=None) -> list:
+    """Копирует результаты из записи кэша в папку результатов (каждый файл заменяется атомарно)."""
+    suffixes = (".txt", "-diarization.txt") if use_diarization else (".txt",)
+    result_files = []
+    for cached_name, suffix in zip(CACHED_RESULTS, suffixes):
+        result_file = results_dir / (wav_path.stem + suffix)
+        tmp_path = result_file.with_name(f".{result_file.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        shutil.copy2(entry / cached_name, tmp_path)
+        os.replace(tmp_path, result_file)
+        result_files.append(result_file)
+    print(f"⚡ Из кэша: {', '.join(f.name for f in result_files)}")
+    FILES.inc(status="cached")
+    if progress is not None:
+        progress("transcript", file=wav_path.name, text=result_files[0].read_text(encoding="utf-8"), cached=True)
+    return result_files
+
+def run_recluster(audio_files: list, language: str, model_type: str, model_name: str, cache: ResultCache,
+                  overrides: dict = None, num_speakers: int = None, segment_batch_sec: float = SEGMENT_BATCH_SECONDS,
+                  speaker_index: SpeakerIndex = None):
+    """Повторная кластеризация файлов папки; файлы без сохранённых признаков пропускаются."""
+    asr_model = None
+    for audio_file in audio_files:
+        print(f"\n>> Повторная кластеризация: {audio_file.name}")
+        try:
+            # Модель ASR нужна только если признаки файла нашлись в кэше
+            features = cache.lookup(cache.features_key(convert_to_wav(audio_file), DIARIZER_CONFIG))
+            if features is None:
+                raise LookupError(f"Нет сохранённых эмбеддингов для {audio_file.name}: "
+                                  "сначала выполните диаризацию с кэшем")
+            if asr_model is None:
+                asr_model = load_asr_model(language, model_type, model_name)
+            recluster(audio_file, asr_model, cache, overrides, num_speakers, segment_batch_sec,
+                      speaker_index=speaker_index, features=features)
+        except LookupError as e:
+            logger.warning(f"⚠️ {e}")
+            FILES.inc(status="failed")
+        except Exception as e:
+            logger.error(f"❌ Ошибка при обработке {audio_file.name}: {e}")
+            FILES.inc(status="failed")
+
+def run_config(args, model_type: str, use_diarization: bool) -> dict:
+    """Параметры запуска, от которых зависит результат: по ним журнал отличает готовые файлы."""
+    config = {"language": args.language, "model_type": model_type, "model_name": args.model_name,
+              "diarization": use_diarization, "single_pass": args.single_pass and use_diarization,
+              "long_form": args.long_form, "vad_gate": args.vad_gate and not use_diarization,
+              "backend": get_backend().name, "backend_tag": getattr(get_backend(), "cache_tag", None),
+              "block_diarization": args.block_diarization and use_diarization,
+              "speaker_index": args.speaker_index and use_diarization}
+    if use_diarization or args.vad_gate:
+        config["diarizer_config"] = config_digest(DIARIZER_CONFIG)
+    return config
 
 def main():
     parser = argparse.ArgumentParser(description="Speech Recognition with optional Diarization")
@@ -209,6 +1122,63 @@ def main():
     parser.add_argument("--transducer", action="store_true", help="Use transducer model (most accurate, heavy)")
     parser.add_argument("--ctc", action="store_true", help="Use CTC model (lighter, faster)")
     parser.add_argument("--model_name", required=True, help="Specific model name to use (e.g., stt_en_conformer_ctc_large)")
+    parser.add_argument("--single_pass", action="store_true",
+                        help="With --diarization, run ASR once with word timestamps and assign words to speakers")
+    parser.add_argument("--long_form", action="store_true",
+                        help="Transcribe in overlapping windows with bounded memory (for multi-hour recordings)")
+    parser.add_argument("--segment_batch_sec", type=float, default=SEGMENT_BATCH_SECONDS,
+                        help="Max padded audio seconds per batch when transcribing diarized segments "
+                             "(the actual size follows free memory)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=None,
+                        help="Model backend (default: ASR_BACKEND env or nemo; cpu = optimized CPU inference; "
+                             "stub = CPU stand-ins for benchmarks)")
+    parser.add_argument("--cpu_threads", type=int, default=None,
+                        help="With --backend cpu, intra-op threads (default: ASR_CPU_THREADS or all cores)")
+    parser.add_argument("--cpu_interop_threads", type=int, default=None,
+                        help="With --backend cpu, inter-op threads (default: ASR_CPU_INTEROP_THREADS or torch default)")
+    parser.add_argument("--cpu_quantize", choices=["none", "int8"], default=None,
+                        help="With --backend cpu, dynamic quantization of encoder linear layers (default: int8)")
+    parser.add_argument("--cpu_bf16", action="store_true",
+                        help="With --backend cpu, bf16 autocast (only on CPUs with AVX512-BF16/AMX)")
+    parser.add_argument("--cpu_export", choices=["torchscript", "onnx"], default=None,
+                        help="With --backend cpu, run the encoder as a cached TorchScript/ONNX export")
+    parser.add_argument("--timing_report", action="store_true",
+                        help="Write per-stage timings to results/timings.json")
+    parser.add_argument("--no_cache", action="store_true", help="Do not read or write the result cache")
+    parser.add_argument("--jobs", "--decode_workers", dest="jobs", type=int, default=2,
+                        help="Processes decoding/resampling audio ahead of inference")
+    parser.add_argument("--writers", type=int, default=2, help="Threads writing results and cache entries")
+    parser.add_argument("--file_batch_sec", type=float, default=600.0,
+                        help="Max padded audio seconds per batch of whole files in ASR-only mode "
+                             "(the actual size follows free memory)")
+    parser.add_argument("--diarize_batch_sec", type=float, default=3600.0,
+                        help="Total audio seconds diarized in one run of the diarizer")
+    parser.add_argument("--vad_gate", action="store_true",
+                        help="Without --diarization, run VAD first and transcribe only speech regions")
+    parser.add_argument("--block_diarization", action="store_true",
+                        help="With --diarization, diarize recordings longer than one block (block_diarization "
+                             "section of diarizer_config.yaml) block by block and link speakers across blocks")
+    parser.add_argument("--speaker_index", action="store_true",
+                        help="With --diarization or --recluster, save speaker centroids to the cross-recording index "
+                             "(SPEAKER_INDEX_DIR, default: speakers) and label enrolled speakers by name")
+    parser.add_argument("--recluster", action="store_true",
+                        help="Re-run only clustering and segment ASR from cached VAD and speaker embeddings")
+    parser.add_argument("--num_speakers", type=int, default=None,
+                        help="With --recluster, known number of speakers (oracle_num_speakers)")
+    parser.add_argument("--max_num_speakers", type=int, default=None,
+                        help="With --recluster, override clustering max_num_speakers")
+    parser.add_argument("--max_rp_threshold", type=float, default=None,
+                        help="With --recluster, override clustering max_rp_threshold")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip files the journal (results/journal.jsonl) records as done and retry failed ones")
+    parser.add_argument("--max_attempts", type=int, default=MAX_ATTEMPTS,
+                        help="With --resume or --queue_dir, give up on a file after this many failed or "
+                             "interrupted attempts")
+    parser.add_argument("--audio_dir", type=Path, default=AUDIO_DIR, help="Folder with input audio (default: audio)")
+    parser.add_argument("--queue_dir", type=Path, default=None,
+                        help="Shared work queue folder: process --audio_dir together with other workers "
+                             "(processes or machines sharing the filesystem); progress: python shard.py status")
+    parser.add_argument("--worker_id", default=None, help="With --queue_dir, worker name (default: host-pid)")
     args = parser.parse_args()
 
     if args.transducer and args.ctc:
@@ -217,43 +1187,112 @@ def main():
         raise ValueError("Необходимо выбрать тип модели: --transducer или --ctc")
 
     model_type = "transducer" if args.transducer else "ctc"
+    cpu_options = {name: value for name, value in (("threads", args.cpu_threads),
+                                                   ("interop_threads", args.cpu_interop_threads),
+                                                   ("quantize", args.cpu_quantize), ("export", args.cpu_export))
+                   if value is not None}
+    if args.cpu_bf16:
+        cpu_options["bf16"] = True
+    backend_name = args.backend or os.environ.get("ASR_BACKEND", "nemo")
+    if cpu_options and backend_name != "cpu":
+        logger.warning("⚠️ Параметры --cpu_* действуют только с --backend cpu и будут проигнорированы")
+        cpu_options = {}
+    if args.backend is not None or cpu_options:
+        set_backend(backend_name, **cpu_options)
+    # Проверка модели по реестру — до импорта torch и NeMo
+    registry.resolve(args.language, model_type, args.model_name)
+    if args.long_form and args.single_pass and args.diarization:
+        logger.warning("⚠️ --single_pass распознаёт файл целиком, --long_form будет проигнорирован")
+    if args.vad_gate and args.diarization:
+        logger.warning("⚠️ С --diarization ASR и так идёт только по сегментам речи, --vad_gate будет проигнорирован")
+    elif args.vad_gate and args.long_form:
+        logger.warning("⚠️ --vad_gate распознаёт участки речи целиком, --long_form будет проигнорирован")
+    if args.block_diarization and not args.diarization:
+        logger.warning("⚠️ --block_diarization действует только с --diarization и будет проигнорирован")
+    if args.speaker_index and not (args.diarization or args.recluster):
+        logger.warning("⚠️ --speaker_index действует только с --diarization или --recluster и будет проигнорирован")
+    if args.speaker_index and args.queue_dir is not None:
+        raise ValueError("Индекс спикеров пишет один процесс: --speaker_index несовместим с --queue_dir")
+    if args.recluster and args.no_cache:
+        raise ValueError("--recluster берёт эмбеддинги из кэша и несовместим с --no_cache")
+    if args.recluster and args.resume:
+        logger.warning("⚠️ --recluster не ведёт журнал, --resume будет проигнорирован")
+    if args.recluster and args.queue_dir is not None:
+        raise ValueError("--recluster обрабатывает файлы локально и несовместим с --queue_dir")
+    if args.queue_dir is not None and args.resume:
+        logger.warning("⚠️ С --queue_dir готовые файлы и так берутся из очереди, --resume будет проигнорирован")
 
-    asr_model = load_asr_model(args.language, model_type, args.model_name)
-    use_diarization = args.diarization
-    mode_name = "ASR + Диаризация" if use_diarization else "Только ASR"
+    use_diarization = args.diarization or args.recluster
+    mode_name = "Повторная кластеризация" if args.recluster else "ASR + Диаризация" if use_diarization else "Только ASR"
     logger.info(f">> Режим: {mode_name} | Язык: {args.language} | Тип модели: {model_type} | Модель: {args.model_name}")
 
-    audio_files = [f for f in AUDIO_DIR.iterdir() if f.suffix.lower() in (".wav", ".mp3", ".flac", ".ogg")]
+    audio_files = [f for f in args.audio_dir.iterdir() if f.suffix.lower() in (".wav", ".mp3", ".flac", ".ogg")]
 
     if not audio_files:
-        logger.warning("❌ В папке audio нет аудиофайлов!")
+        logger.warning(f"❌ В папке {args.audio_dir} нет аудиофайлов!")
         return
 
-    for audio_file in audio_files:
-        print(f"\n>> Обработка: {audio_file.name}")
-
-        wav_path = convert_to_wav(audio_file)
-        output_file = RESULTS_DIR / (wav_path.stem + ".txt")
-
-        try:
-            simple_asr = transcribe_audio(wav_path, asr_model)
-            with open(output_file, "w", encoding="utf-8") as f:
-                f.write(simple_asr)
-            print(f"✅ Сохранено: {output_file.name}")
-
-            if use_diarization:
-                diar_result = diarize_and_transcribe(wav_path, asr_model)
-                diar_output_file = RESULTS_DIR / (wav_path.stem + "-diarization.txt")
-                with open(diar_output_file, "w", encoding="utf-8") as f:
-                    f.write(diar_result)
-                print(f"✅ Сохранено: {diar_output_file.name}")
-
-        except Exception as e:
-            logger.error(f"❌ Ошибка при обработке {audio_file.name}: {e}")
-
-        torch.cuda.empty_cache()
+    cache = None if args.no_cache else ResultCache()
+    speaker_index = SpeakerIndex() if args.speaker_index and use_diarization else None
+    if args.recluster:
+        overrides = {name: getattr(args, name) for name in ("max_num_speakers", "max_rp_threshold")
+                     if getattr(args, name) is not None}
+        with job_report(JobReport("recluster")) as report:
+            run_recluster(audio_files, args.language, model_type, args.model_name, cache, overrides,
+                          args.num_speakers, args.segment_batch_sec, speaker_index)
+    else:
+        config = run_config(args, model_type, use_diarization)
+        target = "diarized" if use_diarization else "transcribed"
+        worker = None
+        if args.queue_dir is not None:
+            # Файлы берутся из общей очереди по одному; у каждого воркера свой журнал
+            from shard import ShardWorker, WorkQueue, default_worker_id
+            worker_id = args.worker_id or default_worker_id()
+            journal = Journal(RESULTS_DIR / f"journal.{worker_id}.jsonl", config, target,
+                              max_attempts=args.max_attempts)
+            worker = ShardWorker(WorkQueue(args.queue_dir, args.audio_dir, config, max_attempts=args.max_attempts),
+                                 journal, worker_id)
+            logger.info(f"🗂️ Воркер {worker_id} очереди {args.queue_dir}")
+        else:
+            # Журнал состояний файлов: с --resume готовые файлы пропускаются без декодирования
+            journal = Journal(RESULTS_DIR / JOURNAL_NAME, config, target, args.resume, args.max_attempts)
+            todo = journal.plan(audio_files)
+        # Декодирование, инференс и запись результатов идут одновременно (см. pipeline.py)
+        from pipeline import BatchPipeline
+        batch = BatchPipeline(args.language, model_type, args.model_name, use_diarization, args.single_pass,
+                              args.long_form, args.segment_batch_sec, cache, jobs=args.jobs, writers=args.writers,
+                              file_batch_sec=args.file_batch_sec, diarize_batch_sec=args.diarize_batch_sec,
+                              vad_gate=args.vad_gate, journal=worker or journal,
+                              block_plan=load_block_diarization() if args.block_diarization else None,
+                              speaker_index=speaker_index)
+        with job_report(JobReport("main")) as report:
+            summary = worker.run(batch) if worker is not None else batch.run(todo)
+        if worker is not None:
+            journal_summary = journal.close(list(dict.fromkeys(worker.claimed)),
+                                            RESULTS_DIR / f"journal_summary.{worker.worker_id}.json")
+        else:
+            journal_summary = journal.close(audio_files)
+        logger.info(f"📒 Журнал: готово {journal_summary['done']} из {journal_summary['files']} "
+                    f"(пропущено готовых {journal_summary['skipped_done']}), ошибок {len(journal_summary['failed'])}, "
+                    f"брошено после {args.max_attempts} попыток {len(journal_summary['gave_up'])}")
+        logger.info(f"⏱️ {summary['files']} файлов за {summary['wall_s']:.1f} с "
+                    f"(загрузка моделей {summary['model_load_s']:.1f} с, ошибок {summary['failed']})")
+        if summary["vad_skipped"] is not None:
+            logger.info(f"🔇 VAD: в ASR не пошло {summary['vad_skipped']:.0%} аудио")
+        for stage in summary["stages"]:
+            logger.info(f"   {stage['stage']:<10} исполнителей {stage['workers']}, файлов {stage['items']}, "
+                        f"занятость {stage['utilization']:.0%}")
+    if args.timing_report:
+        report_path = RESULTS_DIR / "timings.json"
+        report.write(report_path)
+        logger.info(f"⏱️ Отчёт о таймингах стадий: {report_path}")
 
+    if cache is not None:
+        stats = cache.stats()
+        logger.info(f"⚡ Кэш: попаданий {stats['hits']}, промахов {stats['misses']}, {stats['size_mb']:.1f} МБ")
     print(f"\n🎉 Все файлы обработаны! Результаты в папке '{RESULTS_DIR}'")
 
 if __name__ == "__main__":
+    # pipeline.py импортирует main; не даём загрузить этот модуль второй раз
+    sys.modules.setdefault("main", sys.modules[__name__])
     main()
\ No newline at end of file
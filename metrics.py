@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""Тайминги стадий, счётчики и гистограммы в формате Prometheus.
+
+Стадии оборачиваются в span(); время попадает в гистограмму asr_stage_seconds и
+в отчёт текущего задания (JobReport), если он активен в контексте. Отчёт
+передаётся через contextvars, поэтому потоки, запущенные через
+contextvars.copy_context().run, пишут в отчёт своего задания.
+"""
+import sys
+import json
+import time
+import bisect
+import functools
+import threading
+import contextlib
+import contextvars
+from pathlib import Path
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+RTF_BUCKETS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+
+_current_report = contextvars.ContextVar("job_report", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> list:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Текущее значение; можно задать функцию, вызываемую при каждом сборе метрик."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+        self._function = None
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self) -> list:
+        if self._function is not None:
+            value = self._function()
+            if value is not None:
+                self.set(value)
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self) -> list:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_labels = _format_labels(self.labels, key, f'le="{le}"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(Histogram("asr_stage_seconds", "Wall time of processing stages", ("stage",)))
+MODEL_LOAD_SECONDS = REGISTRY.register(Histogram("asr_model_load_seconds", "Model load time", ("model",)))
+AUDIO_SECONDS = REGISTRY.register(Counter("asr_audio_seconds_total", "Seconds of audio processed"))
+FILES = REGISTRY.register(Counter("asr_files_total", "Processed files by outcome", ("status",)))
+SEGMENTS = REGISTRY.register(Counter("asr_segments_total", "Audio pieces sent to ASR", ("kind",)))
+ASR_CALLS_SAVED = REGISTRY.register(Counter("asr_segment_calls_saved_total",
+                                            "Segment ASR calls avoided by merging and dropping diarization fragments"))
+VAD_SKIPPED_SECONDS = REGISTRY.register(Counter("asr_vad_skipped_seconds_total",
+                                                "Seconds of non-speech audio skipped by the VAD gate"))
+BATCH_OOM_RETRIES = REGISTRY.register(Counter("asr_batch_oom_retries_total",
+                                              "Batches retried at half size after running out of memory", ("kind",)))
+RTF = REGISTRY.register(Histogram("asr_rtf", "Real-time factor per file (processing time / audio duration)",
+                                  buckets=RTF_BUCKETS))
+QUEUE_DEPTH = REGISTRY.register(Gauge("asr_job_queue_depth", "Jobs waiting in the worker queue"))
+STREAM_LAG = REGISTRY.register(Histogram("asr_stream_lag_seconds",
+                                         "Delay from receiving streamed audio to sending its event", ("event",)))
+PEAK_RSS = REGISTRY.register(Gauge("asr_peak_rss_bytes", "Peak resident set size of the process"))
+PEAK_VRAM = REGISTRY.register(Gauge("asr_peak_vram_bytes", "Peak CUDA memory allocated by torch"))
+
+
+def peak_rss_bytes() -> int:
+    if sys.platform == "win32":
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт КБ, macOS — байты
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def peak_vram_bytes():
+    # torch не импортируем ради метрик: если его ещё нет, GPU тоже не использовался
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda.max_memory_allocated()
+
+
+PEAK_RSS.set_function(peak_rss_bytes)
+PEAK_VRAM.set_function(peak_vram_bytes)
+
+
+class JobReport:
+    """Тайминги стадий одного задания (или запуска main.py) для JSON-отчёта."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []
+        self.files = []
+        self._lock = threading.Lock()
+
+    def add_span(self, stage: str, start: float, seconds: float):
+        with self._lock:
+            self.spans.append({"stage": stage, "start": start - self.started, "seconds": seconds})
+
+    def add_file(self, **data):
+        with self._lock:
+            self.files.append(data)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            totals = {}
+            for span in self.spans:
+                stage = totals.setdefault(span["stage"], {"seconds": 0.0, "count": 0})
+                stage["seconds"] += span["seconds"]
+                stage["count"] += 1
+            return {
+                "name": self.name,
+                "wall_s": time.perf_counter() - self.started,
+                "stages": totals,
+                "files": list(self.files),
+                "spans": list(self.spans),
+                "peak_rss_bytes": peak_rss_bytes(),
+                "peak_vram_bytes": peak_vram_bytes(),
+            }
+
+    def write(self, path: Path):
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        tmp_path.replace(path)
+
+
+@contextlib.contextmanager
+def job_report(report: JobReport):
+    """Делает report текущим отчётом для span() в этом контексте."""
+    token = _current_report.set(report)
+    try:
+        yield report
+    finally:
+        _current_report.reset(token)
+
+
+class _Span:
+    __slots__ = ("children",)
+
+    def __init__(self):
+        self.children = 0.0
+
+
+@contextlib.contextmanager
+def span(stage: str, rest: str = None):
+    """Засекает время стадии.
+
+    Если задан rest, время стадии за вычетом вложенных span() записывается ещё и
+    под именем rest — так учитывается работа, которую нельзя обернуть отдельно
+    (например, кластеризация внутри ClusteringDiarizer.diarize()).
+    """
+    parent = _current_span.get()
+    current = _Span()
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        _current_span.reset(token)
+        if parent is not None:
+            parent.children += seconds
+        record(stage, seconds, started)
+        if rest is not None:
+            record(rest, max(0.0, seconds - current.children), started)
+
+
+def timed(stage: str, rest: str = None):
+    """Декоратор: весь вызов функции — стадия stage (см. span)."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage, rest):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(stage: str, seconds: float, started: float = None):
+    """Учитывает стадию, замеренную снаружи (например, в дочернем процессе)."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    report = _current_report.get()
+    if report is not None:
+        report.add_span(stage, started if started is not None else time.perf_counter() - seconds, seconds)
+
+
+def instrument(obj, methods: dict):
+    """Оборачивает методы объекта (имя метода → стадия) в span(); отсутствующие методы пропускаются."""
+    for method_name, stage in methods.items():
+        method = getattr(obj, method_name, None)
+        if method is None:
+            continue
+
+        def wrapped(*args, _method=method, _stage=stage, **kwargs):
+            with span(_stage):
+                return _method(*args, **kwargs)
+
+        setattr(obj, method_name, wrapped)
+    return obj
+
+
+def observe_file(audio_seconds: float, seconds: float, status: str = "done", **data):
+    """Учитывает обработанный файл: длительность аудио, RTF и исход."""
+    FILES.inc(status=status)
+    if status == "done":
+        AUDIO_SECONDS.inc(audio_seconds)
+        if audio_seconds > 0:
+            RTF.observe(seconds / audio_seconds)
+    report = _current_report.get()
+    if report is not None:
+        report.add_file(audio_seconds=audio_seconds, seconds=seconds, status=status,
+                        rtf=seconds / audio_seconds if audio_seconds > 0 else None, **data)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""Кэш резидентных моделей воркера: несколько моделей ASR и диаризатор в пределах бюджета памяти.
+
+Модель загружается при первом запросе и остаётся в памяти; повторный запрос той
+же модели ничего не стоит. Для каждой модели измеряется занимаемая память (прирост
+выделенной CUDA-памяти или RSS за время загрузки; оценка из реестра — до
+загрузки). Если резидентные модели не помещаются в бюджет, выгружаются давно не
+использовавшиеся (LRU). Закреплённые модели (pin) не выгружаются и могут быть
+загружены заранее, при старте сервера.
+
+Бюджет — MODEL_CACHE_BUDGET_MB (0 — MODEL_CACHE_BUDGET_FRACTION от всей памяти
+устройства, на котором живут модели: VRAM на GPU, RAM на CPU).
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import registry
+from batching import release_memory
+from metrics import REGISTRY, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+MODEL_CACHE_BUDGET_MB = int(os.environ.get("MODEL_CACHE_BUDGET_MB", "0"))
+MODEL_CACHE_BUDGET_FRACTION = float(os.environ.get("MODEL_CACHE_BUDGET_FRACTION", "0.6"))
+DIARIZER_KEY = "diarizer"  # ClusteringDiarizer: модели VAD (MarbleNet) и эмбеддингов (TitaNet)
+DIARIZER_ESTIMATE_MB = 400
+
+MODEL_CACHE_REQUESTS = REGISTRY.register(Counter("asr_model_cache_requests_total",
+                                                 "Resident model cache lookups", ("result",)))
+MODEL_CACHE_EVICTIONS = REGISTRY.register(Counter("asr_model_cache_evictions_total",
+                                                  "Models evicted from the resident cache"))
+MODEL_CACHE_RESIDENT_MB = REGISTRY.register(Gauge("asr_model_cache_resident_mb",
+                                                  "Measured memory of resident models"))
+
+
+def asr_key(language: str, model_type: str, model_name: str) -> str:
+    return f"{language}/{model_type}/{model_name}"
+
+
+def key_for(name: str) -> str:
+    """Ключ модели по имени из реестра или diarizer (для MODEL_CACHE_PIN и MODEL_CACHE_PRELOAD)."""
+    if name == DIARIZER_KEY:
+        return DIARIZER_KEY
+    if name not in registry.MODELS:
+        raise ValueError(f"Модель '{name}' не найдена в реестре")
+    info = registry.MODELS[name]
+    return asr_key(info.language, info.decoder, info.name)
+
+
+def estimate_mb(key: str) -> float:
+    """Оценка памяти модели до первой загрузки."""
+    if key == DIARIZER_KEY:
+        return DIARIZER_ESTIMATE_MB
+    info = registry.MODELS.get(key.rsplit("/", 1)[-1])
+    return info.approx_memory_mb if info is not None else 0.0
+
+
+class _Entry:
+    __slots__ = ("model", "footprint_mb", "measured", "load_s", "hits", "loads", "last_used")
+
+    def __init__(self):
+        self.model = None
+        self.footprint_mb = 0.0
+        self.measured = False
+        self.load_s = 0.0
+        self.hits = 0
+        self.loads = 0
+        self.last_used = None
+
+
+class ModelCache:
+    """LRU-кэш моделей в пределах бюджета памяти (см. описание модуля).
+
+    device — устройство моделей ("cpu" или CUDA), budget_mb — бюджет (None —
+    MODEL_CACHE_BUDGET_MB или доля памяти устройства), release — освобождение
+    памяти после выгрузки (по умолчанию кэш аллокатора CUDA). Статистика
+    (попадания, промахи, время загрузки, память) хранится и для выгруженных моделей.
+    """
+
+    def __init__(self, device: str, budget_mb: float = None, pinned: tuple = (), release=None):
+        self.device = device
+        self._release = release or (lambda: release_memory(device))
+        self.budget_mb = budget_mb if budget_mb is not None else MODEL_CACHE_BUDGET_MB or None
+        self.pinned = set(pinned)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = {}  # Ключ → _Entry, в том числе для выгруженных моделей (статистика)
+        self._resident = OrderedDict()  # Ключ → None в порядке использования (последний — самый свежий)
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        MODEL_CACHE_RESIDENT_MB.set_function(self.resident_mb)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._resident
+
+    def get(self, key: str, loader):
+        """Модель по ключу; при промахе загружается loader() (по одной загрузке за раз)."""
+        model = self._hit(key)
+        if model is not None:
+            return model
+        with self._load_lock:
+            # Пока ждали, модель мог загрузить другой поток
+            model = self._hit(key)
+            if model is not None:
+                return model
+            with self._lock:
+                self.misses += 1
+                entry = self._entries.setdefault(key, _Entry())
+                estimate = entry.footprint_mb if entry.measured else estimate_mb(key)
+            MODEL_CACHE_REQUESTS.inc(result="miss")
+            self._evict(estimate, keep=key)
+            start_mb = self._used_mb()
+            started = time.perf_counter()
+            model = loader()
+            load_s = time.perf_counter() - started
+            used = self._used_mb() - start_mb if start_mb is not None else 0.0
+            with self._lock:
+                entry.model = model
+                entry.loads += 1
+                entry.load_s += load_s
+                entry.last_used = time.time()
+                # Прирост памяти ноль или меньше — модель уже делила память с кем-то; оставляем оценку
+                entry.measured = entry.measured or used > 0
+                entry.footprint_mb = used if used > 0 else max(entry.footprint_mb, estimate)
+                self._resident[key] = None
+            logger.info(f"📦 Модель {key} загружена за {load_s:.1f} с, {entry.footprint_mb:.0f} МБ "
+                        f"(в кэше {self.resident_mb():.0f} из {self._budget():.0f} МБ)")
+            self._evict(0.0, keep=key)
+            return model
+
+    def _hit(self, key: str):
+        with self._lock:
+            if key not in self._resident:
+                return None
+            self._resident.move_to_end(key)
+            entry = self._entries[key]
+            entry.hits += 1
+            entry.last_used = time.time()
+            self.hits += 1
+        MODEL_CACHE_REQUESTS.inc(result="hit")
+        return entry.model
+
+    def _evict(self, needed_mb: float, keep: str):
+        """Выгружает давно не использованные незакреплённые модели, пока needed_mb не помещается в бюджет."""
+        budget = self._budget()
+        evicted = []
+        with self._lock:
+            for key in list(self._resident):
+                if self._resident_mb() + needed_mb <= budget:
+                    break
+                if key == keep or key in self.pinned:
+                    continue
+                entry = self._entries[key]
+                # Задание, которое сейчас пользуется моделью, держит свою ссылку; память освободится по его завершении
+                entry.model = None
+                del self._resident[key]
+                self.evictions += 1
+                evicted.append(key)
+            over = self._resident_mb() + needed_mb > budget
+        for key in evicted:
+            MODEL_CACHE_EVICTIONS.inc()
+            logger.info(f"♻️ Модель {key} выгружена из кэша (бюджет {budget:.0f} МБ)")
+        if evicted:
+            self._release()
+        if over:
+            logger.warning(f"⚠️ Закреплённые и используемые модели не помещаются в бюджет кэша {budget:.0f} МБ")
+
+    def pin(self, key: str):
+        with self._lock:
+            self.pinned.add(key)
+
+    def unpin(self, key: str):
+        with self._lock:
+            self.pinned.discard(key)
+
+    def preload(self, loaders: dict):
+        """Загружает модели {ключ: loader} заранее; ошибка одной модели не мешает остальным."""
+        for key, loader in loaders.items():
+            try:
+                self.get(key, loader)
+            except Exception as e:
+                logger.error(f"❌ Не удалось заранее загрузить {key}: {e}")
+
+    def resident_mb(self) -> float:
+        with self._lock:
+            return self._resident_mb()
+
+    def _resident_mb(self) -> float:
+        return sum(self._entries[key].footprint_mb for key in self._resident)
+
+    def _budget(self) -> float:
+        if self.budget_mb is None:
+            self.budget_mb = MODEL_CACHE_BUDGET_FRACTION * _total_mb(self.device)
+        return self.budget_mb
+
+    def _used_mb(self):
+        """Память устройства, занятая процессом сейчас (для замера прироста при загрузке)."""
+        if self.device != "cpu":
+            torch = sys.modules.get("torch")
+            if torch is None or not torch.cuda.is_available():
+                return None
+            torch.cuda.synchronize()
+            return torch.cuda.memory_allocated() / 2 ** 20
+        try:
+            with open("/proc/self/statm", "r", encoding="utf-8") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+        except OSError:
+            import psutil
+            return psutil.Process().memory_info().rss / 2 ** 20
+
+    def stats(self) -> dict:
+        with self._lock:
+            models = {key: {"resident": key in self._resident, "pinned": key in self.pinned,
+                            "footprint_mb": entry.footprint_mb, "measured": entry.measured,
+                            "hits": entry.hits, "loads": entry.loads, "load_s": entry.load_s,
+                            "last_used": entry.last_used}
+                      for key, entry in self._entries.items()}
+            requests = self.hits + self.misses
+            return {
+                "device": self.device,
+                "budget_mb": self.budget_mb,
+                "resident_mb": self._resident_mb(),
+                "resident": list(self._resident),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else None,
+                "evictions": self.evictions,
+                "load_s": sum(entry.load_s for entry in self._entries.values()),
+                "models": models,
+            }
+
+
+def _total_mb(device: str) -> float:
+    if device != "cpu":
+        import torch
+        return torch.cuda.get_device_properties(torch.device(device)).total_memory / 2 ** 20
+    try:
+        with open("/proc/meminfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    import psutil
+    return psutil.virtual_memory().total / 2 ** 20
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""Конвейер пакетной обработки папки: декодирование → инференс → запись.
+
+Стадии связаны ограниченными очередями и работают одновременно: пока модель
+распознаёт одни файлы, пул процессов декодирует следующие, а потоки записи
+сохраняют готовые результаты.
+"""
+import time
+import queue
+import logging
+import threading
+import contextvars
+from pathlib import Path
+
+from main import (RESULTS_DIR, SEGMENT_BATCH_SECONDS, CACHED_RESULTS, detect_speech, diarize_many, format_speech,
+                  load_asr_model, load_diarizer, process_file, report_skipped, restore_cached, result_cache_key,
+                  transcribe_batched, transcribe_long_audio, transcribe_speech, write_text_atomic)
+from audio_io import decode_many, open_shared_audio
+from batching import is_oom
+from block_diarization import is_long
+from metrics import span, record, observe_file, FILES
+
+logger = logging.getLogger(__name__)
+
+FILE_BATCH_SEC = 600.0  # Бюджет аудио (с учётом паддинга) на один пакет целых файлов
+DIARIZE_BATCH_SEC = 3600.0  # Суммарная длина файлов в одном прогоне диаризатора
+_DONE = object()
+
+
+class StageStats:
+    """Занятость стадии: суммарное время работы её исполнителей и число файлов."""
+
+    def __init__(self, name: str, workers: int = 1):
+        self.name = name
+        self.workers = workers
+        self.busy = 0.0
+        self.items = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float, items: int = 1, errors: int = 0):
+        with self._lock:
+            self.busy += seconds
+            self.items += items
+            self.errors += errors
+
+    def to_dict(self, wall: float) -> dict:
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "items": self.items,
+            "errors": self.errors,
+            "busy_s": self.busy,
+            "utilization": self.busy / (wall * self.workers) if wall > 0 else 0.0,
+        }
+
+
+class _Item:
+    __slots__ = ("audio_file", "wav_path", "audio", "key")
+
+    def __init__(self, audio_file: Path, wav_path: Path, audio, key: str):
+        self.audio_file = audio_file
+        self.wav_path = wav_path
+        self.audio = audio
+        self.key = key
+
+
+class BatchPipeline:
+    """Конвейер decode → inference → write для папки с аудио.
+
+    jobs — число процессов декодирования, writers — потоков записи, queue_size —
+    ёмкость очереди между декодированием и инференсом. В режиме «только ASR»
+    стадия инференса собирает в один вызов модели несколько файлов, уже ждущих в
+    очереди (до file_batch_sec секунд аудио). С диаризацией ждущие файлы (до
+    diarize_batch_sec секунд) диаризуются одним прогоном diarize_many, а ASR
+    каждого файла начинается, как только готов его RTTM. Режим long_form без
+    диаризации обрабатывается по файлу через process_file. С vad_gate пакет
+    файлов сначала проходит VAD диаризатора, а в ASR идут только участки речи.
+    journal — журнал прогона (journal.Journal или shard.ShardWorker), в который пишется
+    состояние каждого файла. С block_plan (block_diarization.BlockPlan) записи
+    длиннее блока не входят в общий прогон диаризатора, а диаризуются по блокам.
+    С speaker_index (speaker_index.SpeakerIndex) спикеры диаризованных файлов
+    сохраняются в индекс, а известные получают имена (main.index_speakers).
+    """
+
+    def __init__(self, language: str, model_type: str, model_name: str, use_diarization: bool = False,
+                 single_pass: bool = False, long_form: bool = False,
+                 segment_batch_sec: float = SEGMENT_BATCH_SECONDS, cache=None, jobs: int = 2, writers: int = 2,
+                 queue_size: int = 4, file_batch_sec: float = FILE_BATCH_SEC,
+                 diarize_batch_sec: float = DIARIZE_BATCH_SEC, results_dir: Path = RESULTS_DIR,
+                 vad_gate: bool = False, journal=None, block_plan=None, speaker_index=None):
+        self.language = language
+        self.model_type = model_type
+        self.model_name = model_name
+        self.use_diarization = use_diarization
+        self.single_pass = single_pass
+        self.long_form = long_form
+        self.segment_batch_sec = segment_batch_sec
+        self.cache = cache
+        self.jobs = max(1, jobs)
+        self.writers = max(1, writers)
+        self.queue_size = max(1, queue_size)
+        self.file_batch_sec = file_batch_sec
+        self.diarize_batch_sec = diarize_batch_sec
+        self.results_dir = results_dir
+        self.vad_gate = vad_gate and not use_diarization
+        self.batchable = not use_diarization and (not long_form or self.vad_gate)
+        self.audio_seconds = 0.0
+        self.skipped_seconds = 0.0
+        self.stats = {
+            "decode": StageStats("decode", self.jobs),
+            "inference": StageStats("inference", 1),
+            "write": StageStats("write", self.writers),
+        }
+        self.journal = journal
+        self.block_plan = block_plan if use_diarization else None
+        self.speaker_index = speaker_index if use_diarization else None
+        self.model_load_time = 0.0
+        self._asr_model = None
+        self._diarizer = None
+
+    def run(self, audio_files) -> dict:
+        """Обрабатывает файлы и возвращает сводку с загрузкой стадий.
+
+        audio_files читаются лениво, поэтому подходит и генератор (shard.ShardWorker.claims).
+        """
+        started = time.perf_counter()
+        self._files = 0
+        self._infer_queue = queue.Queue(maxsize=self.queue_size)
+        self._write_queue = queue.Queue(maxsize=2 * self.queue_size)
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+
+        # Каждый поток получает копию контекста, чтобы тайминги попадали в текущий отчёт (metrics.job_report)
+        targets = [(self._decode_loop, (audio_files,), "pipeline-decode"), (self._infer_loop, (), "pipeline-inference")]
+        targets += [(self._write_loop, (), f"pipeline-write-{i}") for i in range(self.writers)]
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(target, *args), name=name)
+                   for target, args, name in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        wall = time.perf_counter() - started
+        return {
+            "files": self._files,
+            "failed": sum(stage.errors for stage in self.stats.values()),
+            "wall_s": wall,
+            "model_load_s": self.model_load_time,
+            # Доля аудио без речи, которая не пошла в ASR (только с vad_gate)
+            "vad_skipped": self.skipped_seconds / self.audio_seconds if self.vad_gate and self.audio_seconds else None,
+            "stages": [stage.to_dict(wall) for stage in self.stats.values()],
+        }
+
+    def _decode_loop(self, audio_files: list):
+        try:
+            for audio_file, wav_path, error, seconds, sha256 in decode_many(audio_files, self.jobs,
+                                                                            digest=self.journal is not None):
+                # Декодирование идёт в пуле процессов, поэтому его время учитываем здесь
+                record("decode", seconds)
+                self._files += 1
+                if error is not None:
+                    logger.error(f"❌ Ошибка декодирования {audio_file.name}: {error}")
+                    FILES.inc(status="failed")
+                    self.stats["decode"].add(seconds, errors=1)
+                    self._mark(audio_file, "failed", error=f"Ошибка декодирования: {error}")
+                    continue
+                t0 = time.perf_counter()
+                self._mark(audio_file, "decoded", sha256=sha256)
+                key = entry = None
+                try:
+                    if self.cache is not None:
+                        key = result_cache_key(self.cache, wav_path, self.language, self.model_type, self.model_name,
+                                               self.use_diarization, self.single_pass, self.long_form,
+                                               self.vad_gate, self.block_plan is not None)
+                        entry = self.cache.lookup(key)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка кэша для {audio_file.name}: {e}")
+                try:
+                    item = _Item(audio_file, wav_path, open_shared_audio(wav_path), key)
+                except Exception as e:
+                    # Битый или недописанный WAV — ошибка только этого файла
+                    logger.error(f"❌ Ошибка чтения {wav_path.name}: {e}")
+                    FILES.inc(status="failed")
+                    self.stats["decode"].add(seconds + time.perf_counter() - t0, errors=1)
+                    self._mark(audio_file, "failed", error=f"Ошибка чтения аудио: {e}")
+                    continue
+                self.stats["decode"].add(seconds + time.perf_counter() - t0)
+                if entry is not None:
+                    # Попадание в кэш минует инференс
+                    self._write_queue.put(("cached", item, entry))
+                else:
+                    self._infer_queue.put(item)
+        finally:
+            self._infer_queue.put(_DONE)
+
+    def _models(self):
+        if self._asr_model is None:
+            t0 = time.perf_counter()
+            self._asr_model = load_asr_model(self.language, self.model_type, self.model_name)
+            self.model_load_time += time.perf_counter() - t0
+        if (self.use_diarization or self.vad_gate) and self._diarizer is None:
+            t0 = time.perf_counter()
+            self._diarizer = load_diarizer()
+            self.model_load_time += time.perf_counter() - t0
+        return self._asr_model, self._diarizer
+
+    def _next_batch(self, first: _Item, budget_sec: float) -> tuple:
+        """Добирает к первому файлу уже ждущие в очереди, пока не исчерпан бюджет аудио."""
+        batch, seconds, finished = [first], len(first.audio) / 16000, False
+        while seconds < budget_sec:
+            try:
+                item = self._infer_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE:
+                finished = True
+                break
+            batch.append(item)
+            seconds += len(item.audio) / 16000
+        return batch, finished
+
+    def _infer_loop(self):
+        try:
+            finished = False
+            while not finished:
+                item = self._infer_queue.get()
+                if item is _DONE:
+                    break
+                try:
+                    asr_model, diarizer = self._models()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка загрузки моделей: {e}")
+                    self.stats["inference"].add(0.0, errors=1)
+                    self._mark(item.audio_file, "failed", error=f"Ошибка загрузки моделей: {e}")
+                    continue
+
+                if self.use_diarization:
+                    finished = self._diarize_batch(item, asr_model, diarizer)
+                    continue
+
+                if not self.batchable:
+                    self._process_one(item, asr_model, diarizer)
+                    continue
+
+                batch, finished = self._next_batch(item, self.file_batch_sec)
+                t0 = time.perf_counter()
+                print(f"\n>> Обработка пакета: {', '.join(i.audio_file.name for i in batch)}")
+                try:
+                    if self.vad_gate:
+                        texts, skipped = self._transcribe_gated(batch, asr_model, diarizer)
+                        errors = {}
+                    else:
+                        texts, errors = self._transcribe_files(batch, asr_model)
+                        skipped = {}
+                except Exception as e:
+                    logger.error(f"❌ Ошибка распознавания пакета: {e}")
+                    FILES.inc(len(batch), status="failed")
+                    self.stats["inference"].add(time.perf_counter() - t0, len(batch), errors=len(batch))
+                    for it in batch:
+                        self._mark(it.audio_file, "failed", error=str(e))
+                    continue
+                elapsed = time.perf_counter() - t0
+                self.stats["inference"].add(elapsed, len(batch), errors=len(errors))
+                total_sec = sum(len(it.audio) for it in batch) / 16000
+                for i, it in enumerate(batch):
+                    if i in errors:
+                        FILES.inc(status="failed")
+                        self._mark(it.audio_file, "failed", error=str(errors[i]))
+                        continue
+                    # Время пакета делим между файлами пропорционально длительности
+                    audio_sec = len(it.audio) / 16000
+                    seconds = elapsed * audio_sec / total_sec if total_sec else 0.0
+                    if i in skipped:
+                        observe_file(audio_sec, seconds, file=it.wav_path.name, vad_skipped=skipped[i])
+                    else:
+                        observe_file(audio_sec, seconds, file=it.wav_path.name)
+                    self._write_queue.put(("text", it, texts.get(i, "")))
+        finally:
+            for _ in range(self.writers):
+                self._write_queue.put(_DONE)
+
+    def _transcribe_files(self, batch: list, asr_model) -> tuple:
+        """Целые файлы пакета общими пакетами ASR; возвращает ({номер файла: текст}, {номер файла: ошибка}).
+
+        Тексты, распознанные до ошибки, сохраняются. run_adaptive пробрасывает OOM
+        только на пакете из одного файла: этот файл и файлы не короче него
+        распознаются окнами (transcribe_long_audio), остальные — снова пакетами.
+        """
+        texts, errors = {}, {}
+        while True:
+            pending = [i for i in range(len(batch)) if i not in texts and i not in errors]
+            if not pending:
+                return texts, errors
+            try:
+                transcribe_batched([(i, batch[i].audio) for i in pending], asr_model, self.file_batch_sec,
+                                   on_result=texts.__setitem__)
+                return texts, errors
+            except Exception as e:
+                pending = [i for i in pending if i not in texts]
+                if not is_oom(e):
+                    logger.error(f"❌ Ошибка распознавания пакета: {e}")
+                    errors.update((i, e) for i in pending)
+                    return texts, errors
+                # Фрагменты идут по возрастанию длины, поэтому не поместился самый короткий из оставшихся
+                limit = min(len(batch[i].audio) for i in pending)
+            for i in pending:
+                if len(batch[i].audio) < limit:
+                    continue
+                logger.warning(f"⚠️ Не хватило памяти на {batch[i].wav_path.name} целиком, распознаю окнами")
+                try:
+                    texts[i] = transcribe_long_audio(batch[i].wav_path, asr_model)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка распознавания {batch[i].audio_file.name}: {e}")
+                    errors[i] = e
+
+    def _transcribe_gated(self, batch: list, asr_model, diarizer) -> tuple:
+        """VAD пакета одним прогоном и ASR участков речи всех файлов общими пакетами.
+
+        Возвращает ({номер файла: текст}, {номер файла: доля пропущенного аудио}).
+        """
+        regions = detect_speech([it.wav_path for it in batch], diarizer)
+        skipped = {}
+        for i, it in enumerate(batch):
+            audio_sec = len(it.audio) / 16000
+            skipped[i] = report_skipped(it.wav_path.name, audio_sec, regions[it.wav_path])
+            self.audio_seconds += audio_sec
+            self.skipped_seconds += skipped[i] * audio_sec
+        turns = transcribe_speech([(i, it.audio, regions[it.wav_path]) for i, it in enumerate(batch)], asr_model,
+                                  self.file_batch_sec)
+        return {i: format_speech(turns[i]) for i in turns}, skipped
+
+    def _process_one(self, item: _Item, asr_model, diarizer, diarized: tuple = None) -> float:
+        t0 = time.perf_counter()
+        print(f"\n>> Обработка: {item.audio_file.name}")
+
+        def progress(event, **data):
+            # С диаризацией текст файла готов раньше диаризации — промежуточное состояние журнала
+            if event == "transcript" and self.use_diarization:
+                self._mark(item.audio_file, "transcribed")
+
+        try:
+            result_files = process_file(item.wav_path, asr_model, self.use_diarization, diarizer,
+                                        self.segment_batch_sec, self.single_pass, self.long_form,
+                                        results_dir=self.results_dir, progress=progress, cache=self.cache,
+                                        cache_key=item.key, audio_data=item.audio, diarized=diarized,
+                                        vad_gate=self.vad_gate, block_plan=self.block_plan,
+                                        speaker_index=self.speaker_index)
+            self.stats["inference"].add(time.perf_counter() - t0)
+            self._mark(item.audio_file, self._target, results=result_files, audio_sec=len(item.audio) / 16000)
+        except Exception as e:
+            logger.error(f"❌ Ошибка при обработке {item.audio_file.name}: {e}")
+            FILES.inc(status="failed")
+            self.stats["inference"].add(time.perf_counter() - t0, errors=1)
+            self._mark(item.audio_file, "failed", error=str(e))
+        return time.perf_counter() - t0
+
+    def _diarize_batch(self, first: _Item, asr_model, diarizer) -> bool:
+        """Диаризует пакет ждущих файлов одним прогоном; возвращает True, если очередь исчерпана."""
+        batch, finished = self._next_batch(first, self.diarize_batch_sec)
+        if self.block_plan is not None:
+            # Длинные записи диаризуются по блокам внутри process_file
+            long_items = [item for item in batch if is_long(len(item.audio) / 16000, self.block_plan)]
+            batch = [item for item in batch if item not in long_items]
+            for item in long_items:
+                self._process_one(item, asr_model, diarizer)
+        by_path = {item.wav_path: item for item in batch}
+        done = set()
+        asr_time = []
+
+        def on_result(wav_path, segments, file_dir):
+            # ASR файла идёт, пока диаризатор кластеризует следующие
+            done.add(wav_path)
+            asr_time.append(self._process_one(by_path[wav_path], asr_model, diarizer, (segments, file_dir)))
+
+        t0 = time.perf_counter()
+        error = "RTTM не создан"
+        try:
+            diarize_many(list(by_path), diarizer, on_result)
+        except Exception as e:
+            logger.error(f"❌ Ошибка пакетной диаризации: {e}")
+            error = f"Ошибка диаризации: {e}"
+        for wav_path, item in by_path.items():
+            if wav_path not in done:
+                self._mark(item.audio_file, "failed", error=error)
+        # Время самой диаризации (файлы уже учтены в _process_one) и файлы без результата
+        missing = len(by_path) - len(done)
+        self.stats["inference"].add(time.perf_counter() - t0 - sum(asr_time), missing, errors=missing)
+        return finished
+
+    def _write_loop(self):
+        while True:
+            task = self._write_queue.get()
+            if task is _DONE:
+                return
+            kind, item, payload = task
+            t0 = time.perf_counter()
+            try:
+                if kind == "cached":
+                    result_files = restore_cached(payload, item.wav_path, self.use_diarization, self.results_dir)
+                else:
+                    output_file = self.results_dir / (item.wav_path.stem + ".txt")
+                    with span("write"):
+                        write_text_atomic(output_file, payload)
+                    print(f"✅ Сохранено: {output_file.name}")
+                    if self.cache is not None and item.key is not None:
+                        with self.cache.staging() as staging:
+                            write_text_atomic(staging / CACHED_RESULTS[0], payload)
+                            self.cache.store(item.key, staging)
+                    result_files = [output_file]
+                self.stats["write"].add(time.perf_counter() - t0)
+                self._mark(item.audio_file, self._target, results=result_files, audio_sec=len(item.audio) / 16000)
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи результата {item.audio_file.name}: {e}")
+                self.stats["write"].add(time.perf_counter() - t0, errors=1)
+                self._mark(item.audio_file, "failed", error=f"Ошибка записи: {e}")
+
+    @property
+    def _target(self) -> str:
+        return "diarized" if self.use_diarization else "transcribed"
+
+    def _mark(self, audio_file: Path, state: str, **data):
+        if self.journal is None:
+            return
+        try:
+            self.journal.mark(audio_file, state, **data)
+        except Exception as e:
+            # Журнал не должен ронять обработку: в худшем случае файл повторится при --resume
+            logger.error(f"❌ Ошибка записи журнала для {audio_file.name}: {e}")
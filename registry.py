@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Реестр моделей ASR: метаданные и локальный кэш чекпойнтов .nemo.
+
+Модуль импортируется дёшево (только стандартная библиотека), поэтому проверка
+аргументов, --help и построение списков моделей в веб-интерфейсе не тянут
+torch и NeMo.
+"""
+import os
+import re
+import json
+import time
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+MODELS_DIR = Path(os.environ.get("ASR_MODELS_DIR", "models"))  # Локальные чекпойнты .nemo
+MANIFEST_NAME = "manifest.json"
+
+
+class ModelInfo(NamedTuple):
+    name: str
+    family: str  # conformer, fastconformer, contextnet, citrinet, squeezeformer
+    decoder: str  # transducer или ctc
+    language: str  # язык, для которого модель предлагается (ru или en)
+    approx_memory_mb: int  # Примерный объём памяти модели при инференсе (веса fp32 и буферы)
+
+    @property
+    def local_path(self) -> Path:
+        return MODELS_DIR / f"{self.name}.nemo"
+
+
+_TRANSDUCER_EN = [
+    "stt_en_conformer_transducer_large", "stt_en_conformer_transducer_large_ls",
+    "stt_en_conformer_transducer_medium", "stt_en_conformer_transducer_small",
+    "stt_en_conformer_transducer_xlarge", "stt_en_conformer_transducer_xxlarge",
+    "stt_en_contextnet_1024", "stt_en_contextnet_1024_mls",
+    "stt_en_contextnet_256", "stt_en_contextnet_256_mls",
+    "stt_en_contextnet_512", "stt_en_contextnet_512_mls",
+    "stt_en_fastconformer_transducer_large", "stt_en_fastconformer_transducer_large_ls",
+    "stt_en_fastconformer_transducer_xlarge", "stt_en_fastconformer_transducer_xxlarge",
+    "stt_enes_conformer_transducer_large", "stt_enes_conformer_transducer_large_codesw",
+    "stt_enes_contextnet_large"
+]
+_CTC_EN = [
+    "stt_en_citrinet_1024", "stt_en_citrinet_1024_gamma_0_25",
+    "stt_en_citrinet_256", "stt_en_citrinet_256_gamma_0_25",
+    "stt_en_citrinet_512", "stt_en_citrinet_512_gamma_0_25",
+    "stt_en_conformer_ctc_large", "stt_en_conformer_ctc_large_ls",
+    "stt_en_conformer_ctc_medium", "stt_en_conformer_ctc_medium_ls",
+    "stt_en_conformer_ctc_small", "stt_en_conformer_ctc_small_ls",
+    "stt_en_conformer_ctc_xlarge", "stt_en_fastconformer_ctc_large",
+    "stt_en_fastconformer_ctc_large_ls", "stt_en_fastconformer_ctc_xlarge",
+    "stt_en_fastconformer_ctc_xxlarge", "stt_en_squeezeformer_ctc_large_ls",
+    "stt_en_squeezeformer_ctc_medium_large_ls", "stt_en_squeezeformer_ctc_medium_ls",
+    "stt_en_squeezeformer_ctc_small_ls", "stt_en_squeezeformer_ctc_small_medium_ls",
+    "stt_en_squeezeformer_ctc_xsmall_ls", "stt_enes_conformer_ctc_large",
+    "stt_enes_conformer_ctc_large_codesw", "stt_fr_no_hyphen_citrinet_1024_gamma_0_25",
+    "stt_fr_no_hyphen_conformer_ctc_large"
+]
+_TRANSDUCER_RU = ["stt_ru_conformer_transducer_large"]
+_CTC_RU = ["stt_ru_conformer_ctc_large"]
+
+# Примерная память по размеру модели (порядок числа параметров из карточек NGC)
+_SIZE_MEMORY_MB = [
+    ("xxlarge", 5000), ("xlarge", 2800), ("medium_large", 1100), ("small_medium", 350), ("xsmall", 150),
+    ("large", 1100), ("medium", 450), ("small", 250), ("1024", 1200), ("512", 450), ("256", 200),
+]
+_FAMILIES = ("fastconformer", "squeezeformer", "contextnet", "citrinet", "conformer")
+
+
+def _describe(name: str, decoder: str, language: str) -> ModelInfo:
+    family = next((f for f in _FAMILIES if f in name), "unknown")
+    memory = next((mb for size, mb in _SIZE_MEMORY_MB if re.search(rf"_{size}(_|$)", name)), 1100)
+    return ModelInfo(name, family, decoder, language, memory)
+
+
+MODELS = {}
+for _names, _decoder, _language in ((_TRANSDUCER_EN, "transducer", "en"), (_CTC_EN, "ctc", "en"),
+                                    (_TRANSDUCER_RU, "transducer", "ru"), (_CTC_RU, "ctc", "ru")):
+    for _name in _names:
+        MODELS[_name] = _describe(_name, _decoder, _language)
+
+
+def models_for(language: str, decoder: str) -> list:
+    """Имена моделей для языка и типа декодера в порядке реестра."""
+    return [info.name for info in MODELS.values() if info.language == language and info.decoder == decoder]
+
+
+def resolve(language: str, model_type: str, model_name: str) -> ModelInfo:
+    """Проверяет сочетание языка, типа и имени модели и возвращает её метаданные."""
+    if language not in ("ru", "en"):
+        raise ValueError(f"Язык '{language}' не поддерживается. Используйте 'ru' или 'en'.")
+    if model_type not in ("transducer", "ctc"):
+        raise ValueError(f"Тип модели '{model_type}' не поддерживается. Используйте 'transducer' или 'ctc'.")
+    available = models_for(language, model_type)
+    if model_name not in available:
+        raise ValueError(f"Модель '{model_name}' не поддерживается для {language} ({model_type}). Доступно: {available}")
+    return MODELS[model_name]
+
+
+_manifest_lock = threading.Lock()
+
+
+def _load_manifest() -> dict:
+    try:
+        with open(MODELS_DIR / MANIFEST_NAME, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def local_checkpoint(model_name: str) -> Path:
+    """Путь к сохранённому чекпойнту .nemo, если он есть в манифесте и не изменился на диске, иначе None."""
+    entry = _load_manifest().get(model_name)
+    if entry is None:
+        return None
+    path = MODELS_DIR / entry["file"]
+    if not path.is_file() or path.stat().st_size != entry["size"]:
+        return None
+    return path
+
+
+def register_checkpoint(model_name: str, path: Path):
+    """Записывает сохранённый чекпойнт в манифест (атомарной заменой файла)."""
+    with _manifest_lock:
+        manifest = _load_manifest()
+        manifest[model_name] = {"file": path.name, "size": path.stat().st_size, "saved_at": time.time()}
+        tmp_path = MODELS_DIR / f".{MANIFEST_NAME}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, MODELS_DIR / MANIFEST_NAME)
@@ -1,11 +1,29 @@
 #!/usr/bin/env python3
 import os
-import sys
-import subprocess
-import shutil
+import json
+import time
+import queue
+import threading
 from pathlib import Path
-from flask import Flask, request, render_template_string, send_from_directory, flash, redirect, url_for, jsonify
+import numpy as np
+from flask import Flask, Response, request, render_template_string, send_from_directory, flash, redirect, url_for, jsonify, stream_with_context
 import logging
+import registry
+from worker import InferenceWorker, Job
+from main import embed_speech, load_streaming, transcribe_chunk
+from streaming import StreamSession
+from speaker_index import SpeakerIndex, relabel_results
+from uploads import UploadManager, UploadError, CHUNK_SIZE, MAX_CHUNK_SIZE
+from metrics import REGISTRY, STREAM_LAG
+
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+except ImportError:
+    Sock = None  # Без flask-sock сервер работает, но без WebSocket /stream
+
+    class ConnectionClosed(Exception):
+        pass
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"  # Для флеш-сообщений
@@ -17,6 +35,7 @@ log.setLevel(logging.ERROR)
 AUDIO_DIR = Path("audio")
 RESULTS_DIR = Path("results")
 TEMPLATES_DIR = Path("templates")
+JOBS_DIR = RESULTS_DIR / "jobs"  # Результаты асинхронных заданий, по папке на задание
 AUDIO_DIR.mkdir(exist_ok=True)
 RESULTS_DIR.mkdir(exist_ok=True)
 TEMPLATES_DIR.mkdir(exist_ok=True)
@@ -24,6 +43,21 @@ TEMPLATES_DIR.mkdir(exist_ok=True)
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:%(message)s")
 logger = logging.getLogger(__name__)
 
+# Ограничения очереди заданий (можно переопределить переменными окружения)
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "16"))
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", "1"))
+SSE_KEEPALIVE_SEC = 15
+# JOB_TIMING_REPORT=1 — писать тайминги стадий задания в timings.json рядом с результатами
+JOB_TIMING_REPORT = os.environ.get("JOB_TIMING_REPORT", "0") == "1"
+# SPEAKER_INDEX=1 — сохранять спикеров диаризованных файлов в индекс (папка SPEAKER_INDEX_DIR) и подставлять имена
+SPEAKER_INDEX = os.environ.get("SPEAKER_INDEX", "0") == "1"
+# Поток /stream без входящих данных дольше этого времени считается завершённым
+STREAM_IDLE_SEC = float(os.environ.get("STREAM_IDLE_SEC", "60"))
+# Модели кэша (имена из реестра или diarizer через запятую): закреплённые не выгружаются,
+# предзагружаемые загружаются в фоне при старте (бюджет — MODEL_CACHE_BUDGET_MB, см. model_cache.py)
+MODEL_CACHE_PIN = [name.strip() for name in os.environ.get("MODEL_CACHE_PIN", "").split(",") if name.strip()]
+MODEL_CACHE_PRELOAD = [name.strip() for name in os.environ.get("MODEL_CACHE_PRELOAD", "").split(",") if name.strip()]
+
 # HTML шаблоны с Tailwind CSS (без изменений)
 INDEX_HTML = """
 <!DOCTYPE html>
@@ -69,38 +103,145 @@ INDEX_HTML = """
                             modelName.includes("fastconformer_transducer") ? "transducer" : "ctc";
             document.getElementById("model_type").value = modelType;
         }
+        const CHUNK_SIZE = 8 * 1024 * 1024;
+        const CHUNK_RETRIES = 5;
+        function sleep(ms) {
+            return new Promise(resolve => setTimeout(resolve, ms));
+        }
+        async function sha256Hex(buffer) {
+            // crypto.subtle есть только в защищённом контексте (https или localhost)
+            if (!window.crypto || !window.crypto.subtle) {
+                return null;
+            }
+            let digest = await crypto.subtle.digest("SHA-256", buffer);
+            return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, "0")).join("");
+        }
+        var uploadedIds = [];  // Загрузки текущей выборки: задание обрабатывает только их
+        function uploadClient() {
+            // Id браузера: новая выборка файлов заменяет только его загрузки
+            let client = localStorage.getItem("uploadClient");
+            if (!client) {
+                client = Date.now().toString(36) + "-" + Math.random().toString(36).slice(2);
+                localStorage.setItem("uploadClient", client);
+            }
+            return client;
+        }
+        function uploadKey(file) {
+            return "upload:" + file.name + ":" + file.size + ":" + file.lastModified;
+        }
+        async function uploadState(id) {
+            let response = await fetch("/uploads/" + id);
+            let state = await response.json();
+            if (!state.success) {
+                throw new Error(state.message);
+            }
+            return state;
+        }
+        async function resumableUpload(file) {
+            // Загрузка того же файла, прерванная раньше, продолжается с недостающих частей
+            let id = localStorage.getItem(uploadKey(file));
+            if (!id) {
+                return null;
+            }
+            try {
+                let state = await uploadState(id);
+                return state.status === "failed" ? null : state;
+            } catch (error) {
+                return null;
+            }
+        }
+        async function putChunk(state, file, index) {
+            let start = index * state.chunk_size;
+            let buffer = await file.slice(start, Math.min(start + state.chunk_size, file.size)).arrayBuffer();
+            let headers = {"Content-Type": "application/octet-stream"};
+            let checksum = await sha256Hex(buffer);
+            if (checksum) {
+                headers["X-Chunk-SHA256"] = checksum;
+            }
+            for (let attempt = 1; ; attempt++) {
+                try {
+                    let response = await fetch(`/uploads/${state.id}/chunks/${index}`, {
+                        method: "PUT",
+                        headers: headers,
+                        body: buffer
+                    });
+                    let result = await response.json();
+                    if (!result.success) {
+                        throw new Error(result.message);
+                    }
+                    return result;
+                } catch (error) {
+                    if (attempt >= CHUNK_RETRIES) {
+                        throw error;
+                    }
+                    await sleep(1000 * attempt);
+                }
+            }
+        }
         async function uploadFiles() {
             var files = document.getElementById("audio_files").files;
             if (files.length === 0) {
                 showToast("Выберите хотя бы один аудиофайл!", "error");
                 return;
             }
-            var formData = new FormData();
-            for (var i = 0; i < files.length; i++) {
-                formData.append("audio_files", files[i]);
-            }
+            var progressText = document.getElementById("upload_progress");
+            document.getElementById("process_button").disabled = true;
             try {
-                let response = await fetch("/upload", {
-                    method: "POST",
-                    body: formData
-                });
-                let result = await response.json();
-                if (result.success) {
-                    let fileList = document.getElementById("file_list");
-                    fileList.innerHTML = "";
-                    result.files.forEach(file => {
-                        let li = document.createElement("li");
-                        li.className = "flex items-center text-gray-700";
-                        li.innerHTML = `<svg class="w-5 h-5 mr-2 text-blue-500" fill="currentColor" viewBox="0 0 20 20"><path d="M10 2a6 6 0 00-6 6v3.586l-.707.707A1 1 0 004 14h12a1 1 0 00.707-1.707L16 11.586V8a6 6 0 00-6-6z"></path></svg>${file}`;
-                        fileList.appendChild(li);
-                    });
-                    document.getElementById("process_button").disabled = false;
-                    showToast("Файлы успешно загружены!", "success");
-                } else {
-                    showToast("Ошибка: " + result.message, "error");
+                let states = [];
+                for (let file of files) {
+                    states.push(await resumableUpload(file));
+                }
+                // Новая выборка файлов заменяет прежние, докачка — нет
+                let replace = states.every(state => state === null);
+                for (let i = 0; i < files.length; i++) {
+                    let file = files[i];
+                    let state = states[i];
+                    if (state === null) {
+                        let response = await fetch("/uploads", {
+                            method: "POST",
+                            headers: {"Content-Type": "application/json"},
+                            body: JSON.stringify({filename: file.name, size: file.size, chunk_size: CHUNK_SIZE, client: uploadClient(), replace: replace})
+                        });
+                        state = await response.json();
+                        if (!state.success) {
+                            throw new Error(state.message);
+                        }
+                        replace = false;
+                        localStorage.setItem(uploadKey(file), state.id);
+                    }
+                    for (let index of state.missing.slice()) {
+                        state = await putChunk(state, file, index);
+                        progressText.textContent = `${file.name}: ${state.received} из ${state.chunks} частей`;
+                    }
+                    states[i] = state;
                 }
+                // Готовые файлы декодируются на сервере, пока загружаются остальные; ждём последние
+                for (let i = 0; i < files.length; i++) {
+                    while (states[i].status === "decoding" || states[i].status === "uploading") {
+                        progressText.textContent = `Декодирование ${files[i].name}...`;
+                        await sleep(1000);
+                        states[i] = await uploadState(states[i].id);
+                    }
+                    if (states[i].status === "failed") {
+                        localStorage.removeItem(uploadKey(files[i]));
+                        throw new Error(`${files[i].name}: ${states[i].error}`);
+                    }
+                    localStorage.removeItem(uploadKey(files[i]));
+                }
+                progressText.textContent = "";
+                uploadedIds = states.map(state => state.id);
+                let fileList = document.getElementById("file_list");
+                fileList.innerHTML = "";
+                states.forEach(state => {
+                    let li = document.createElement("li");
+                    li.className = "flex items-center text-gray-700";
+                    li.innerHTML = `<svg class="w-5 h-5 mr-2 text-blue-500" fill="currentColor" viewBox="0 0 20 20"><path d="M10 2a6 6 0 00-6 6v3.586l-.707.707A1 1 0 004 14h12a1 1 0 00.707-1.707L16 11.586V8a6 6 0 00-6-6z"></path></svg>${state.filename}`;
+                    fileList.appendChild(li);
+                });
+                document.getElementById("process_button").disabled = false;
+                showToast("Файлы успешно загружены!", "success");
             } catch (error) {
-                showToast("Ошибка при загрузке: " + error.message, "error");
+                showToast("Ошибка при загрузке: " + error.message + ". Повторите загрузку — она продолжится с места обрыва", "error");
             }
         }
         async function processFiles() {
@@ -109,33 +250,69 @@ INDEX_HTML = """
             button.textContent = "Обработка...";
             var loader = document.getElementById("loader");
             loader.classList.remove("hidden");
+            var progressText = document.getElementById("progress_text");
+            var partial = document.getElementById("partial_results");
+            progressText.textContent = "Задание в очереди...";
+            partial.textContent = "";
             var formData = new FormData(document.getElementById("process_form"));
+            uploadedIds.forEach(id => formData.append("upload_id", id));
+            var finish = function() {
+                button.disabled = false;
+                button.textContent = "Обработать";
+                loader.classList.add("hidden");
+            };
             try {
-                let response = await fetch("/process", {
+                let response = await fetch("/jobs", {
                     method: "POST",
                     body: formData
                 });
                 let result = await response.json();
-                if (result.success) {
-                    let resultList = document.getElementById("result_list");
-                    resultList.innerHTML = "";
-                    result.files.forEach(file => {
-                        let li = document.createElement("li");
-                        li.className = "flex items-center";
-                        li.innerHTML = `<svg class="w-5 h-5 mr-2 text-green-500" fill="currentColor" viewBox="0 0 20 20"><path d="M6 2a2 2 0 00-2 2v12a2 2 0 002 2h8a2 2 0 002-2V7.414A2 2 0 0015.414 6L12 2.586A2 2 0 0010.586 2H6z"></path></svg><a href="/download/${file}" class="text-blue-600 hover:underline">${file}</a>`;
-                        resultList.appendChild(li);
-                    });
-                    document.getElementById("results_section").classList.remove("hidden");
-                    showToast("Обработка завершена!", "success");
-                } else {
+                if (!result.success) {
                     showToast("Ошибка: " + result.message, "error");
+                    finish();
+                    return;
                 }
+                let jobId = result.job_id;
+                let source = new EventSource(`/jobs/${jobId}/events`);
+                source.addEventListener("file_started", e => {
+                    let data = JSON.parse(e.data);
+                    progressText.textContent = `Файл ${data.index + 1} из ${data.total}: ${data.file}`;
+                });
+                source.addEventListener("transcript", e => {
+                    let data = JSON.parse(e.data);
+                    partial.textContent += `${data.file}: ${data.text}\n`;
+                });
+                source.addEventListener("segment", e => {
+                    let data = JSON.parse(e.data);
+                    progressText.textContent = `${data.file}: сегмент ${data.index + 1} из ${data.total}`;
+                    partial.textContent += `[${data.speaker}] ${data.start.toFixed(2)}-${data.end.toFixed(2)}s: ${data.text}\n`;
+                });
+                let onFinished = e => {
+                    source.close();
+                    let data = JSON.parse(e.data);
+                    if (data.result_files.length) {
+                        let resultList = document.getElementById("result_list");
+                        resultList.innerHTML = "";
+                        data.result_files.forEach(file => {
+                            let li = document.createElement("li");
+                            li.className = "flex items-center";
+                            li.innerHTML = `<svg class="w-5 h-5 mr-2 text-green-500" fill="currentColor" viewBox="0 0 20 20"><path d="M6 2a2 2 0 00-2 2v12a2 2 0 002 2h8a2 2 0 002-2V7.414A2 2 0 0015.414 6L12 2.586A2 2 0 0010.586 2H6z"></path></svg><a href="/jobs/${jobId}/download/${file}" class="text-blue-600 hover:underline">${file}</a>`;
+                            resultList.appendChild(li);
+                        });
+                        document.getElementById("results_section").classList.remove("hidden");
+                    }
+                    if (e.type === "done") {
+                        showToast("Обработка завершена!", "success");
+                    } else {
+                        showToast("Ошибка: " + data.errors.join("; "), "error");
+                    }
+                    finish();
+                };
+                source.addEventListener("done", onFinished);
+                source.addEventListener("failed", onFinished);
             } catch (error) {
                 showToast("Ошибка при обработке: " + error.message, "error");
-            } finally {
-                button.disabled = false;
-                button.textContent = "Обработать";
-                loader.classList.add("hidden");
+                finish();
             }
         }
         function showToast(message, type) {
@@ -174,6 +351,7 @@ INDEX_HTML = """
                 Загрузить аудиофайлы
             </button>
         </form>
+        <p id="upload_progress" class="mt-4 text-gray-600"></p>
         <ul id="file_list" class="mt-6 space-y-2"></ul>
         <form id="process_form" class="mt-6">
             <div class="mb-6">
@@ -197,6 +375,18 @@ INDEX_HTML = """
                     <span class="ml-2 text-gray-700 font-medium">Включить диаризацию</span>
                 </label>
             </div>
+            <div class="mb-6">
+                <label class="inline-flex items-center">
+                    <input type="checkbox" name="single_pass" class="form-checkbox h-5 w-5 text-blue-600 rounded">
+                    <span class="ml-2 text-gray-700 font-medium">Один проход ASR для диаризации (по таймстампам слов)</span>
+                </label>
+            </div>
+            <div class="mb-6">
+                <label class="inline-flex items-center">
+                    <input type="checkbox" name="vad_gate" class="form-checkbox h-5 w-5 text-blue-600 rounded">
+                    <span class="ml-2 text-gray-700 font-medium">Распознавать только участки речи (VAD, без диаризации)</span>
+                </label>
+            </div>
             <button id="process_button" type="button" onclick="processFiles()" disabled class="w-full bg-green-600 text-white font-semibold py-3 px-4 rounded-lg hover:bg-green-700 transition flex items-center justify-center">
                 <svg class="w-5 h-5 mr-2" fill="currentColor" viewBox="0 0 20 20"><path d="M5 4v12l11-6-11-6z"></path></svg>
                 Обработать
@@ -205,6 +395,8 @@ INDEX_HTML = """
         <div id="loader" class="hidden text-center mt-6">
             <div class="animate-spin rounded-full h-10 w-10 border-t-4 border-blue-600 mx-auto"></div>
             <p class="text-gray-700 mt-3 font-medium">Идёт обработка, ожидайте...</p>
+            <p id="progress_text" class="text-gray-500 mt-1"></p>
+            <pre id="partial_results" class="text-left text-sm text-gray-700 mt-4 max-h-64 overflow-y-auto whitespace-pre-wrap"></pre>
         </div>
         <div id="results_section" class="hidden mt-8">
             <h3 class="text-2xl font-semibold text-gray-700 mb-4">Скачать результаты:</h3>
@@ -244,44 +436,18 @@ RESULTS_HTML = """
 </html>
 """
 
-# Списки моделей для английского языка
-transducer_models_en = [
-    "stt_en_conformer_transducer_large", "stt_en_conformer_transducer_large_ls",
-    "stt_en_conformer_transducer_medium", "stt_en_conformer_transducer_small",
-    "stt_en_conformer_transducer_xlarge", "stt_en_conformer_transducer_xxlarge",
-    "stt_en_contextnet_1024", "stt_en_contextnet_1024_mls",
-    "stt_en_contextnet_256", "stt_en_contextnet_256_mls",
-    "stt_en_contextnet_512", "stt_en_contextnet_512_mls",
-    "stt_en_fastconformer_transducer_large", "stt_en_fastconformer_transducer_large_ls",
-    "stt_en_fastconformer_transducer_xlarge", "stt_en_fastconformer_transducer_xxlarge",
-    "stt_enes_conformer_transducer_large", "stt_enes_conformer_transducer_large_codesw",
-    "stt_enes_contextnet_large"
-]
-ctc_models_en = [
-    "stt_en_citrinet_1024", "stt_en_citrinet_1024_gamma_0_25",
-    "stt_en_citrinet_256", "stt_en_citrinet_256_gamma_0_25",
-    "stt_en_citrinet_512", "stt_en_citrinet_512_gamma_0_25",
-    "stt_en_conformer_ctc_large", "stt_en_conformer_ctc_large_ls",
-    "stt_en_conformer_ctc_medium", "stt_en_conformer_ctc_medium_ls",
-    "stt_en_conformer_ctc_small", "stt_en_conformer_ctc_small_ls",
-    "stt_en_conformer_ctc_xlarge", "stt_en_fastconformer_ctc_large",
-    "stt_en_fastconformer_ctc_large_ls", "stt_en_fastconformer_ctc_xlarge",
-    "stt_en_fastconformer_ctc_xxlarge", "stt_en_squeezeformer_ctc_large_ls",
-    "stt_en_squeezeformer_ctc_medium_large_ls", "stt_en_squeezeformer_ctc_medium_ls",
-    "stt_en_squeezeformer_ctc_small_ls", "stt_en_squeezeformer_ctc_small_medium_ls",
-    "stt_en_squeezeformer_ctc_xsmall_ls", "stt_enes_conformer_ctc_large",
-    "stt_enes_conformer_ctc_large_codesw", "stt_fr_no_hyphen_citrinet_1024_gamma_0_25",
-    "stt_fr_no_hyphen_conformer_ctc_large"
-]
-
-def clear_directory(directory: Path):
-    """Очищает указанную директорию."""
-    for item in directory.iterdir():
-        if item.is_file():
-            item.unlink()
-        elif item.is_dir():
-            shutil.rmtree(item, ignore_errors=True)
-    logger.info(f"🧹 Очищена директория: {directory}")
+# Списки моделей для английского языка (общий реестр с main.py)
+transducer_models_en = registry.models_for("en", "transducer")
+ctc_models_en = registry.models_for("en", "ctc")
+
+worker = InferenceWorker(max_queue=JOB_QUEUE_SIZE, concurrency=JOB_CONCURRENCY, timing_report=JOB_TIMING_REPORT,
+                         speaker_index=SpeakerIndex() if SPEAKER_INDEX else None)
+worker.start()
+if MODEL_CACHE_PIN or MODEL_CACHE_PRELOAD:
+    threading.Thread(target=worker.preload, args=(MODEL_CACHE_PRELOAD, MODEL_CACHE_PIN),
+                     name="model-preload", daemon=True).start()
+uploads = UploadManager(AUDIO_DIR)
+last_process_dir = None  # Папка результатов последнего /process (для /download/<файл>)
 
 def generate_templates():
     """Генерирует HTML шаблоны в папке templates."""
@@ -302,73 +468,355 @@ def index():
 
 @app.route("/upload", methods=["POST"])
 def upload():
-    clear_directory(AUDIO_DIR)
+    """Загрузка файлов одним multipart-запросом; возвращает upload_ids для /process и /jobs.
+
+    Поле client — как у /uploads: прежние загрузки этого клиента удаляются.
+    """
     audio_files = request.files.getlist("audio_files")
     if not audio_files or all(f.filename == '' for f in audio_files):
         return jsonify({"success": False, "message": "Не выбраны аудиофайлы"})
-    
-    uploaded_files = []
+    uploads.clear(request.form.get("client") or None)
+
+    uploaded = []
     for audio_file in audio_files:
         if audio_file and audio_file.filename:
-            file_path = AUDIO_DIR / audio_file.filename
-            audio_file.save(file_path)
-            logger.info(f"📥 Загружен файл: {file_path}")
-            uploaded_files.append(audio_file.filename)
-    
-    return jsonify({"success": True, "files": uploaded_files})
+            try:
+                uploaded.append(uploads.add(audio_file.filename, audio_file.stream, request.form.get("client") or None))
+            except UploadError as e:
+                return jsonify({"success": False, "message": str(e)}), 400
+            logger.info(f"📥 Загружен файл: {uploaded[-1].audio_path}")
+    # Запрос синхронный: отвечаем, когда файлы декодированы
+    for upload in uploaded:
+        upload.finished.wait()
+    failed = [f"{upload.filename}: {upload.error}" for upload in uploaded if upload.status == "failed"]
+    if failed:
+        return jsonify({"success": False, "message": "\n".join(failed)})
+
+    return jsonify({"success": True, "files": [upload.audio_path.name for upload in uploaded],
+                    "upload_ids": [upload.id for upload in uploaded]})
+
+def requested_audio_files() -> tuple:
+    """Аудиофайлы готовых загрузок из полей upload_id формы: (файлы, None) или (None, ошибка).
+
+    Задание берёт только перечисленные загрузки — не всю папку аудио, где лежат
+    файлы других клиентов.
+    """
+    files = []
+    for upload_id in request.form.getlist("upload_id"):
+        upload = uploads.get(upload_id)
+        if upload is None:
+            return None, f"Загрузка {upload_id} не найдена"
+        if upload.status != "ready":
+            return None, f"{upload.filename}: загрузка не готова ({upload.status})"
+        files.append(upload.audio_path)
+    if not files:
+        return None, "Нет загруженных аудиофайлов"
+    return files, None
+
+@app.route("/uploads", methods=["POST"])
+def create_upload():
+    """Начинает загрузку файла по частям: JSON {filename, size, chunk_size, sha256, client, replace}.
+
+    sha256 (необязательно) — сумма всего файла, проверяется после приёма всех частей.
+    client — id клиента; replace — первый файл новой выборки: прежние загрузки этого
+    клиента и их аудиофайлы удаляются, загрузки других клиентов остаются.
+    """
+    data = request.get_json(silent=True) or {}
+    client = str(data["client"]) if data.get("client") else None
+    try:
+        if data.get("replace"):
+            uploads.clear(client)
+        upload = uploads.create(data.get("filename"), int(data.get("size") or 0),
+                                int(data.get("chunk_size") or CHUNK_SIZE), data.get("sha256"), client)
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, **upload.to_dict()}), 201
+
+@app.route("/uploads/<upload_id>/chunks/<int:index>", methods=["PUT"])
+def upload_chunk(upload_id, index):
+    """Принимает часть index (тело запроса — сырые байты, заголовок X-Chunk-SHA256 — её сумма)."""
+    upload = uploads.get(upload_id)
+    if upload is None:
+        return jsonify({"success": False, "message": "Загрузка не найдена"}), 404
+    if request.content_length is not None and request.content_length > MAX_CHUNK_SIZE:
+        return jsonify({"success": False, "message": "Слишком большая часть"}), 413
+    try:
+        uploads.write_chunk(upload, index, request.get_data(cache=False), request.headers.get("X-Chunk-SHA256"))
+    except UploadError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, **upload.to_dict()})
+
+@app.route("/uploads/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    """Принятые и недостающие части загрузки и её статус (uploading, decoding, ready, failed)."""
+    upload = uploads.get(upload_id)
+    if upload is None:
+        return jsonify({"success": False, "message": "Загрузка не найдена"}), 404
+    return jsonify({"success": True, **upload.to_dict()})
 
 @app.route("/process", methods=["POST"])
 def process():
-    clear_directory(RESULTS_DIR)
-    
+    """Блокирующая обработка загруженных файлов; результаты — в своей папке задания, как у /jobs.
+
+    Общая папка results не очищается: в ней работают задания /jobs и /recluster,
+    которые воркер выполняет одновременно с этим.
+    """
+    global last_process_dir
     language = request.form.get("language", "ru")
     model_name = request.form.get("model_name")
     model_type = request.form.get("model_type")
     diarization = "diarization" in request.form
+    single_pass = "single_pass" in request.form
+    vad_gate = "vad_gate" in request.form
 
     if not model_name or not model_type:
         return jsonify({"success": False, "message": "Модель или тип модели не выбраны"})
+    audio_files, error = requested_audio_files()
+    if error is not None:
+        return jsonify({"success": False, "message": error}), 400
 
-    cmd = [sys.executable, "main.py", "--language", language, "--model_name", model_name]
-    if model_type == "transducer":
-        cmd.append("--transducer")
-    else:
-        cmd.append("--ctc")
-    if diarization:
-        cmd.append("--diarization")
-
-    logger.info(f"🚀 Запуск команды: {' '.join(cmd)}")
+    # Модели остаются загруженными в воркере между запросами
+    job = Job(language, model_type, model_name, diarization, single_pass, audio_files, vad_gate=vad_gate)
+    job.results_dir = JOBS_DIR / job.id
     try:
-        # Явно указываем кодировку utf-8 для subprocess
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            errors='replace'  # Заменяем неподдерживаемые символы
-        )
-        logger.info(result.stdout)
-        # Игнорируем предупреждения NeMo в stderr
-        if result.stderr and "[NeMo W" in result.stderr:
-            logger.info("Игнорируем предупреждения NeMo в stderr")
-        elif result.stderr:
-            logger.error(result.stderr)
-            return jsonify({"success": False, "message": result.stderr})
-    except subprocess.CalledProcessError as e:
-        logger.error(e.stderr)
-        return jsonify({"success": False, "message": e.stderr})
-    except UnicodeDecodeError as e:
-        logger.error(f"Ошибка декодирования вывода: {e}")
-        return jsonify({"success": False, "message": f"Ошибка декодирования: {e}"})
-
-    result_files = [f.name for f in RESULTS_DIR.iterdir() if f.is_file()]
+        worker.submit(job, block=False)
+    except queue.Full:
+        return jsonify({"success": False, "message": "Очередь заданий переполнена, попробуйте позже"}), 503
+    logger.info(f"🚀 Задание {job.id}: {language}, {model_type}, {model_name}, диаризация={diarization}")
+    job.wait()
+    if job.status == "failed":
+        message = "\n".join(job.errors)
+        logger.error(message)
+        return jsonify({"success": False, "message": message})
+
+    result_files = sorted(f.name for f in job.results_dir.iterdir() if f.is_file()) if job.results_dir.is_dir() else []
     if not result_files:
         return jsonify({"success": False, "message": "Результаты не созданы"})
 
-    return jsonify({"success": True, "files": result_files})
+    last_process_dir = job.results_dir
+    return jsonify({"success": True, "job_id": job.id, "files": result_files})
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """Ставит задание в очередь и сразу возвращает его id."""
+    language = request.form.get("language", "ru")
+    model_name = request.form.get("model_name")
+    model_type = request.form.get("model_type")
+    diarization = "diarization" in request.form
+    single_pass = "single_pass" in request.form
+    vad_gate = "vad_gate" in request.form
+
+    if not model_name or not model_type:
+        return jsonify({"success": False, "message": "Модель или тип модели не выбраны"}), 400
+    audio_files, error = requested_audio_files()
+    if error is not None:
+        return jsonify({"success": False, "message": error}), 400
+
+    job = Job(language, model_type, model_name, diarization, single_pass, audio_files, vad_gate=vad_gate)
+    job.results_dir = JOBS_DIR / job.id
+    try:
+        worker.submit(job, block=False)
+    except queue.Full:
+        return jsonify({"success": False, "message": "Очередь заданий переполнена, попробуйте позже"}), 503
+    logger.info(f"🚀 Задание {job.id} поставлено в очередь: {language}, {model_type}, {model_name}, "
+                f"диаризация={diarization}")
+    return jsonify({"success": True, "job_id": job.id}), 202
+
+@app.route("/recluster", methods=["POST"])
+def create_recluster_job():
+    """Повторная кластеризация загруженных файлов с новыми параметрами без VAD и эмбеддингов.
+
+    Признаки берутся из кэша прошлой диаризации; заново выполняются только
+    кластеризация и ASR по сегментам. Прогресс — как у /jobs.
+    """
+    language = request.form.get("language", "ru")
+    model_name = request.form.get("model_name")
+    model_type = request.form.get("model_type")
+    if not model_name or not model_type:
+        return jsonify({"success": False, "message": "Модель или тип модели не выбраны"}), 400
+
+    # get(type=...) возвращает None для нечисловых значений
+    num_speakers = request.form.get("num_speakers", type=int)
+    overrides = {name: request.form.get(name, type=kind)
+                 for name, kind in (("max_num_speakers", int), ("max_rp_threshold", float))
+                 if request.form.get(name)}
+    if any(value is None for value in overrides.values()) or (request.form.get("num_speakers") and num_speakers is None):
+        return jsonify({"success": False, "message": "Некорректные параметры кластеризации"}), 400
+
+    audio_files, error = requested_audio_files()
+    if error is not None:
+        return jsonify({"success": False, "message": error}), 400
+
+    job = Job(language, model_type, model_name, True, audio_files=audio_files,
+              recluster={"overrides": overrides, "num_speakers": num_speakers})
+    job.results_dir = JOBS_DIR / job.id
+    try:
+        worker.submit(job, block=False)
+    except queue.Full:
+        return jsonify({"success": False, "message": "Очередь заданий переполнена, попробуйте позже"}), 503
+    logger.info(f"🔁 Задание {job.id} (повторная кластеризация) поставлено в очередь: {overrides}, "
+                f"спикеров={num_speakers}")
+    return jsonify({"success": True, "job_id": job.id}), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = worker.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Задание не найдено"}), 404
+    return jsonify({"success": True, **job.to_dict()})
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    """Server-Sent Events: прогресс по файлам и сегментам и частичные результаты задания."""
+    job = worker.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Задание не найдено"}), 404
+    try:
+        last_id = max(-1, int(request.headers.get("Last-Event-ID", -1)))
+    except ValueError:
+        last_id = -1  # Испорченный заголовок — отдаём события с начала
+
+    def stream():
+        nonlocal last_id
+        while True:
+            events = job.wait_events(last_id, timeout=SSE_KEEPALIVE_SEC)
+            if not events:
+                if job.done.is_set():
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                last_id = event["id"]
+                yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/jobs/<job_id>/download/<filename>")
+def download_job_file(job_id, filename):
+    if worker.get(job_id) is None:
+        return jsonify({"success": False, "message": "Задание не найдено"}), 404
+    return send_from_directory(JOBS_DIR / job_id, filename, as_attachment=True)
+
+@app.route("/cache/stats")
+def cache_stats():
+    """Попадания и промахи кэша результатов."""
+    return jsonify(worker.cache.stats())
+
+@app.route("/worker/stats")
+def worker_stats():
+    """Тайминги холодных и тёплых заданий воркера."""
+    return jsonify(worker.stats())
+
+@app.route("/models")
+def models():
+    """Метаданные моделей из реестра и наличие локального чекпойнта."""
+    return jsonify([{**info._asdict(), "local_checkpoint": registry.local_checkpoint(info.name) is not None}
+                    for info in registry.MODELS.values()])
+
+@app.route("/models/cache")
+def models_cache():
+    """Резидентные модели, их память, попадания и промахи кэша моделей."""
+    return jsonify(worker.models.stats())
+
+@app.route("/speakers")
+def speakers():
+    """Размер индекса спикеров и известные имена."""
+    if worker.speaker_index is None:
+        return jsonify({"success": False, "message": "Индекс спикеров выключен (SPEAKER_INDEX=1)"}), 404
+    return jsonify(worker.speaker_index.stats())
+
+@app.route("/speakers/enroll", methods=["POST"])
+def enroll_speaker():
+    """JSON {name, recording, speaker}: имя для спикера записи; затем метки в результатах заменяются именами."""
+    if worker.speaker_index is None:
+        return jsonify({"success": False, "message": "Индекс спикеров выключен (SPEAKER_INDEX=1)"}), 404
+    data = request.get_json(silent=True) or {}
+    if not all(data.get(field) for field in ("name", "recording", "speaker")):
+        return jsonify({"success": False, "message": "Нужны поля name, recording и speaker"}), 400
+    try:
+        worker.speaker_index.enroll(data["name"], data["recording"], data["speaker"])
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 404
+    relabeled = {}
+    for results_dir in [RESULTS_DIR] + [path for path in JOBS_DIR.glob("*") if path.is_dir()]:
+        relabeled.update(relabel_results(worker.speaker_index, results_dir))
+    return jsonify({"success": True, "relabeled": relabeled})
+
+@app.route("/metrics")
+def metrics():
+    """Счётчики и гистограммы стадий в текстовом формате Prometheus."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+def stream_socket(ws):
+    """Потоковое распознавание по WebSocket (streaming.StreamSession).
+
+    Параметры — в строке запроса: language, model_type, model_name и diarization=1.
+    Бинарные сообщения — 16 кГц моно PCM s16le любыми кусками, текстовое
+    {"event": "end"} — конец потока. В ответ идут JSON-события partial и final с
+    полями segment, start, end, speaker, text; в конце — done со статистикой сессии.
+    """
+    language = request.args.get("language", "ru")
+    model_type = request.args.get("model_type")
+    model_name = request.args.get("model_name")
+    diarization = request.args.get("diarization") == "1"
+    try:
+        registry.resolve(language, model_type, model_name)
+        asr_model = worker.get_asr_model(language, model_type, model_name)
+        diarizer = worker.get_diarizer() if diarization else None
+    except Exception as e:
+        logger.error(f"❌ Поток не начат: {e}")
+        ws.send(json.dumps({"event": "error", "message": str(e)}, ensure_ascii=False))
+        return
+    session = StreamSession(lambda samples: transcribe_chunk(samples, asr_model),
+                            (lambda pieces: embed_speech(pieces, diarizer)) if diarizer is not None else None,
+                            load_streaming())
+    logger.info(f"🎧 Поток: {language}, {model_type}, {model_name}, диаризация={diarization}")
+    leftover = b""
+    finished = False
+    try:
+        while not finished:
+            message = ws.receive(timeout=STREAM_IDLE_SEC)
+            received_at = time.perf_counter()
+            finished = message is None
+            chunks = [leftover]
+            # Всё, что успело прийти, обрабатывается одним шагом — при медленном шаге отставание не копится
+            while message is not None:
+                if isinstance(message, str):
+                    try:
+                        finished = json.loads(message).get("event") == "end"
+                    except (ValueError, AttributeError):
+                        ws.send(json.dumps({"event": "error", "message": "Ожидался JSON вида {\"event\": \"end\"}"},
+                                           ensure_ascii=False))
+                    break
+                chunks.append(message)
+                message = ws.receive(timeout=0)
+            data = b"".join(chunks)
+            leftover = data[len(data) // 2 * 2:]
+            samples = np.frombuffer(data[:len(data) // 2 * 2], dtype="<i2").astype(np.float32) / 32768
+            events = session.feed(samples)
+            if finished:
+                events.extend(session.finish())
+            for event in events:
+                STREAM_LAG.observe(time.perf_counter() - received_at, event=event["event"])
+                ws.send(json.dumps(event, ensure_ascii=False))
+        ws.send(json.dumps({"event": "done", **session.stats}))
+    except ConnectionClosed:
+        logger.info(f"🎧 Поток закрыт клиентом: {session.stats['audio_sec']:.1f} с аудио, "
+                    f"{session.stats['finals']} сегментов")
+        return
+    logger.info(f"🎧 Поток завершён: {session.stats['audio_sec']:.1f} с аудио, {session.stats['finals']} сегментов")
+
+if Sock is not None:
+    Sock(app).route("/stream")(stream_socket)
+else:
+    logger.warning("⚠️ Пакет flask-sock не установлен: потоковое распознавание /stream недоступно")
 
 @app.route("/download/<filename>")
 def download_file(filename):
+    """Файл из results или, для клиентов /process без job_id, из папки последнего задания /process."""
+    if last_process_dir is not None and not (RESULTS_DIR / filename).is_file():
+        return send_from_directory(last_process_dir, filename, as_attachment=True)
     return send_from_directory(RESULTS_DIR, filename, as_attachment=True)
 
 if __name__ == "__main__":
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""Общая очередь файлов для обработки одной папки несколькими процессами или машинами.
+
+Очередь — папка на общей файловой системе (queue_dir), брокер не нужен:
+- leases/<ключ>.lease — аренда файла воркером. Создаётся через O_CREAT | O_EXCL,
+  поэтому файл захватывает ровно один воркер. Пока файл в работе, воркер раз в
+  HEARTBEAT_SEC обновляет mtime аренды; аренда без обновления дольше
+  LEASE_TTL_SEC считается брошенной (воркер упал или потерял связь), и её
+  забирает любой другой воркер — переименованием, которое удаётся только одному;
+- done/<ключ>.json — файл обработан (кем, когда, сколько секунд аудио, где результаты);
+- failed/<ключ>.json — неудачные попытки (в том числе истёкшие аренды); после
+  max_attempts попыток файл больше не берётся;
+- workers/<воркер>.json — состояние воркера для координатора (python shard.py status);
+- queue.json — конфигурация прогона: воркер с другой конфигурацией не подключится.
+
+Каждый воркер пишет результаты и свой журнал (journal.<воркер>.jsonl) в свою
+папку results, а общую очередь трогает только через эти файлы. Ключ файла —
+хэш его имени в папке с аудио, поэтому папка может быть смонтирована на разных
+машинах по разным путям.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import hashlib
+import logging
+import argparse
+import threading
+from pathlib import Path
+
+from journal import MAX_ATTEMPTS, config_id
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL_SEC = float(os.environ.get("SHARD_LEASE_TTL_SEC", "120"))  # Аренда без heartbeat дольше — брошена
+HEARTBEAT_SEC = LEASE_TTL_SEC / 4
+POLL_SEC = float(os.environ.get("SHARD_POLL_SEC", "5"))  # Как часто ждать чужие аренды в конце прогона
+THROUGHPUT_WINDOW_SEC = 600.0  # Окно, по которому координатор считает текущую скорость
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg")
+QUEUE_NAME = "queue.json"
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def file_key(name: str) -> str:
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()[:20]
+
+
+def _read_json(path: Path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # Файла нет или его как раз переписывают
+
+
+def _write_json_atomic(path: Path, data: dict):
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _listdir(path: Path, suffix: str) -> set:
+    """Ключи файлов папки с окончанием suffix — один listdir вместо stat на каждый файл."""
+    try:
+        return {name[:-len(suffix)] for name in os.listdir(path) if name.endswith(suffix)}
+    except FileNotFoundError:
+        return set()
+
+
+class WorkQueue:
+    """Очередь файлов audio_dir в общей папке queue_dir (см. описание модуля)."""
+
+    def __init__(self, queue_dir: Path, audio_dir: Path, config: dict = None, lease_ttl: float = LEASE_TTL_SEC,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.queue_dir = queue_dir
+        self.audio_dir = audio_dir
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max(1, max_attempts)
+        self.leases_dir = queue_dir / "leases"
+        self.done_dir = queue_dir / "done"
+        self.failed_dir = queue_dir / "failed"
+        self.workers_dir = queue_dir / "workers"
+        for path in (self.leases_dir, self.done_dir, self.failed_dir, self.workers_dir):
+            path.mkdir(parents=True, exist_ok=True)
+        if config is not None:
+            self._check_config(config)
+
+    def _check_config(self, config: dict):
+        path = self.queue_dir / QUEUE_NAME
+        data = {"config": config, "config_id": config_id(config), "created": time.time()}
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            existing = _read_json(path)
+            if existing is not None and existing["config_id"] != data["config_id"]:
+                raise ValueError(f"Очередь {self.queue_dir} создана с другой конфигурацией: {existing['config']}. "
+                                 "Для новых параметров нужна новая папка очереди")
+            return
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    def files(self) -> list:
+        return sorted(f for f in self.audio_dir.iterdir() if f.suffix.lower() in AUDIO_EXTENSIONS)
+
+    def _lease_path(self, key: str) -> Path:
+        return self.leases_dir / f"{key}.lease"
+
+    def _failed_path(self, key: str) -> Path:
+        return self.failed_dir / f"{key}.json"
+
+    def attempts(self, key: str) -> int:
+        failed = _read_json(self._failed_path(key))
+        return failed["attempts"] if failed is not None else 0
+
+    def lease_age(self, key: str) -> float:
+        """Секунды с последнего heartbeat аренды; None, если аренды нет."""
+        try:
+            return time.time() - os.stat(self._lease_path(key)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def snapshot(self) -> tuple:
+        """(готовые ключи, ключи с неудачными попытками, ключи аренд) — по одному listdir на папку."""
+        return (_listdir(self.done_dir, ".json"), _listdir(self.failed_dir, ".json"),
+                _listdir(self.leases_dir, ".lease"))
+
+    def claim(self, audio_file: Path, worker: str) -> str:
+        """Захватывает файл; возвращает токен аренды или None, если файл занят, готов или исчерпал попытки."""
+        key = file_key(audio_file.name)
+        if (self.done_dir / f"{key}.json").exists() or self.attempts(key) >= self.max_attempts:
+            return None
+        token = uuid.uuid4().hex
+        if not self._create_lease(key, audio_file, worker, token):
+            age = self.lease_age(key)
+            if age is None or age <= self.lease_ttl or not self._break_lease(key, audio_file):
+                return None
+            # Попытка брошенной аренды засчитана — файл мог уронить воркер
+            if self.attempts(key) >= self.max_attempts or not self._create_lease(key, audio_file, worker, token):
+                return None
+        if (self.done_dir / f"{key}.json").exists():
+            # Другой воркер закончил файл между проверкой и захватом
+            self.release(audio_file, token)
+            return None
+        return token
+
+    def _create_lease(self, key: str, audio_file: Path, worker: str, token: str) -> bool:
+        try:
+            fd = os.open(self._lease_path(key), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"file": audio_file.name, "worker": worker, "host": socket.gethostname(), "pid": os.getpid(),
+                       "token": token, "claimed": time.time()}, f, ensure_ascii=False)
+        return True
+
+    def _break_lease(self, key: str, audio_file: Path) -> bool:
+        """Забирает брошенную аренду. Из нескольких воркеров переименование удаётся одному."""
+        lease_path = self._lease_path(key)
+        stale_path = lease_path.with_name(f"{lease_path.name}.{uuid.uuid4().hex}.stale")
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return False
+        try:
+            if time.time() - os.stat(stale_path).st_mtime <= self.lease_ttl:
+                # Пока мы проверяли возраст, аренду уже забрали и пересоздали — возвращаем её владельцу
+                try:
+                    os.link(stale_path, lease_path)
+                except FileExistsError:
+                    pass
+                return False
+            lease = _read_json(stale_path) or {}
+        finally:
+            stale_path.unlink()
+        logger.warning(f"⚠️ {audio_file.name}: аренда воркера {lease.get('worker')} истекла, файл забран заново")
+        self._record_failure(key, audio_file, f"Аренда воркера {lease.get('worker')} истекла", lease.get("worker"),
+                             expired=True)
+        return True
+
+    def heartbeat(self, audio_file: Path, token: str) -> bool:
+        """Продлевает аренду; False, если она уже не наша (истекла и забрана другим воркером)."""
+        lease_path = self._lease_path(file_key(audio_file.name))
+        lease = _read_json(lease_path)
+        if lease is None or lease["token"] != token:
+            return False
+        os.utime(lease_path)
+        return True
+
+    def release(self, audio_file: Path, token: str):
+        lease_path = self._lease_path(file_key(audio_file.name))
+        lease = _read_json(lease_path)
+        if lease is not None and lease["token"] == token:
+            lease_path.unlink(missing_ok=True)
+
+    def complete(self, audio_file: Path, token: str, worker: str, **data):
+        """Отмечает файл готовым и снимает аренду. Повторное завершение безопасно (результаты перезаписаны атомарно)."""
+        key = file_key(audio_file.name)
+        _write_json_atomic(self.done_dir / f"{key}.json",
+                           {"file": audio_file.name, "worker": worker, "finished": time.time(),
+                            "attempts": self.attempts(key), **data})
+        self.release(audio_file, token)
+
+    def fail(self, audio_file: Path, token: str, worker: str, error: str):
+        """Засчитывает неудачную попытку и снимает аренду: файл повторит любой воркер, пока попытки не кончатся."""
+        key = file_key(audio_file.name)
+        attempts = self._record_failure(key, audio_file, error, worker)
+        self.release(audio_file, token)
+        if attempts >= self.max_attempts:
+            logger.warning(f"⚠️ {audio_file.name}: {attempts} неудачных попыток, файл больше не берётся")
+
+    def _record_failure(self, key: str, audio_file: Path, error: str, worker: str, expired: bool = False) -> int:
+        failed = _read_json(self._failed_path(key)) or {"file": audio_file.name, "attempts": 0, "expired": 0}
+        failed["attempts"] += 1
+        failed["expired"] += int(expired)
+        failed.update(error=error, worker=worker, time=time.time())
+        _write_json_atomic(self._failed_path(key), failed)
+        return failed["attempts"]
+
+    def write_worker(self, worker: str, data: dict):
+        _write_json_atomic(self.workers_dir / f"{worker}.json", data)
+
+    def status(self, window_sec: float = THROUGHPUT_WINDOW_SEC) -> dict:
+        """Сводка очереди для координатора: файлы по состояниям, воркеры, скорость и оценка остатка."""
+        now = time.time()
+        files = self.files()
+        done_keys, failed_keys, lease_keys = self.snapshot()
+        counts = {"done": 0, "leased": 0, "expired": 0, "pending": 0, "retry": 0, "gave_up": 0}
+        done, failures, expired_leases = [], [], 0
+        for audio_file in files:
+            key = file_key(audio_file.name)
+            failed = _read_json(self._failed_path(key)) if key in failed_keys else None
+            expired_leases += failed.get("expired", 0) if failed is not None else 0
+            if key in done_keys:
+                counts["done"] += 1
+                entry = _read_json(self.done_dir / f"{key}.json")
+                if entry is not None:
+                    done.append(entry)
+                continue
+            if key in lease_keys:
+                age = self.lease_age(key)
+                counts["expired" if age is not None and age > self.lease_ttl else "leased"] += 1
+            elif failed is not None and failed["attempts"] >= self.max_attempts:
+                counts["gave_up"] += 1
+            else:
+                counts["retry" if failed is not None else "pending"] += 1
+            if failed is not None:
+                failures.append(failed)
+
+        recent = [entry for entry in done if now - entry["finished"] <= window_sec]
+        span_sec = min(window_sec, now - min((entry["finished"] for entry in recent), default=now))
+        files_per_min = 60 * len(recent) / span_sec if span_sec > 0 else 0.0
+        remaining = counts["leased"] + counts["expired"] + counts["pending"] + counts["retry"]
+
+        workers = []
+        for path in sorted(self.workers_dir.glob("*.json")):
+            worker = _read_json(path)
+            if worker is None:
+                continue
+            elapsed = max(worker["heartbeat"] - worker["started"], 1e-9)
+            worker["alive"] = not worker.get("finished") and now - worker["heartbeat"] <= self.lease_ttl
+            worker["files_per_min"] = 60 * worker["done"] / elapsed
+            worker["rtf"] = elapsed / worker["audio_sec"] if worker["audio_sec"] else None
+            workers.append(worker)
+        return {
+            "files": len(files),
+            **counts,
+            "expired_leases": expired_leases,
+            "files_per_min": files_per_min,
+            "audio_sec_per_sec": sum(entry.get("audio_sec", 0.0) for entry in recent) / span_sec if span_sec > 0 else 0.0,
+            "eta_sec": 60 * remaining / files_per_min if files_per_min > 0 else None,
+            "workers": workers,
+            "failures": failures,
+        }
+
+
+class ShardWorker:
+    """Воркер общей очереди.
+
+    claims() лениво отдаёт конвейеру захваченные файлы, mark() повторяет интерфейс
+    журнала (BatchPipeline пишет в него состояния) и по целевому состоянию или
+    failed закрывает аренду в очереди. Поток heartbeat продлевает аренды файлов в
+    работе и публикует состояние воркера в workers/<воркер>.json.
+    """
+
+    def __init__(self, queue: WorkQueue, journal, worker_id: str = None, poll_sec: float = POLL_SEC):
+        self.queue = queue
+        self.journal = journal
+        self.worker_id = worker_id or default_worker_id()
+        self.poll_sec = poll_sec
+        self.started = time.time()
+        self.claimed = []
+        self.done = 0
+        self.failed = 0
+        self.audio_sec = 0.0
+        self._held = {}  # Имя файла → (файл, токен аренды)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def claims(self):
+        """Один проход по папке: захватывает и отдаёт свободные файлы, включая брошенные другими воркерами."""
+        done_keys, _, lease_keys = self.queue.snapshot()
+        for audio_file in self.queue.files():
+            key = file_key(audio_file.name)
+            if key in done_keys:
+                continue
+            if key in lease_keys:
+                # Живые аренды отсеиваются без попытки O_EXCL
+                age = self.queue.lease_age(key)
+                if age is not None and age <= self.queue.lease_ttl:
+                    continue
+            token = self.queue.claim(audio_file, self.worker_id)
+            if token is None:
+                continue
+            with self._lock:
+                self._held[audio_file.name] = (audio_file, token)
+            self.claimed.append(audio_file)
+            yield audio_file
+
+    def unfinished(self) -> int:
+        """Файлы, которые ещё может обработать кто-то из воркеров (не готовы и не исчерпали попытки)."""
+        status = self.queue.status()
+        return status["leased"] + status["expired"] + status["pending"] + status["retry"]
+
+    def run(self, batch) -> dict:
+        """Обрабатывает файлы очереди конвейером batch, пока у очереди есть незавершённые файлы.
+
+        Когда свободных файлов нет, а чужие ещё в работе, воркер ждёт: если их
+        воркер упадёт, аренды истекут и файлы заберёт этот.
+        """
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="shard-heartbeat", daemon=True)
+        heartbeat.start()
+        started = time.perf_counter()
+        files = 0
+        summary = None
+        try:
+            while True:
+                claimed = len(self.claimed)
+                summary = batch.run(self.claims())
+                files += summary["files"]
+                if not self.unfinished():
+                    break
+                if len(self.claimed) == claimed:
+                    time.sleep(self.poll_sec)
+        finally:
+            self._stop.set()
+            heartbeat.join()
+            self._publish(finished=True)
+        wall = time.perf_counter() - started
+        return dict(summary, files=files, wall_s=wall, stages=[stage.to_dict(wall) for stage in batch.stats.values()])
+
+    def mark(self, audio_file: Path, state: str, **data):
+        self.journal.mark(audio_file, state, **data)
+        if state not in (self.journal.target, "failed"):
+            return
+        with self._lock:
+            held = self._held.pop(audio_file.name, None)
+        if held is None:
+            return
+        _, token = held
+        if state == "failed":
+            self.failed += 1
+            self.queue.fail(audio_file, token, self.worker_id, data.get("error") or "")
+        else:
+            self.done += 1
+            self.audio_sec += data.get("audio_sec", 0.0)
+            self.queue.complete(audio_file, token, self.worker_id, audio_sec=data.get("audio_sec"),
+                                results=[str(Path(result).resolve()) for result in data.get("results", ())])
+
+    def _heartbeat_loop(self):
+        while not self._stop.is_set():
+            with self._lock:
+                held = list(self._held.values())
+            for audio_file, token in held:
+                try:
+                    if not self.queue.heartbeat(audio_file, token):
+                        logger.warning(f"⚠️ Аренда {audio_file.name} потеряна (истекла и забрана другим воркером)")
+                        with self._lock:
+                            self._held.pop(audio_file.name, None)
+                except OSError as e:
+                    logger.error(f"❌ Ошибка heartbeat для {audio_file.name}: {e}")
+            self._publish()
+            self._stop.wait(HEARTBEAT_SEC)
+
+    def _publish(self, finished: bool = False):
+        with self._lock:
+            held = sorted(self._held)
+        try:
+            self.queue.write_worker(self.worker_id, {
+                "worker": self.worker_id, "host": socket.gethostname(), "pid": os.getpid(),
+                "started": self.started, "heartbeat": time.time(), "finished": finished,
+                "claimed": len(self.claimed), "done": self.done, "failed": self.failed,
+                "audio_sec": self.audio_sec, "in_progress": held,
+            })
+        except OSError as e:
+            logger.error(f"❌ Не удалось обновить состояние воркера: {e}")
+
+
+def format_status(status: dict) -> str:
+    eta = f"{status['eta_sec'] / 60:.1f} мин" if status["eta_sec"] is not None else "—"
+    lines = [
+        f"Файлов {status['files']}: готово {status['done']}, в работе {status['leased']}, "
+        f"брошено {status['expired']}, ждут {status['pending']}, повтор {status['retry']}, "
+        f"исчерпали попытки {status['gave_up']}",
+        f"Скорость: {status['files_per_min']:.1f} файлов/мин, {status['audio_sec_per_sec']:.1f} с аудио/с, "
+        f"осталось ~{eta}; истёкших аренд {status['expired_leases']}",
+        "",
+        f"{'worker':<32} {'state':<8} {'done':>6} {'failed':>6} {'files/min':>9} {'rtf':>7}  in progress",
+    ]
+    for worker in status["workers"]:
+        state = "alive" if worker["alive"] else "finished" if worker.get("finished") else "lost"
+        rtf = f"{worker['rtf']:.3f}" if worker["rtf"] is not None else "—"
+        lines.append(f"{worker['worker']:<32} {state:<8} {worker['done']:>6} {worker['failed']:>6} "
+                     f"{worker['files_per_min']:>9.1f} {rtf:>7}  {', '.join(worker['in_progress'])}")
+    for failed in status["failures"]:
+        lines.append(f"❌ {failed['file']}: попыток {failed['attempts']}, {failed['error']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared work queue coordinator (workers run main.py --queue_dir)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    status_parser = subparsers.add_parser("status", help="Show progress and throughput across workers")
+    status_parser.add_argument("--queue_dir", type=Path, required=True, help="Shared queue folder")
+    status_parser.add_argument("--audio_dir", type=Path, default=Path("audio"), help="Audio folder of the queue")
+    status_parser.add_argument("--max_attempts", type=int, default=MAX_ATTEMPTS,
+                               help="Attempts after which a file is given up (as passed to the workers)")
+    status_parser.add_argument("--watch", type=float, default=0, help="Refresh every N seconds until all files finish")
+    status_parser.add_argument("--json", action="store_true", help="Print the status as JSON")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue_dir, args.audio_dir, max_attempts=args.max_attempts)
+    while True:
+        status = queue.status()
+        print(json.dumps(status, ensure_ascii=False) if args.json else format_status(status), flush=True)
+        unfinished = status["leased"] + status["expired"] + status["pending"] + status["retry"]
+        if args.watch <= 0 or not unfinished:
+            return
+        time.sleep(args.watch)
+        if not args.json:
+            print()
+
+
+if __name__ == "__main__":
+    if sys.platform == "win32":
+        import io
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+    main()
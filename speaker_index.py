@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""Индекс спикеров между записями: центроиды эмбеддингов, поиск ближайших и имена известных спикеров.
+
+После диаризации каждый спикер записи сохраняется одной строкой — нормированным
+центроидом его эмбеддингов TitaNet (block_diarization.speaker_centroids). Строки
+дописываются в плоский файл float32 (vectors.f32), который читается через
+np.memmap: открытие индекса не читает его целиком, а поиск идёт блоками по
+SEARCH_BLOCK_ROWS строк матричным умножением (косинус нормированных векторов)
+сразу для пакета запросов, с отбором лучших через argpartition. Метаданные строк
+(запись, метка спикера, секунды речи) — в rows.jsonl, размерность — в index.json.
+
+Записанный повторно файл получает новые строки, прежние его строки исключаются
+из поиска. Имена (enroll) привязываются к строкам: «speaker_1 в meeting — это
+Анна». Спикеры новых записей сравниваются со всеми строками каждого имени, и
+метки в тексте диаризации заменяются именами (relabel_text, команда relabel).
+
+Индекс пишет один процесс (main.py или server.py); читать его могут несколько.
+
+Запуск:
+    python speaker_index.py enroll --name Анна --recording meeting --speaker speaker_1
+    python speaker_index.py relabel --results_dir results
+"""
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SPEAKER_INDEX_DIR = Path(os.environ.get("SPEAKER_INDEX_DIR", "speakers"))
+# Косинус центроидов, начиная с которого спикер записи считается известным (именованным)
+SPEAKER_MATCH_THRESHOLD = float(os.environ.get("SPEAKER_MATCH_THRESHOLD", "0.7"))
+SEARCH_BLOCK_ROWS = 65536  # Строк индекса на одно матричное умножение при поиске
+DIARIZATION_SUFFIX = "-diarization.txt"
+_LABEL = re.compile(r"^\[(speaker_\d+)\]", re.MULTILINE)
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-9)
+
+
+class SpeakerIndex:
+    """Хранилище центроидов спикеров с пакетным поиском ближайших по косинусу (см. описание модуля)."""
+
+    def __init__(self, root: Path = SPEAKER_INDEX_DIR):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = root / "vectors.f32"
+        self._rows_path = root / "rows.jsonl"
+        self._names_path = root / "names.json"
+        self._lock = threading.Lock()
+        self._matrix = None
+        self.dim = None
+        self.rows = []  # Метаданные строк по порядку: recording, speaker, seconds, added_at
+        self._active = bytearray()  # 1 — строка последней версии своей записи (участвует в поиске)
+        self.recordings = {}  # Запись → номера её актуальных строк
+        self.names = {}  # Имя → номера строк
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.root / "index.json", "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        except (OSError, ValueError, KeyError):
+            return
+        rows = []
+        if self._rows_path.exists():
+            with open(self._rows_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        break  # Строка, недописанная при сбое, и всё после неё
+        row_bytes = 4 * self.dim
+        count = min(len(rows), self._vectors_path.stat().st_size // row_bytes if self._vectors_path.exists() else 0)
+        # Векторы и метаданные дописываются по очереди: после сбоя выравниваем их по короткому
+        if self._vectors_path.exists() and self._vectors_path.stat().st_size != count * row_bytes:
+            os.truncate(self._vectors_path, count * row_bytes)
+        if len(rows) != count:
+            rows = rows[:count]
+            self._write_lines(self._rows_path, rows)
+        for row in rows:
+            self._append_row(row)
+        try:
+            with open(self._names_path, "r", encoding="utf-8") as f:
+                self.names = {name: [i for i in ids if i < count] for name, ids in json.load(f).items()}
+        except (OSError, ValueError):
+            self.names = {}
+
+    def _append_row(self, row: dict):
+        i = len(self.rows)
+        self.rows.append(row)
+        self._active.append(1)
+        if row.get("first"):
+            # Первая строка новой версии записи: прежние строки этой записи выходят из поиска
+            for j in self.recordings.get(row["recording"], []):
+                self._active[j] = 0
+            self.recordings[row["recording"]] = []
+        self.recordings.setdefault(row["recording"], []).append(i)
+
+    @staticmethod
+    def _write_lines(path: Path, rows: list):
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+
+    def add(self, recording: str, centroids: dict) -> list:
+        """Сохраняет спикеров записи: {метка: (центроид, секунды речи)}; возвращает номера новых строк."""
+        if not centroids:
+            return []
+        labels = sorted(centroids)
+        vectors = _normalize([centroids[label][0] for label in labels])
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self.root / "index.json", "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim}, f)
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Размерность эмбеддингов {vectors.shape[1]} не совпадает с индексом ({self.dim})")
+            rows = [{"recording": recording, "speaker": label, "seconds": float(centroids[label][1]),
+                     "added_at": time.time(), "first": k == 0} for k, label in enumerate(labels)]
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._rows_path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+            start = len(self.rows)
+            for row in rows:
+                self._append_row(row)
+            self._matrix = None
+        logger.info(f"🗂️ {recording}: {len(labels)} спикеров в индексе (всего строк {len(self.rows)})")
+        return list(range(start, start + len(rows)))
+
+    def matrix(self) -> np.ndarray:
+        """Все строки индекса (memmap только для чтения)."""
+        return self._snapshot()[0]
+
+    def _snapshot(self) -> tuple:
+        """Согласованные (матрица, маска актуальных строк) на момент вызова."""
+        with self._lock:
+            if self._matrix is None or len(self._matrix) != len(self.rows):
+                self._matrix = (np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(len(self.rows), self.dim))
+                                if self.rows else np.zeros((0, self.dim or 0), dtype=np.float32))
+            return self._matrix, np.frombuffer(bytes(self._active), dtype=bool)
+
+    def search(self, queries, k: int = 5) -> tuple:
+        """k ближайших актуальных строк для каждого запроса: (номера строк, косинусы), по убыванию сходства.
+
+        Если актуальных строк меньше k, недостающие места — номер -1 и косинус -inf.
+        """
+        queries = _normalize(queries)
+        matrix, active = self._snapshot()
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for start in range(0, len(matrix), SEARCH_BLOCK_ROWS):
+            scores = queries @ matrix[start:start + SEARCH_BLOCK_ROWS].T
+            block_active = active[start:start + SEARCH_BLOCK_ROWS]
+            if not block_active.all():
+                scores[:, ~block_active] = -np.inf
+            top = min(k, scores.shape[1])
+            ids = np.argpartition(-scores, top - 1, axis=1)[:, :top]
+            # Лучшие блока вместе с лучшими прошлых блоков; оставляем k
+            ids = np.concatenate((best_ids, ids + start), axis=1)
+            scores = np.concatenate((best_scores, np.take_along_axis(scores, ids[:, k:] - start, axis=1)), axis=1)
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_ids = np.take_along_axis(ids, keep, axis=1)
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best_ids = np.take_along_axis(best_ids, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_ids[np.isneginf(best_scores)] = -1
+        return best_ids, best_scores
+
+    def name_scores(self, queries) -> tuple:
+        """(имена, косинусы запросов с ближайшей строкой каждого имени — матрица запросы × имена)."""
+        queries = _normalize(queries)
+        names = sorted(name for name, ids in self.names.items() if ids)
+        if not names:
+            return [], np.zeros((len(queries), 0), dtype=np.float32)
+        matrix = self.matrix()
+        ids = [i for name in names for i in self.names[name]]
+        scores = queries @ np.asarray(matrix[ids]).T
+        bounds = np.cumsum([0] + [len(self.names[name]) for name in names[:-1]])
+        return names, np.maximum.reduceat(scores, bounds, axis=1)
+
+    def identify(self, queries, threshold: float = SPEAKER_MATCH_THRESHOLD) -> list:
+        """Имя ближайшего известного спикера для каждого запроса (None — ни одно не ближе threshold)."""
+        names, scores = self.name_scores(queries)
+        if not names:
+            return [None] * len(scores)
+        best = np.argmax(scores, axis=1)
+        return [names[j] if scores[i, j] >= threshold else None for i, j in enumerate(best)]
+
+    def names_for(self, recording: str, threshold: float = SPEAKER_MATCH_THRESHOLD) -> dict:
+        """{метка: имя} для спикеров записи; два спикера одной записи не получают одно имя."""
+        ids = self.recordings.get(recording, [])
+        if not ids:
+            return {}
+        names, scores = self.name_scores(np.asarray(self.matrix()[ids]))
+        mapping, used = {}, set()
+        for flat in np.argsort(-scores, axis=None):
+            i, j = divmod(int(flat), scores.shape[1])
+            if scores[i, j] < threshold:
+                break
+            label = self.rows[ids[i]]["speaker"]
+            if label in mapping or names[j] in used:
+                continue
+            mapping[label] = names[j]
+            used.add(names[j])
+        return mapping
+
+    def enroll(self, name: str, recording: str, speaker: str) -> int:
+        """Привязывает имя к спикеру записи из индекса; возвращает номер строки."""
+        with self._lock:
+            row = next((i for i in self.recordings.get(recording, []) if self.rows[i]["speaker"] == speaker), None)
+            if row is None:
+                raise ValueError(f"Спикер {speaker} записи {recording} не найден в индексе")
+            if row not in self.names.setdefault(name, []):
+                self.names[name].append(row)
+            self._save_names()
+        logger.info(f"🏷️ {recording}/{speaker} → {name}")
+        return row
+
+    def unenroll(self, name: str):
+        with self._lock:
+            if self.names.pop(name, None) is None:
+                raise ValueError(f"Имя {name} не найдено в индексе")
+            self._save_names()
+
+    def _save_names(self):
+        tmp_path = self._names_path.with_name(f".{self._names_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.names, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self._names_path)
+
+    def stats(self) -> dict:
+        return {
+            "dim": self.dim,
+            "rows": len(self.rows),
+            "active_rows": sum(self._active),
+            "recordings": len(self.recordings),
+            "names": {name: len(ids) for name, ids in self.names.items()},
+            "size_mb": self._vectors_path.stat().st_size / 2 ** 20 if self._vectors_path.exists() else 0.0,
+        }
+
+
+def relabel_text(text: str, mapping: dict) -> str:
+    """Заменяет метки speaker_N в тексте диаризации ([метка] start-end s: текст) именами из mapping."""
+    if not mapping:
+        return text
+    return _LABEL.sub(lambda match: f"[{mapping.get(match.group(1), match.group(1))}]", text)
+
+
+def relabel_results(index: SpeakerIndex, results_dir: Path, threshold: float = SPEAKER_MATCH_THRESHOLD) -> dict:
+    """Подставляет имена во все <запись>-diarization.txt папки; возвращает {файл: {метка: имя}}."""
+    relabeled = {}
+    for path in sorted(results_dir.glob(f"*{DIARIZATION_SUFFIX}")):
+        mapping = index.names_for(path.name[:-len(DIARIZATION_SUFFIX)], threshold)
+        text = path.read_text(encoding="utf-8")
+        new_text = relabel_text(text, mapping)
+        if new_text == text:
+            continue
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(new_text, encoding="utf-8")
+        os.replace(tmp_path, path)
+        relabeled[path.name] = mapping
+    return relabeled
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-recording speaker index: enrollment and relabeling")
+    parser.add_argument("--index_dir", type=Path, default=SPEAKER_INDEX_DIR, help="Speaker index folder")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show index size and enrolled names")
+    enroll_parser = subparsers.add_parser("enroll", help="Name a speaker of an indexed recording")
+    enroll_parser.add_argument("--name", required=True, help="Speaker name")
+    enroll_parser.add_argument("--recording", required=True, help="Recording (audio file name without extension)")
+    enroll_parser.add_argument("--speaker", required=True, help="Label in the diarization output, e.g. speaker_1")
+    unenroll_parser = subparsers.add_parser("unenroll", help="Forget a speaker name")
+    unenroll_parser.add_argument("--name", required=True)
+    relabel_parser = subparsers.add_parser("relabel", help="Replace speaker_N labels with enrolled names")
+    relabel_parser.add_argument("--results_dir", type=Path, default=Path("results"))
+    relabel_parser.add_argument("--threshold", type=float, default=SPEAKER_MATCH_THRESHOLD,
+                                help="Minimum cosine similarity to an enrolled speaker")
+    args = parser.parse_args()
+
+    index = SpeakerIndex(args.index_dir)
+    if args.command == "enroll":
+        index.enroll(args.name, args.recording, args.speaker)
+    elif args.command == "unenroll":
+        index.unenroll(args.name)
+    elif args.command == "relabel":
+        relabeled = relabel_results(index, args.results_dir, args.threshold)
+        for name, mapping in relabeled.items():
+            print(f"✅ {name}: " + ", ".join(f"{label} → {person}" for label, person in sorted(mapping.items())))
+        print(f"Файлов с новыми именами: {len(relabeled)}")
+        return
+    print(json.dumps(index.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    if sys.platform == "win32":
+        import io
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:%(message)s")
+    main()
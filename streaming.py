@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Потоковое распознавание с онлайн-диаризацией: звук приходит кусками, сегменты — с ограниченной задержкой.
+
+Сессия получает 16 кГц моно отсчёты по мере поступления. Инкрементальный
+энергетический VAD с адаптивной оценкой шума открывает сегмент на речи и
+закрывает его после паузы endpoint_sec или по достижении max_segment_sec. Пока
+сегмент открыт, каждые partial_sec нового звука распознаётся весь открытый
+сегмент — промежуточная гипотеза (partial); длина сегмента ограничена, поэтому
+ограничена и стоимость шага. Закрытый сегмент распознаётся окончательно (final)
+и получает спикера: эмбеддинг сегмента сравнивается с текущими центроидами
+спикеров сессии (block_diarization.SpeakerLinker) — ближе link_threshold к
+известному спикеру или новый спикер.
+
+Задержка final не больше endpoint_sec (или max_segment_sec при непрерывной речи)
+плюс время распознавания сегмента; partial — не больше partial_sec плюс время
+шага. Параметры — раздел streaming конфигурации диаризатора.
+"""
+import logging
+from typing import NamedTuple
+
+import numpy as np
+
+from block_diarization import BlockPlan, SpeakerLinker
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+
+class StreamPlan(NamedTuple):
+    frame_sec: float = 0.03  # Кадр VAD
+    speech_rms: float = 0.01  # Минимальная энергия кадра речи
+    noise_ratio: float = 3.0  # Кадр речи громче текущей оценки шума во столько раз
+    pre_roll_sec: float = 0.2  # Звук перед началом речи, который попадает в сегмент
+    endpoint_sec: float = 0.6  # Пауза, закрывающая сегмент
+    partial_sec: float = 0.5  # Как часто распознаётся открытый сегмент
+    max_segment_sec: float = 15.0  # Сегмент длиннее закрывается, даже если речь продолжается
+    min_speech_sec: float = 0.2  # Сегмент с меньшим объёмом речи отбрасывается (щелчки, шорохи)
+    min_embed_sec: float = 1.0  # Более коротким сегментам спикер не определяется по эмбеддингу
+    link_threshold: float = 0.6  # Косинус, начиная с которого сегмент относится к известному спикеру
+    min_speaker_sec: float = 1.5  # Сегмент короче не заводит нового спикера, а относится к ближайшему
+
+
+def load_stream_plan(config) -> StreamPlan:
+    """Параметры из раздела streaming конфигурации (OmegaConf)."""
+    section = config.get("streaming") or {}
+    return StreamPlan(**{name: float(section[name]) for name in StreamPlan._fields if name in section})
+
+
+class EnergyVad:
+    """Покадровый VAD: речь — кадр громче speech_rms и noise_ratio × оценка шума.
+
+    Оценка шума быстро опускается к тихим кадрам и медленно (за минуту) поднимается
+    к громким: так речь её почти не сдвигает, а постоянный фон, поднявшийся выше
+    порога, со временем перестаёт считаться речью.
+    """
+
+    def __init__(self, plan: StreamPlan = StreamPlan()):
+        self.plan = plan
+        self.noise = plan.speech_rms / plan.noise_ratio
+
+    def is_speech(self, frame: np.ndarray) -> bool:
+        rms = float(np.sqrt(np.mean(frame ** 2)))
+        speech = rms > max(self.plan.speech_rms, self.plan.noise_ratio * self.noise)
+        self.noise += (0.1 if rms < self.noise else 0.0005) * (rms - self.noise)
+        return speech
+
+
+class StreamSession:
+    """Состояние одного потока: VAD, открытый сегмент и спикеры.
+
+    transcribe(samples) → текст (main.transcribe_chunk с выбранной моделью),
+    embed(pieces) → эмбеддинги спикера по фрагментам (main.embed_speech); без
+    embed сегменты идут без спикеров. feed() и finish() возвращают события
+    {"event": "partial" | "final", "segment", "start", "end", "speaker", "text"};
+    партиалы сегмента заменяют друг друга, final завершает его.
+    """
+
+    def __init__(self, transcribe, embed=None, plan: StreamPlan = StreamPlan()):
+        self.transcribe = transcribe
+        self.embed = embed
+        self.plan = plan
+        self.vad = EnergyVad(plan)
+        self.linker = SpeakerLinker(BlockPlan(link_threshold=plan.link_threshold,
+                                              min_speaker_sec=plan.min_speaker_sec)) if embed is not None else None
+        self._frame = int(plan.frame_sec * SAMPLE_RATE)
+        self._pending = np.zeros(0, dtype=np.float32)  # Хвост короче кадра
+        self._pre_roll = np.zeros(0, dtype=np.float32)
+        self._position = 0  # Отсчётов обработано VAD
+        self._segment = []  # Кадры открытого сегмента
+        self._start = None  # Начало открытого сегмента в отсчётах; None — сегмент не открыт
+        self._length = 0
+        self._speech = 0
+        self._silence = 0  # Тишина в конце открытого сегмента
+        self._partial_at = 0  # Длина сегмента при последнем partial
+        self._segments = 0
+        self._last_speaker = None
+        self.stats = {"audio_sec": 0.0, "partials": 0, "finals": 0, "dropped": 0}
+
+    def feed(self, samples) -> list:
+        """Принимает очередной кусок отсчётов (float32 в [-1, 1]); возвращает готовые события."""
+        samples = np.concatenate((self._pending, np.asarray(samples, dtype=np.float32)))
+        usable = len(samples) // self._frame * self._frame
+        self._pending = samples[usable:]
+        self.stats["audio_sec"] += usable / SAMPLE_RATE
+        events = []
+        for offset in range(0, usable, self._frame):
+            frame = samples[offset:offset + self._frame]
+            speech = self.vad.is_speech(frame)
+            self._position += len(frame)
+            if self._start is None:
+                if speech:
+                    self._open(frame)
+                else:
+                    self._pre_roll = np.concatenate((self._pre_roll, frame))[-int(self.plan.pre_roll_sec * SAMPLE_RATE):]
+                continue
+            self._segment.append(frame)
+            self._length += len(frame)
+            if speech:
+                self._speech += len(frame)
+                self._silence = 0
+            else:
+                self._silence += len(frame)
+            if (self._silence >= self.plan.endpoint_sec * SAMPLE_RATE
+                    or self._length >= self.plan.max_segment_sec * SAMPLE_RATE):
+                events.extend(self._close())
+        # Одна промежуточная гипотеза на вызов: если поток отстаёт, распознаётся сразу всё накопленное
+        if self._start is not None and self._length - self._partial_at >= self.plan.partial_sec * SAMPLE_RATE:
+            events.append(self._partial())
+        return events
+
+    def finish(self) -> list:
+        """Конец потока: закрывает открытый сегмент."""
+        if self._start is not None and len(self._pending):
+            self._segment.append(self._pending)
+            self._length += len(self._pending)
+        self._pending = np.zeros(0, dtype=np.float32)
+        return self._close() if self._start is not None else []
+
+    def _open(self, frame: np.ndarray):
+        self._segment = [self._pre_roll, frame]
+        self._start = self._position - len(frame) - len(self._pre_roll)
+        self._length = len(self._pre_roll) + len(frame)
+        self._speech = len(frame)
+        self._silence = 0
+        self._partial_at = 0
+        self._pre_roll = np.zeros(0, dtype=np.float32)
+
+    def _event(self, kind: str, audio: np.ndarray, speaker: str) -> dict:
+        return {"event": kind, "segment": self._segments, "start": self._start / SAMPLE_RATE,
+                "end": (self._start + len(audio)) / SAMPLE_RATE, "speaker": speaker, "text": self.transcribe(audio)}
+
+    def _partial(self) -> dict:
+        audio = np.concatenate(self._segment)
+        self._partial_at = self._length
+        speaker = None
+        if self.linker is not None and len(audio) >= self.plan.min_embed_sec * SAMPLE_RATE:
+            speaker = self.linker.nearest(self._embedding(audio))
+        self.stats["partials"] += 1
+        return self._event("partial", audio, speaker)
+
+    def _close(self) -> list:
+        # Хвостовая тишина не распознаётся, но остаётся предзвуком следующего сегмента
+        audio = np.concatenate(self._segment)
+        tail = audio[len(audio) - self._silence:]
+        audio = audio[:len(audio) - self._silence]
+        events = []
+        if self._speech >= self.plan.min_speech_sec * SAMPLE_RATE or self._partial_at:
+            speaker = None
+            if self.linker is not None:
+                speaker = self._last_speaker
+                if len(audio) >= self.plan.min_embed_sec * SAMPLE_RATE:
+                    mapping = self.linker.link({"segment": (self._embedding(audio), len(audio) / SAMPLE_RATE)})
+                    speaker = mapping["segment"]
+                self._last_speaker = speaker
+            events.append(self._event("final", audio, speaker))
+            self._segments += 1
+            self.stats["finals"] += 1
+        else:
+            self.stats["dropped"] += 1
+        self._segment = []
+        self._start = None
+        self._pre_roll = tail[-int(self.plan.pre_roll_sec * SAMPLE_RATE):]
+        return events
+
+    def _embedding(self, audio: np.ndarray) -> np.ndarray:
+        vector = np.asarray(self.embed([audio])[0], dtype=np.float32)
+        return vector / (np.linalg.norm(vector) + 1e-9)
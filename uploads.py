@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""Докачиваемая загрузка аудио по частям с контрольными суммами.
+
+Каждая загрузка живёт в своей папке UPLOADS_DIR/<id>: состояние (meta.json) и
+файл data.part, в который части пишутся по своим смещениям в любом порядке.
+Состояние хранится на диске, поэтому после обрыва связи или перезапуска сервера
+клиент запрашивает список недостающих частей и дозагружает только их. Как только
+файл получен целиком, он переносится в папку аудио и сразу отправляется на
+декодирование в 16 кГц WAV в пуле процессов — пока догружаются остальные файлы.
+Если в папке аудио уже есть файл с таким именем, к имени добавляется начало id
+загрузки. client — id клиента (браузера): clear() удаляет только его загрузки.
+"""
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from audio_io import timed_decode
+from metrics import record
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIR = Path(os.environ.get("UPLOADS_DIR", "uploads"))
+CHUNK_SIZE = 8 * 2 ** 20  # Размер части по умолчанию
+MAX_CHUNK_SIZE = 64 * 2 ** 20
+UPLOAD_DECODE_WORKERS = int(os.environ.get("UPLOAD_DECODE_WORKERS", "2"))
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg")
+META_NAME = "meta.json"
+DATA_NAME = "data.part"
+
+
+class UploadError(ValueError):
+    """Некорректный запрос к загрузке (размер, номер части, контрольная сумма)."""
+
+
+class Upload:
+    """Состояние одной загрузки: принятые части и статус.
+
+    Статусы: uploading → decoding → ready (или failed, если не сошлась сумма файла
+    или не удалось декодирование).
+    """
+
+    def __init__(self, upload_id: str, filename: str, size: int, chunk_size: int, sha256: str = None,
+                 received: list = (), status: str = "uploading", audio_path: str = None, wav_path: str = None,
+                 error: str = None, client: str = None):
+        self.id = upload_id
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+        self.sha256 = sha256
+        self.received = set(received)
+        self.status = status
+        self.audio_path = Path(audio_path) if audio_path else None
+        self.wav_path = Path(wav_path) if wav_path else None
+        self.error = error
+        self.client = client
+        self.lock = threading.Lock()
+        self.finished = threading.Event()  # Декодирование завершилось (ready или failed)
+        if status in ("ready", "failed"):
+            self.finished.set()
+
+    @property
+    def chunks(self) -> int:
+        return max(1, -(-self.size // self.chunk_size))
+
+    @property
+    def missing(self) -> list:
+        return [index for index in range(self.chunks) if index not in self.received]
+
+    def chunk_length(self, index: int) -> int:
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "audio_file": self.audio_path.name if self.audio_path else None,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "chunks": self.chunks,
+            "received": len(self.received),
+            "missing": self.missing,
+            "status": self.status,
+            "error": self.error,
+        }
+
+    def _meta(self) -> dict:
+        return {
+            "id": self.id, "filename": self.filename, "size": self.size, "chunk_size": self.chunk_size,
+            "sha256": self.sha256, "received": sorted(self.received), "status": self.status,
+            "audio_path": str(self.audio_path) if self.audio_path else None,
+            "wav_path": str(self.wav_path) if self.wav_path else None, "error": self.error,
+            "client": self.client,
+        }
+
+
+class UploadManager:
+    """Создаёт загрузки, принимает части и запускает декодирование готовых файлов."""
+
+    def __init__(self, audio_dir: Path, root: Path = UPLOADS_DIR, decode_workers: int = UPLOAD_DECODE_WORKERS):
+        self.audio_dir = audio_dir
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.decode_workers = max(1, decode_workers)
+        self._uploads = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def create(self, filename: str, size: int, chunk_size: int = CHUNK_SIZE, sha256: str = None,
+               client: str = None) -> Upload:
+        # Только имя файла: путь от клиента не должен выводить за пределы папки аудио
+        filename = Path(filename or "").name
+        if not filename or Path(filename).suffix.lower() not in AUDIO_EXTENSIONS:
+            raise UploadError(f"Неподдерживаемый файл '{filename}'. Допустимы: {', '.join(AUDIO_EXTENSIONS)}")
+        if size <= 0:
+            raise UploadError("Размер файла должен быть положительным")
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise UploadError(f"Размер части должен быть от 1 байта до {MAX_CHUNK_SIZE} байт")
+        if client is not None and not (0 < len(client) <= 64 and client.replace("-", "").isalnum()):
+            raise UploadError("Некорректный id клиента")
+
+        upload = Upload(uuid.uuid4().hex, filename, size, chunk_size, sha256.lower() if sha256 else None,
+                        client=client)
+        upload_dir = self.root / upload.id
+        upload_dir.mkdir(parents=True)
+        with open(upload_dir / DATA_NAME, "wb") as f:
+            f.truncate(size)
+        self._save(upload)
+        with self._lock:
+            self._uploads[upload.id] = upload
+        logger.info(f"📥 Новая загрузка {upload.id}: {filename}, {size} байт, частей {upload.chunks}")
+        return upload
+
+    def add(self, filename: str, stream, client: str = None) -> Upload:
+        """Загрузка одним запросом (/upload): файл из stream принимается целиком и ставится на декодирование."""
+        tmp_path = self.root / f".{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(stream, f)
+            upload = self.create(filename, tmp_path.stat().st_size, MAX_CHUNK_SIZE, client=client)
+            os.replace(tmp_path, self.root / upload.id / DATA_NAME)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        with upload.lock:
+            upload.received = set(range(upload.chunks))
+            upload.status = "decoding"
+            self._save(upload)
+        self._complete(upload)
+        return upload
+
+    def get(self, upload_id: str) -> Upload:
+        """Загрузка по id; после перезапуска сервера состояние читается с диска. None, если такой нет."""
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is not None:
+                return upload
+            upload = self._read(upload_id)
+            if upload is None:
+                return None
+            self._uploads[upload_id] = upload
+        if upload.status == "uploading" and not upload.missing:
+            upload.status = "decoding"
+        if upload.status == "decoding":
+            # Завершение или декодирование прервалось вместе с прошлым процессом сервера
+            if upload.audio_path is not None and upload.audio_path.exists():
+                self._decode(upload)
+            else:
+                self._complete(upload)
+        return upload
+
+    def _read(self, upload_id: str) -> Upload:
+        if not upload_id.isalnum():
+            return None
+        try:
+            with open(self.root / upload_id / META_NAME, "r", encoding="utf-8") as f:
+                return Upload(upload_id=upload_id, **{k: v for k, v in json.load(f).items() if k != "id"})
+        except (OSError, ValueError):
+            return None
+
+    def write_chunk(self, upload: Upload, index: int, data: bytes, sha256: str = None) -> Upload:
+        """Записывает часть на её место в файле. Повторная отправка уже принятой части безвредна."""
+        if not 0 <= index < upload.chunks:
+            raise UploadError(f"Номер части {index} вне диапазона 0..{upload.chunks - 1}")
+        if len(data) != upload.chunk_length(index):
+            raise UploadError(f"Часть {index}: ожидалось {upload.chunk_length(index)} байт, получено {len(data)}")
+        if sha256 is not None and hashlib.sha256(data).hexdigest() != sha256.lower():
+            raise UploadError(f"Часть {index}: контрольная сумма не совпадает")
+        if upload.status != "uploading":
+            return upload
+
+        with open(self.root / upload.id / DATA_NAME, "r+b") as f:
+            f.seek(index * upload.chunk_size)
+            f.write(data)
+        with upload.lock:
+            upload.received.add(index)
+            self._save(upload)
+            complete = upload.status == "uploading" and not upload.missing
+            if complete:
+                upload.status = "decoding"
+        if complete:
+            self._complete(upload)
+        return upload
+
+    def _complete(self, upload: Upload):
+        """Проверяет файл целиком, переносит его в папку аудио и ставит на декодирование."""
+        upload_dir = self.root / upload.id
+        if upload.sha256 is not None and _file_sha256(upload_dir / DATA_NAME) != upload.sha256:
+            # Все части сошлись, а файл нет — клиент прислал не тот файл, загрузку нужно начать заново
+            self._fail(upload, "Контрольная сумма файла не совпадает")
+            return
+        with self._lock:
+            # Одноимённый файл другой загрузки не перезаписывается
+            audio_path = self.audio_dir / upload.filename
+            if audio_path.exists():
+                audio_path = audio_path.with_name(f"{audio_path.stem}_{upload.id[:8]}{audio_path.suffix}")
+            upload.audio_path = audio_path
+            os.replace(upload_dir / DATA_NAME, upload.audio_path)
+        self._save(upload)
+        logger.info(f"✅ Загрузка {upload.id} завершена: {upload.audio_path}")
+        self._decode(upload)
+
+    def _decode(self, upload: Upload):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.decode_workers)
+            future = self._pool.submit(timed_decode, upload.audio_path)
+        future.add_done_callback(lambda done: self._decoded(upload, done))
+
+    def _decoded(self, upload: Upload, future):
+        try:
+            wav_path, seconds = future.result()
+        except Exception as e:
+            logger.error(f"❌ Ошибка декодирования {upload.filename}: {e}")
+            self._fail(upload, f"Ошибка декодирования: {e}")
+            return
+        record("decode", seconds)
+        upload.wav_path = wav_path
+        upload.status = "ready"
+        self._save(upload)
+        upload.finished.set()
+        logger.info(f"🎧 {upload.filename} декодирован за {seconds:.1f} с")
+
+    def _fail(self, upload: Upload, message: str):
+        upload.status = "failed"
+        upload.error = message
+        self._save(upload)
+        upload.finished.set()
+
+    def _save(self, upload: Upload):
+        path = self.root / upload.id / META_NAME
+        if not path.parent.is_dir():
+            return  # Загрузку удалили (clear), пока шло декодирование
+        tmp_path = path.with_name(f".{META_NAME}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(upload._meta(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def clear(self, client: str = None):
+        """Удаляет загрузки клиента client (и их файлы в папке аудио); загрузки других клиентов не трогаются."""
+        for upload_dir in list(self.root.iterdir()):
+            with self._lock:
+                upload = self._uploads.get(upload_dir.name) or self._read(upload_dir.name)
+                if upload is None or upload.client != client:
+                    continue
+                self._uploads.pop(upload.id, None)
+                for path in (upload.audio_path, upload.wav_path):
+                    if path is not None and path.parent == self.audio_dir and path.exists():
+                        path.unlink()
+                shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+def _file_sha256(path: Path, block: int = 2 ** 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(block), b""):
+            digest.update(data)
+    return digest.hexdigest()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""Долгоживущий воркер инференса: модели загружаются один раз и остаются в памяти."""
+import time
+import uuid
+import queue
+import threading
+import logging
+from collections import OrderedDict, deque
+from pathlib import Path
+
+import registry
+
+_import_started = time.perf_counter()
+from main import (DIARIZER_CONFIG, RESULTS_DIR, convert_to_wav, get_device, load_asr_model, load_diarizer,
+                  process_file, recluster, release_cuda_cache, restore_cached, result_cache_key)
+from metrics import job_report, JobReport, FILES, QUEUE_DEPTH
+from cache import ResultCache
+from audio_io import open_shared_audio
+from model_cache import ModelCache, DIARIZER_KEY, asr_key, key_for
+from speaker_index import SpeakerIndex
+IMPORT_TIME = time.perf_counter() - _import_started
+
+logger = logging.getLogger(__name__)
+
+JOB_HISTORY = 100  # Сколько заданий хранить для GET /jobs/<id>
+STATS_HISTORY = 1000  # Сколько последних запусков каждого вида учитывать в stats()
+
+
+class Job:
+    """Задание на обработку набора аудиофайлов с заданными параметрами.
+
+    Прогресс накапливается в списке событий; потребители (SSE-поток) ждут новые
+    события через wait_events(). recluster — задание повторной кластеризации из
+    кэша признаков: {"overrides": {...}, "num_speakers": n} (см. main.recluster).
+    vad_gate — без диаризации распознавать только участки речи (main.transcribe_gated).
+    audio_files — файлы задания (сервер передаёт загрузки клиента, а не всю папку аудио).
+    """
+
+    def __init__(self, language: str, model_type: str, model_name: str, diarization: bool,
+                 single_pass: bool = False, audio_files: list = None, results_dir: Path = RESULTS_DIR,
+                 recluster: dict = None, vad_gate: bool = False):
+        self.id = uuid.uuid4().hex
+        self.language = language
+        self.model_type = model_type
+        self.model_name = model_name
+        self.diarization = diarization
+        self.single_pass = single_pass
+        self.recluster = recluster
+        self.vad_gate = vad_gate
+        self.audio_files = list(audio_files or [])
+        self.results_dir = results_dir
+        self.status = "queued"
+        self.result_files = []
+        self.errors = []
+        self.timings = {}
+        self.submitted_at = time.perf_counter()
+        self.cold = False
+        self.report = JobReport(self.id)
+        self.done = threading.Event()
+        self.events = []
+        self._events_changed = threading.Condition()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self.done.wait(timeout)
+
+    def emit(self, event: str, **data):
+        """Добавляет событие прогресса и будит ожидающих потребителей."""
+        with self._events_changed:
+            self.events.append({"id": len(self.events), "event": event, **data})
+            self._events_changed.notify_all()
+
+    def wait_events(self, after: int, timeout: float = None) -> list:
+        """Возвращает события с номерами больше after, при необходимости дожидаясь их."""
+        with self._events_changed:
+            self._events_changed.wait_for(lambda: len(self.events) > after + 1 or self.done.is_set(), timeout)
+            return self.events[after + 1:]
+
+    def finish(self):
+        with self._events_changed:
+            self.done.set()
+            self._events_changed.notify_all()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "language": self.language,
+            "model_type": self.model_type,
+            "model_name": self.model_name,
+            "diarization": self.diarization,
+            "recluster": self.recluster,
+            "vad_gate": self.vad_gate,
+            "files": [f.name for f in self.audio_files],
+            "result_files": [f.name for f in self.result_files],
+            "errors": self.errors,
+            "timings": self.timings,
+            "stages": self.report.to_dict()["stages"],
+            "events": len(self.events),
+        }
+
+
+class InferenceWorker:
+    """Потоки, которые берут задания из ограниченной очереди и обрабатывают их резидентными моделями.
+
+    max_queue ограничивает число ожидающих заданий (submit(block=False) бросает
+    queue.Full), concurrency — число заданий, обрабатываемых одновременно. При
+    timing_report тайминги стадий задания пишутся в timings.json рядом с результатами.
+    Задания, которые делят одну модель ASR, вызывают её transcribe() по очереди (main.model_lock).
+    Модели ASR и диаризатор держатся в models (model_cache.ModelCache): переключение
+    между резидентными моделями не требует загрузки. С speaker_index спикеры
+    диаризованных файлов сохраняются в индекс спикеров (main.index_speakers).
+    """
+
+    def __init__(self, max_queue: int = 0, concurrency: int = 1, cache: ResultCache = None,
+                 timing_report: bool = False, models: ModelCache = None, speaker_index: SpeakerIndex = None):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.timing_report = timing_report
+        QUEUE_DEPTH.set_function(self._queue.qsize)
+        self.cache = cache if cache is not None else ResultCache()
+        self._models = models
+        self.speaker_index = speaker_index
+        self._stats_lock = threading.Lock()
+        self._stats = {"cold": deque(maxlen=STATS_HISTORY), "warm": deque(maxlen=STATS_HISTORY)}
+        self.jobs = OrderedDict()
+        self._threads = [threading.Thread(target=self._run, name=f"inference-worker-{i}", daemon=True)
+                         for i in range(max(1, concurrency))]
+
+    def start(self):
+        for thread in self._threads:
+            if not thread.is_alive():
+                thread.start()
+        logger.info(f"🧵 Воркер инференса запущен (потоков: {len(self._threads)})")
+
+    def submit(self, job: Job, block: bool = True) -> Job:
+        job.emit("queued", position=self._queue.qsize() + 1)
+        self._queue.put(job, block=block)
+        with self._stats_lock:
+            self.jobs[job.id] = job
+            # Забываем самые старые завершённые задания
+            while len(self.jobs) > JOB_HISTORY and next(iter(self.jobs.values())).done.is_set():
+                self.jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self._stats_lock:
+            return self.jobs.get(job_id)
+
+    @property
+    def models(self) -> ModelCache:
+        # Создаётся при первом обращении: устройство определяется импортом torch
+        if self._models is None:
+            with self._stats_lock:
+                if self._models is None:
+                    self._models = ModelCache(get_device(), release=release_cuda_cache)
+        return self._models
+
+    def get_asr_model(self, language: str, model_type: str, model_name: str):
+        return self.models.get(asr_key(language, model_type, model_name),
+                               lambda: load_asr_model(language, model_type, model_name))
+
+    def get_diarizer(self):
+        return self.models.get(DIARIZER_KEY, load_diarizer)
+
+    def preload(self, names: list, pin: list = ()):
+        """Закрепляет модели pin и заранее загружает names (имена из реестра или diarizer)."""
+        loaders = {}
+        for name in list(pin) + list(names):
+            try:
+                key = key_for(name)
+            except ValueError as e:
+                logger.error(f"❌ {e}")
+                continue
+            if name in pin:
+                self.models.pin(key)
+            if name not in names:
+                continue
+            if key == DIARIZER_KEY:
+                loaders[key] = load_diarizer
+            else:
+                info = registry.MODELS[name]
+                loaders[key] = lambda info=info: load_asr_model(info.language, info.decoder, info.name)
+        self.models.preload(loaders)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                with job_report(job.report):
+                    self._process(job)
+            except Exception as e:
+                logger.error(f"❌ Ошибка задания {job.id}: {e}")
+                job.errors.append(str(e))
+                job.status = "failed"
+            finally:
+                job.emit(job.status, result_files=[f.name for f in job.result_files], errors=job.errors)
+                job.finish()
+                self._queue.task_done()
+
+    def _process(self, job: Job):
+        started = time.perf_counter()
+        job.status = "running"
+        job.timings["queue_wait"] = started - job.submitted_at
+        job.timings["asr_model_load"] = 0.0
+        job.timings["diarizer_load"] = 0.0
+        job.emit("running", files=[f.name for f in job.audio_files])
+
+        # Модели запрашиваются только при первом промахе кэша
+        asr_model = None
+        diarizer = None
+        t_start = time.perf_counter()
+        job.results_dir.mkdir(parents=True, exist_ok=True)
+        for index, audio_file in enumerate(job.audio_files):
+            logger.info(f">> Обработка: {audio_file.name}")
+            job.emit("file_started", file=audio_file.name, index=index, total=len(job.audio_files))
+            try:
+                wav_path = convert_to_wav(audio_file)
+                if job.recluster is not None:
+                    # Результат кластеризации с новыми параметрами не кэшируется; VAD и эмбеддинги — из кэша.
+                    # Признаки ищутся до загрузки модели ASR: без них файл пропускается
+                    entry = None
+                    features = self.cache.lookup(self.cache.features_key(wav_path, DIARIZER_CONFIG))
+                    if features is None:
+                        raise LookupError(f"Нет сохранённых эмбеддингов для {audio_file.name}: "
+                                          "сначала выполните диаризацию с кэшем")
+                else:
+                    key = result_cache_key(self.cache, wav_path, job.language, job.model_type, job.model_name,
+                                           job.diarization, job.single_pass, vad_gate=job.vad_gate)
+                    entry = self.cache.lookup(key)
+                if entry is not None:
+                    files = restore_cached(entry, wav_path, job.diarization, job.results_dir, job.emit)
+                else:
+                    if asr_model is None:
+                        job.cold |= asr_key(job.language, job.model_type, job.model_name) not in self.models
+                        t0 = time.perf_counter()
+                        asr_model = self.get_asr_model(job.language, job.model_type, job.model_name)
+                        job.timings["asr_model_load"] = time.perf_counter() - t0
+                if job.recluster is not None:
+                    files = recluster(wav_path, asr_model, self.cache, job.recluster.get("overrides"),
+                                      job.recluster.get("num_speakers"), results_dir=job.results_dir,
+                                      progress=job.emit, audio_data=open_shared_audio(wav_path),
+                                      speaker_index=self.speaker_index, features=features)
+                elif entry is None:
+                    if (job.diarization or job.vad_gate) and diarizer is None:
+                        job.cold |= DIARIZER_KEY not in self.models
+                        t0 = time.perf_counter()
+                        diarizer = self.get_diarizer()
+                        job.timings["diarizer_load"] = time.perf_counter() - t0
+                    files = process_file(wav_path, asr_model, job.diarization, diarizer, single_pass=job.single_pass,
+                                         results_dir=job.results_dir, progress=job.emit,
+                                         cache=self.cache, cache_key=key, audio_data=open_shared_audio(wav_path),
+                                         vad_gate=job.vad_gate, speaker_index=self.speaker_index)
+                job.result_files.extend(files)
+                job.emit("file_done", file=audio_file.name, result_files=[f.name for f in files],
+                         cached=entry is not None)
+            except Exception as e:
+                logger.error(f"❌ Ошибка при обработке {audio_file.name}: {e}")
+                job.errors.append(f"{audio_file.name}: {e}")
+                job.emit("file_failed", file=audio_file.name, error=str(e))
+                FILES.inc(status="failed")
+        job.timings["inference"] = (time.perf_counter() - t_start
+                                    - job.timings["asr_model_load"] - job.timings["diarizer_load"])
+        job.timings["total"] = time.perf_counter() - started
+
+        job.status = "failed" if job.errors and not job.result_files else "done"
+        self._record(job)
+        if self.timing_report:
+            job.report.write(job.results_dir / "timings.json")
+
+    def _record(self, job: Job):
+        # Задание «холодное», если ему пришлось загружать хотя бы одну модель
+        loaded = job.timings["asr_model_load"] + job.timings["diarizer_load"]
+        kind = "cold" if job.cold else "warm"
+        with self._stats_lock:
+            self._stats[kind].append(dict(job.timings))
+        logger.info(f"⏱️ Задание {job.id} ({kind}): {job.timings['total']:.2f} с, "
+                    f"загрузка моделей {loaded:.2f} с")
+
+    def stats(self) -> dict:
+        """Возвращает сводку холодных и тёплых запусков для сравнения накладных расходов."""
+        with self._stats_lock:
+            summary = {"import_time": IMPORT_TIME, "queue_size": self._queue.qsize(),
+                       "concurrency": len(self._threads),
+                       "cache": self.cache.stats()}
+            if self._models is not None:
+                summary["models"] = self._models.stats()
+            for kind, runs in self._stats.items():
+                summary[kind] = {
+                    "count": len(runs),
+                    "mean_total": sum(r["total"] for r in runs) / len(runs) if runs else None,
+                    "mean_overhead": (sum(r["queue_wait"] + r["asr_model_load"] + r["diarizer_load"] for r in runs) / len(runs)
+                                      if runs else None),
+                    "last": runs[-1] if runs else None,
+                }
+        return summary